@@ -0,0 +1,210 @@
+"""Admission control and per-user fair scheduling for /api/detect.
+
+Without it, every upload waits for an inference slot in arrival order, so one
+user posting a batch of videos holds all the slots while everyone else's
+requests pile up behind them. Here every detection takes a ticket first:
+
+- at most ADMISSION_USER_CONCURRENCY detections of one user run at once (0:
+  half the slots), and at most ADMISSION_USER_QUEUE more wait; beyond that the
+  user gets 429
+- at most ADMISSION_QUEUE_SIZE detections wait in total; beyond that 503
+- free slots go to the waiting user with the smallest virtual finish time
+  (weighted fair queuing), so users share the slots in proportion to their
+  weight (ADMISSION_USER_WEIGHTS, e.g. "gate-north=2"), whatever their
+  arrival rate; a video counts as ADMISSION_VIDEO_COST images
+- a ticket that waits longer than ADMISSION_MAX_WAIT_SECONDS is shed with
+  503, and one whose client disconnects is dropped without running
+
+429 and 503 responses carry Retry-After, estimated from the recent service
+time and the work queued ahead. The scheduler runs on the event loop and is
+per worker; the slots are the worker's inference slots (thread_budget.py).
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+import metrics
+from config import settings
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """'gate-north=2,audit=0.5' -> {'gate-north': 2.0, 'audit': 0.5}"""
+    weights = {}
+    for part in value.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name and weight:
+            weights[name] = float(weight)
+    return weights
+
+
+class _UserQueue:
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.running = 0
+        self.waiting: Deque["Ticket"] = deque()
+        self.last_finish = 0.0
+
+
+class Ticket:
+    def __init__(self, scheduler: "AdmissionScheduler", user: str, cost: float, start: float, finish: float):
+        self.scheduler = scheduler
+        self.user = user
+        self.cost = cost
+        self.start = start
+        self.finish = finish
+        self.enqueued = time.monotonic()
+        self.granted: Optional[float] = None
+        self.released = False
+        self._future = asyncio.get_running_loop().create_future()
+
+    async def wait(self, is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+        """Until a slot is granted; raises Rejected on timeout, ClientDisconnected if the client left"""
+        deadline = self.enqueued + settings.ADMISSION_MAX_WAIT_SECONDS
+        while not self._future.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._future),
+                                       timeout=max(0.0, min(0.25, deadline - time.monotonic())))
+                break
+            except asyncio.TimeoutError:
+                pass
+            if is_disconnected is not None and not self._future.done() and await is_disconnected():
+                self.scheduler._drop(self, "cancelled")
+                raise ClientDisconnected()
+            if not self._future.done() and time.monotonic() >= deadline:
+                self.scheduler._drop(self, "timed_out")
+                raise Rejected(503, "Detection queue is too slow right now, try again later",
+                               self.scheduler.retry_after())
+        metrics.ADMISSION_WAIT_SECONDS.observe(self.granted - self.enqueued)
+
+    def release(self):
+        """Give the slot back (or leave the queue); safe to call more than once"""
+        if self.released:
+            return
+        self.released = True
+        if self.granted is not None:
+            self.scheduler._finished(self)
+        else:
+            self.scheduler._drop(self, "abandoned")
+
+
+class AdmissionScheduler:
+    def __init__(self, capacity: int = 1):
+        self.capacity = capacity
+        self.running = 0
+        self.queued = 0
+        self.virtual_time = 0.0
+        self.users: Dict[str, _UserQueue] = {}
+        self.weights = parse_weights(settings.ADMISSION_USER_WEIGHTS)
+        # Seconds per unit of cost, smoothed, for Retry-After
+        self._service_seconds = 1.0
+        self._queued_cost = 0.0
+        metrics.QUEUE_DEPTH.labels("detect").set_function(lambda: self.queued)
+
+    @property
+    def user_concurrency(self) -> int:
+        return settings.ADMISSION_USER_CONCURRENCY or max(1, self.capacity // 2)
+
+    def retry_after(self, extra_cost: float = 0.0) -> int:
+        """Seconds until the queued work (plus extra_cost) should have drained"""
+        seconds = (self._queued_cost + extra_cost) * self._service_seconds / max(1, self.capacity)
+        return max(1, math.ceil(seconds))
+
+    def enqueue(self, user: str, cost: float = 1.0) -> Ticket:
+        """Take a place in the queue, or raise Rejected straight away"""
+        queue = self.users.get(user)
+        if queue is None:
+            queue = self.users[user] = _UserQueue(self.weights.get(user, 1.0))
+        if len(queue.waiting) >= settings.ADMISSION_USER_QUEUE:
+            metrics.ADMISSION_DECISIONS.labels("rejected_user").inc()
+            # This user's own backlog has to clear first
+            own = sum(ticket.cost for ticket in queue.waiting)
+            raise Rejected(429, "Too many detections in progress for this user",
+                           max(1, math.ceil(own * self._service_seconds / self.user_concurrency)))
+        if self.queued >= settings.ADMISSION_QUEUE_SIZE:
+            metrics.ADMISSION_DECISIONS.labels("rejected_full").inc()
+            raise Rejected(503, "Detection queue is full, try again later", self.retry_after(cost))
+
+        start = max(self.virtual_time, queue.last_finish)
+        queue.last_finish = start + cost / queue.weight
+        ticket = Ticket(self, user, cost, start, queue.last_finish)
+        queue.waiting.append(ticket)
+        self.queued += 1
+        self._queued_cost += cost
+        self._dispatch()
+        return ticket
+
+    def _dispatch(self):
+        while self.running < self.capacity:
+            candidates = [queue for queue in self.users.values()
+                          if queue.waiting and queue.running < self.user_concurrency]
+            if not candidates:
+                return
+            queue = min(candidates, key=lambda q: q.waiting[0].finish)
+            ticket = queue.waiting.popleft()
+            self.queued -= 1
+            self._queued_cost -= ticket.cost
+            self.running += 1
+            queue.running += 1
+            self.virtual_time = max(self.virtual_time, ticket.start)
+            ticket.granted = time.monotonic()
+            ticket._future.set_result(True)
+            metrics.ADMISSION_DECISIONS.labels("admitted").inc()
+
+    def _finished(self, ticket: Ticket):
+        queue = self.users[ticket.user]
+        queue.running -= 1
+        self.running -= 1
+        elapsed = time.monotonic() - ticket.granted
+        self._service_seconds = 0.8 * self._service_seconds + 0.2 * elapsed / max(ticket.cost, 1e-9)
+        self._forget_idle(ticket.user)
+        self._dispatch()
+
+    def _drop(self, ticket: Ticket, outcome: str):
+        if ticket.granted is not None:
+            return
+        queue = self.users.get(ticket.user)
+        if queue is not None and ticket in queue.waiting:
+            queue.waiting.remove(ticket)
+            self.queued -= 1
+            self._queued_cost -= ticket.cost
+            metrics.ADMISSION_DECISIONS.labels(outcome).inc()
+            self._forget_idle(ticket.user)
+        ticket.released = True
+
+    def _forget_idle(self, user: str):
+        # Kept while its finish tag is ahead, so leaving and rejoining doesn't reset a user's share
+        queue = self.users.get(user)
+        if queue is not None and not queue.running and not queue.waiting and queue.last_finish <= self.virtual_time:
+            del self.users[user]
+
+    def busy(self) -> bool:
+        """Every slot taken or detections waiting"""
+        return self.running >= self.capacity or self.queued > 0
+
+    def summary(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "user_concurrency": self.user_concurrency,
+            "running": self.running,
+            "queued": self.queued,
+            "queue_size": settings.ADMISSION_QUEUE_SIZE,
+            "estimated_wait_seconds": self.retry_after() if self.queued else 0,
+            "users": {
+                user: {"weight": queue.weight, "running": queue.running, "queued": len(queue.waiting)}
+                for user, queue in self.users.items() if queue.running or queue.waiting
+            },
+        }
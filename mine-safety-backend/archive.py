@@ -0,0 +1,446 @@
+"""Retention and cold archival of old detections and their evidence files.
+
+Detections older than ARCHIVE_AFTER_DAYS are moved, a batch at a time, from the
+live detections table into detection_archive (monthly partitions on
+PostgreSQL). Their upload files are packed into gzip-compressed tar bundles
+under ARCHIVE_DIR/bundles: each file is stored once under its SHA-256, and each
+bundle is named after the SHA-256 of its own contents. Archived rows and files
+stay reachable through /api/detections?archived=true and
+/api/detections/{id}/file.
+
+Archived rows older than ARCHIVE_RETENTION_DAYS are deleted, together with the
+bundles no archived row references any more.
+
+Run a pass manually with:
+    python archive.py run [--days N]
+    python archive.py purge [--days N]
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import os
+import re
+import tarfile
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, single-process deployments only
+    fcntl = None
+
+from sqlalchemy import delete, insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import http_cache
+import models
+import stats
+from config import settings
+from database import AsyncSessionLocal, AsyncWriteSessionLocal
+
+UPLOAD_DIR = Path("uploads")
+BUNDLE_DIR = Path(settings.ARCHIVE_DIR) / "bundles"
+# Unreferenced bundles younger than this are kept: an archive pass may be about to use them
+BUNDLE_GRACE_SECONDS = 3600
+
+_DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_PARTITION_PATTERN = re.compile(r"^detection_archive_(\d{4})_(\d{2})$")
+# Columns copied verbatim from detections into detection_archive
+_COPIED_COLUMNS = [column.name for column in models.Detection.__table__.columns]
+
+
+def _month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month: datetime) -> datetime:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def _is_postgresql(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def ensure_partitions(db: Session, months: Iterable[datetime]):
+    """Create the monthly partitions archived rows are about to land in (PostgreSQL only)"""
+    if not _is_postgresql(db):
+        return
+    for month in sorted(set(months)):
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS detection_archive_{month.year:04d}_{month.month:02d} "
+            f"PARTITION OF detection_archive "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_next_month(month):%Y-%m-%d}')"
+        ))
+
+
+def file_digest(path: Path) -> Optional[str]:
+    """SHA-256 of a file's contents, or None if it cannot be read"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as source:
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def bundle_path(bundle: str) -> Path:
+    if not _DIGEST_PATTERN.match(bundle or ""):
+        raise ValueError(f"Invalid bundle name: {bundle!r}")
+    return BUNDLE_DIR / f"{bundle}.tar.gz"
+
+
+def write_bundle(files: Dict[str, Path]) -> str:
+    """Pack files (keyed by their digest) into a bundle and return the bundle's name.
+
+    Members, timestamps and ordering are fixed, so the same files always produce
+    the same bundle and a repeated pass reuses the existing file.
+    """
+    BUNDLE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=BUNDLE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, \
+                gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as compressed, \
+                tarfile.open(fileobj=compressed, mode="w") as tar:
+            for digest in sorted(files):
+                with open(files[digest], "rb") as source:
+                    info = tarfile.TarInfo(digest)
+                    info.size = os.fstat(source.fileno()).st_size
+                    info.mode = 0o644
+                    tar.addfile(info, source)
+
+        bundle = file_digest(Path(temp_path))
+        if bundle_path(bundle).exists():
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, bundle_path(bundle))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return bundle
+
+
+def read_archived_file(bundle: str, digest: str) -> bytes:
+    """Extract one archived evidence file from its bundle"""
+    with tarfile.open(bundle_path(bundle), mode="r:gz") as tar:
+        return tar.extractfile(digest).read()
+
+
+def _select_candidates(db: Session, cutoff: datetime, limit: int):
+    return db.execute(
+        select(models.Detection.__table__)
+        .where(models.Detection.created_at < cutoff)
+        .order_by(models.Detection.created_at, models.Detection.id)
+        .limit(limit)
+    ).all()
+
+
+def _evidence_file(row) -> Optional[Path]:
+    """The row's upload, unless it is gone or was written after the row was.
+
+    Uploads used to be named after the user and file name, so an older row's
+    path may now hold a later upload's image.
+    """
+    if not row.file_path:
+        return None
+    path = Path(row.file_path)
+    try:
+        modified = datetime.utcfromtimestamp(path.stat().st_mtime)
+    except OSError:
+        return None
+    if row.created_at is not None and modified > row.created_at:
+        print(f"❌ {path} was overwritten after detection {row.id}, archiving it without its file")
+        return None
+    return path
+
+
+def _digest_files(rows) -> Tuple[Dict[int, str], Dict[str, Path]]:
+    """Hash the evidence file of each row; rows whose file is gone are left out"""
+    digests, files = {}, {}
+    for row in rows:
+        path = _evidence_file(row)
+        if path is None:
+            continue
+        digest = file_digest(path)
+        if digest is not None:
+            digests[row.id] = digest
+            files.setdefault(digest, path)
+    return digests, files
+
+
+def _known_bundles(db: Session, digests: List[str]) -> Dict[str, str]:
+    """Bundles already holding some of these files, so they are not stored twice"""
+    if not digests:
+        return {}
+    return dict(db.execute(
+        select(models.ArchivedDetection.file_sha256, models.ArchivedDetection.bundle)
+        .where(
+            models.ArchivedDetection.file_sha256.in_(digests),
+            models.ArchivedDetection.bundle.isnot(None)
+        )
+        .distinct()
+    ).all())
+
+
+def _move_rows(db: Session, rows, refs: Dict[int, Tuple[str, str]]) -> Set[int]:
+    """Copy rows into the archive and delete them (and their items) from the live tables"""
+    ensure_partitions(db, [_month_start(row.created_at) for row in rows])
+    archived_at = datetime.utcnow()
+    db.execute(insert(models.ArchivedDetection), [
+        {
+            **{column: getattr(row, column) for column in _COPIED_COLUMNS},
+            "file_sha256": refs.get(row.id, (None, None))[0],
+            "bundle": refs.get(row.id, (None, None))[1],
+            "archived_at": archived_at
+        }
+        for row in rows
+    ])
+
+    ids = [row.id for row in rows]
+    db.execute(
+        delete(models.DetectionItem).where(models.DetectionItem.detection_id.in_(ids)),
+        execution_options={"synchronize_session": False}
+    )
+    db.execute(
+        delete(models.Detection).where(models.Detection.id.in_(ids)),
+        execution_options={"synchronize_session": False}
+    )
+
+    # Counters and rollups keep lifetime totals; only the history listing changes
+    user_ids = {row.user_id for row in rows if row.user_id is not None}
+    stats.bump_versions(db, user_ids)
+    return user_ids
+
+
+def _unreferenced_paths(db: Session, paths: List[str]) -> List[str]:
+    """Upload paths no live detection points at any more (older uploads may share a path)"""
+    if not paths:
+        return []
+    live = set(db.scalars(
+        select(models.Detection.file_path).where(models.Detection.file_path.in_(paths))
+    ))
+    return [path for path in paths if path not in live]
+
+
+def _remove_uploads(paths: List[str]):
+    root = UPLOAD_DIR.resolve()
+    for path in paths:
+        resolved = Path(path).resolve()
+        if root not in resolved.parents:
+            continue
+        try:
+            resolved.unlink()
+        except FileNotFoundError:
+            pass
+
+
+async def archive_batch(cutoff: datetime, batch_size: int) -> int:
+    """Archive up to batch_size of the oldest detections created before cutoff"""
+    async with AsyncSessionLocal() as db:
+        rows = await db.run_sync(_select_candidates, cutoff, batch_size)
+    if not rows:
+        return 0
+
+    # Hashing and compression are blocking; keep them off the event loop and
+    # outside the write transaction
+    digests, files = await asyncio.to_thread(_digest_files, rows)
+    async with AsyncSessionLocal() as db:
+        bundles = await db.run_sync(_known_bundles, list(files))
+    new_files = {digest: path for digest, path in files.items() if digest not in bundles}
+    if new_files:
+        bundle = await asyncio.to_thread(write_bundle, new_files)
+        bundles.update(dict.fromkeys(new_files, bundle))
+    refs = {detection_id: (digest, bundles[digest]) for detection_id, digest in digests.items()}
+
+    try:
+        async with AsyncWriteSessionLocal() as db:
+            user_ids = await db.run_sync(_move_rows, rows, refs)
+            await db.commit()
+    except IntegrityError:
+        # Another worker archived the same rows first
+        return 0
+    for user_id in user_ids:
+        http_cache.invalidate_user(user_id)
+
+    archived_paths = sorted({row.file_path for row in rows if row.id in digests})
+    async with AsyncSessionLocal() as db:
+        orphaned = await db.run_sync(_unreferenced_paths, archived_paths)
+    await asyncio.to_thread(_remove_uploads, orphaned)
+    return len(rows)
+
+
+async def archive_expired(after_days: int = settings.ARCHIVE_AFTER_DAYS,
+                          batch_size: int = settings.ARCHIVE_BATCH_SIZE,
+                          stop: Optional[asyncio.Event] = None) -> int:
+    """Archive every detection older than after_days, one batch per transaction"""
+    if after_days <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=after_days)
+    total = 0
+    while stop is None or not stop.is_set():
+        archived = await archive_batch(cutoff, batch_size)
+        total += archived
+        if archived < batch_size:
+            break
+    return total
+
+
+def _purge_rows(db: Session, cutoff: datetime) -> Tuple[int, Set[int]]:
+    user_ids = set(db.scalars(
+        select(models.ArchivedDetection.user_id)
+        .where(
+            models.ArchivedDetection.created_at < cutoff,
+            models.ArchivedDetection.user_id.isnot(None)
+        )
+        .distinct()
+    ))
+
+    purged = 0
+    if _is_postgresql(db):
+        # Whole months past the cutoff are dropped instead of deleted row by row
+        for name in inspect(db.connection()).get_table_names():
+            match = _PARTITION_PATTERN.match(name)
+            if match and _next_month(datetime(int(match[1]), int(match[2]), 1)) <= cutoff:
+                purged += db.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+                db.execute(text(f"DROP TABLE {name}"))
+
+    result = db.execute(
+        delete(models.ArchivedDetection).where(models.ArchivedDetection.created_at < cutoff),
+        execution_options={"synchronize_session": False}
+    )
+    stats.bump_versions(db, user_ids)
+    return purged + result.rowcount, user_ids
+
+
+def _referenced_bundles(db: Session) -> Set[str]:
+    return set(db.scalars(
+        select(models.ArchivedDetection.bundle)
+        .where(models.ArchivedDetection.bundle.isnot(None))
+        .distinct()
+    ))
+
+
+def _remove_unreferenced_bundles(referenced: Set[str]) -> int:
+    removed = 0
+    now = time.time()
+    for path in BUNDLE_DIR.glob("*.tar.gz"):
+        if path.name[:-len(".tar.gz")] in referenced or now - path.stat().st_mtime < BUNDLE_GRACE_SECONDS:
+            continue
+        path.unlink()
+        removed += 1
+    return removed
+
+
+async def purge_expired(retention_days: int = settings.ARCHIVE_RETENTION_DAYS) -> Tuple[int, int]:
+    """Delete archived rows older than retention_days and the bundles left unreferenced"""
+    if retention_days <= 0:
+        return 0, 0
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    async with AsyncWriteSessionLocal() as db:
+        purged, user_ids = await db.run_sync(_purge_rows, cutoff)
+        await db.commit()
+    for user_id in user_ids:
+        http_cache.invalidate_user(user_id)
+
+    async with AsyncSessionLocal() as db:
+        referenced = await db.run_sync(_referenced_bundles)
+    removed = await asyncio.to_thread(_remove_unreferenced_bundles, referenced)
+    return purged, removed
+
+
+class Archiver:
+    """Background task running the archive and retention passes every interval"""
+
+    def __init__(self, interval_minutes: int = 60):
+        self.interval = interval_minutes * 60
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock_file = None
+
+    def _acquire(self) -> bool:
+        """Take the archiver lock so only one of several worker processes runs the passes"""
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            Path(settings.ARCHIVE_DIR).mkdir(parents=True, exist_ok=True)
+            self._lock_file = open(Path(settings.ARCHIVE_DIR) / ".archiver.lock", "w")
+        try:
+            # Held until the process exits; another worker takes over if this one dies
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def start(self):
+        if self._task is None:
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop after the batch in progress"""
+        if self._task is None:
+            return
+        self._stop.set()
+        await self._task
+        self._task = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _run(self):
+        while not self._stop.is_set():
+            # Otherwise another worker process holds the lock and runs the passes
+            if self._acquire():
+                try:
+                    archived = await archive_expired(stop=self._stop)
+                    purged, bundles = await purge_expired()
+                    if archived or purged or bundles:
+                        print(f"✓ Archived {archived} detections, purged {purged} archived rows and {bundles} bundles")
+                except Exception as e:
+                    print(f"❌ Archive pass failed: {e}")
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Only created when the background pass is enabled; otherwise run `python archive.py`
+archiver = None
+if settings.ARCHIVE_INTERVAL_MINUTES > 0 and (settings.ARCHIVE_AFTER_DAYS > 0 or settings.ARCHIVE_RETENTION_DAYS > 0):
+    archiver = Archiver(settings.ARCHIVE_INTERVAL_MINUTES)
+
+
+if __name__ == "__main__":
+    from database import dispose_async_engines, engine
+    from migrations import run_migrations
+
+    parser = argparse.ArgumentParser(description="Archive old detections and apply the retention policy")
+    parser.add_argument("command", choices=["run", "purge"])
+    parser.add_argument("--days", type=int, help="override ARCHIVE_AFTER_DAYS / ARCHIVE_RETENTION_DAYS")
+    args = parser.parse_args()
+
+    run_migrations(engine)
+
+    async def main():
+        try:
+            if args.command == "run":
+                archived = await archive_expired(
+                    args.days if args.days is not None else settings.ARCHIVE_AFTER_DAYS
+                )
+                print(f"✓ Archived {archived} detections")
+            else:
+                purged, bundles = await purge_expired(
+                    args.days if args.days is not None else settings.ARCHIVE_RETENTION_DAYS
+                )
+                print(f"✓ Purged {purged} archived rows and {bundles} bundles")
+        finally:
+            await dispose_async_engines()
+
+    asyncio.run(main())
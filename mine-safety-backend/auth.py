@@ -1,29 +1,78 @@
+import asyncio
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import event, select
+from database import AsyncSessionLocal
+from cache import TTLCache
+import metrics
 import models
 from config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
+# Tokens whose signature has already been verified, mapped to their subject
+token_cache = TTLCache(maxsize=settings.AUTH_TOKEN_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS)
+# Resolved users keyed by username (detached from any session)
+user_cache = TTLCache(maxsize=settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS)
+metrics.register_cache("auth_token", token_cache)
+metrics.register_cache("auth_user", user_cache)
+
+# Bcrypt runs in its own small pool so login bursts cannot starve the request threadpool
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+_hash_slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE)
+
 def verify_password(plain_password, hashed_password):
     # Bcrypt has a 72 byte limit, truncate password before verification
     if len(plain_password.encode('utf-8')) > 72:
         plain_password = plain_password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password, hashed_password):
+    """Verify a password, returning (valid, new_hash) where new_hash is set if the stored cost is outdated"""
+    if len(plain_password.encode('utf-8')) > 72:
+        plain_password = plain_password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password):
     # Bcrypt has a 72 byte limit, truncate password before hashing
     if len(password.encode('utf-8')) > 72:
         password = password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
     return pwd_context.hash(password)
 
+async def _run_hashing(func, *args):
+    """Run a bcrypt call on the hashing pool, rejecting work when the pool is saturated"""
+    if not _hash_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-in requests in progress, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        future = _hash_executor.submit(func, *args)
+    except Exception:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return await asyncio.wrap_future(future)
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    return await _run_hashing(verify_and_update_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_hashing(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -34,21 +83,71 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def invalidate_user(username: Optional[str] = None, user_id: Optional[int] = None):
+    """Drop a user from the auth cache so the next request reloads it"""
+    if username is not None:
+        user_cache.pop(username)
+    if user_id is not None:
+        user_cache.discard_where(lambda user: user.id == user_id)
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(user_id=target.id)
+
+def _decode_token_subject(token: str) -> Optional[str]:
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+
+    username = payload.get("sub")
+    if username is None:
+        return None
+
+    # Never keep a token cached past its own expiry
+    ttl = settings.AUTH_CACHE_TTL_SECONDS
+    exp = payload.get("exp")
+    if exp is not None:
+        ttl = min(ttl, exp - time.time())
+    if ttl > 0:
+        token_cache.set(token, username, ttl=ttl)
+    return username
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
+    username = _decode_token_subject(token)
+    if username is None:
         raise credentials_exception
+
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+
+    # Its own short session: a request-scoped one would hold a pooled connection
+    # through the whole request, admission wait and inference included
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(models.User).where(models.User.username == username))
+        user = result.scalars().first()
+        if user is None:
+            raise credentials_exception
+        # Detach so the cached instance is never expired or refreshed by another request's session
+        db.expunge(user)
+    user_cache.set(username, user)
     return user
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """Admin access is disabled entirely while ADMIN_TOKEN is unset"""
+    return bool(settings.ADMIN_TOKEN) and token is not None and secrets.compare_digest(token, settings.ADMIN_TOKEN)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
@@ -0,0 +1,125 @@
+"""Load benchmark for the async database layer.
+
+Runs many concurrent in-flight requests against the app in-process and reports
+throughput, latency percentiles and the worst event-loop stall observed.
+
+Usage (from mine-safety-backend/):
+    python benchmarks/bench_async_db.py [--concurrency 200] [--requests 2000]
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_async_db_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(_tmpdir)
+
+import httpx
+from PIL import Image
+
+import auth
+import main
+import models
+from database import SessionLocal
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def seed(detections: int):
+    db = SessionLocal()
+    try:
+        user = models.User(username="bench", email="bench@example.com",
+                           hashed_password=auth.get_password_hash("bench-password"))
+        db.add(user)
+        db.flush()
+        main.crud.add_detections(db, [
+            models.Detection(
+                user_id=user.id, file_path="uploads/seed.jpg", file_type="image",
+                is_safe=i % 3 == 0, confidence=80,
+                detected_items='["Hardhat"]', missing_items='[]' if i % 3 == 0 else '["Safety Vest"]',
+                reason="seeded"
+            )
+            for i in range(detections)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+async def loop_monitor(stop: asyncio.Event, stalls: list, interval: float = 0.005):
+    """Measure how late a periodic timer fires; large values mean the loop was blocked"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def run(args):
+    seed(args.seed)
+    token = auth.create_access_token({"sub": "bench"})
+    headers = {"Authorization": f"Bearer {token}"}
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 240)).save(buffer, "JPEG")
+    image = buffer.getvalue()
+
+    # Count server errors (e.g. SQLite lock timeouts) instead of aborting the run
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits) as client:
+        counter = iter(range(args.requests))
+        latencies, errors = [], 0
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                kind = i % 10
+                start = time.perf_counter()
+                if kind == 0:
+                    response = await client.post("/api/detect", headers=headers,
+                                                 files={"file": ("frame.jpg", image, "image/jpeg")})
+                elif kind < 5:
+                    # Distinct limits defeat the response cache so every call reaches the database
+                    response = await client.get("/api/detections", headers=headers,
+                                                params={"limit": 1 + i % 50, "is_safe": i % 2 == 0})
+                else:
+                    main.http_cache.invalidate_user(1)
+                    response = await client.get("/api/dashboard", headers=headers)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+
+        stop = asyncio.Event()
+        stalls = []
+        monitor = asyncio.create_task(loop_monitor(stop, stalls))
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        finally:
+            duration = time.perf_counter() - start
+            stop.set()
+            await monitor
+            await main.dispose_async_engines()
+
+    print(f"{args.requests} requests, {args.concurrency} in flight, {args.seed} seeded detections")
+    print(f"  throughput: {args.requests / duration:8.1f} req/s   errors: {errors}")
+    print(f"  latency p50: {percentile(latencies, 50):.1f} ms  p95: {percentile(latencies, 95):.1f} ms  "
+          f"p99: {percentile(latencies, 99):.1f} ms")
+    print(f"  event-loop stall p99: {percentile(stalls, 99):.1f} ms  max: {max(stalls, default=0):.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=5000, help="detections to seed before the run")
+    asyncio.run(run(parser.parse_args()))
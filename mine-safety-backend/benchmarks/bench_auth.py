@@ -0,0 +1,61 @@
+"""Benchmark token-to-user resolution with and without the auth cache.
+
+Usage (from mine-safety-backend/):
+    python benchmarks/bench_auth.py [--requests 2000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Run against a throwaway SQLite database, never the real one
+_tmpdir = tempfile.mkdtemp(prefix="bench_auth_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(_tmpdir)
+
+from datetime import timedelta
+from fastapi.testclient import TestClient
+
+import auth
+import main
+
+
+def run(client: TestClient, headers: dict, requests: int, cached: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        if not cached:
+            auth.token_cache.clear()
+            auth.user_cache.clear()
+        response = client.get("/api/auth/me", headers=headers)
+        assert response.status_code == 200, response.text
+    return requests / (time.perf_counter() - start)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    client = TestClient(main.app)
+    client.post("/api/auth/register", json={
+        "username": "bench", "email": "bench@example.com", "password": "bench-password"
+    })
+    token = auth.create_access_token({"sub": "bench"}, expires_delta=timedelta(minutes=30))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Warm up the app and the connection pool
+    run(client, headers, 50, cached=False)
+
+    uncached = run(client, headers, args.requests, cached=False)
+    cached = run(client, headers, args.requests, cached=True)
+
+    print(f"GET /api/auth/me x {args.requests}")
+    print(f"  without auth cache: {uncached:8.1f} req/s ({1000 / uncached:.3f} ms/req)")
+    print(f"  with auth cache:    {cached:8.1f} req/s ({1000 / cached:.3f} ms/req)")
+    print(f"  overhead removed:   {1000 / uncached - 1000 / cached:.3f} ms/req")
+
+
+if __name__ == "__main__":
+    main_bench()
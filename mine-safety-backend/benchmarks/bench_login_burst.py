@@ -0,0 +1,111 @@
+"""Benchmark login latency during a shift-start burst of concurrent sign-ins.
+
+While the burst runs, a steady trickle of /api/detections requests measures how
+much the burst delays other traffic sharing the request threadpool.
+
+Usage (from mine-safety-backend/):
+    python benchmarks/bench_login_burst.py [--users 50] [--rounds 12]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+_parser.add_argument("--users", type=int, default=50, help="concurrent logins in the burst")
+_parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+_parser.add_argument("--workers", type=int, default=None, help="password hashing pool size")
+_parser.add_argument("--queue", type=int, default=None, help="password hashing queue size")
+args = _parser.parse_args()
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_login_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/bench.db")
+os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+if args.workers is not None:
+    os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+if args.queue is not None:
+    os.environ["PASSWORD_HASH_QUEUE_SIZE"] = str(args.queue)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(_tmpdir)
+
+import httpx
+
+import auth
+import main
+import models
+from database import SessionLocal
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed_users(count: int):
+    hashed = auth.get_password_hash("burst-password")
+    db = SessionLocal()
+    try:
+        for i in range(count):
+            db.add(models.User(username=f"worker{i}", email=f"worker{i}@example.com", hashed_password=hashed))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def timed(client: httpx.AsyncClient, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    return response.status_code, (time.perf_counter() - start) * 1000
+
+
+async def background_reads(client, headers, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        status, elapsed = await timed(client, "GET", "/api/detections", headers=headers)
+        if status == 200:
+            latencies.append(elapsed)
+        await asyncio.sleep(0.01)
+
+
+async def run():
+    seed_users(args.users)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        status, _ = await timed(client, "POST", "/api/auth/login",
+                                json={"username": "worker0", "password": "burst-password"})
+        assert status == 200
+        token = auth.create_access_token({"sub": "worker0"})
+        headers = {"Authorization": f"Bearer {token}"}
+
+        stop = asyncio.Event()
+        read_latencies = []
+        reader = asyncio.create_task(background_reads(client, headers, stop, read_latencies))
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            timed(client, "POST", "/api/auth/login",
+                  json={"username": f"worker{i}", "password": "burst-password"})
+            for i in range(args.users)
+        ])
+        duration = time.perf_counter() - start
+        stop.set()
+        await reader
+    await main.dispose_async_engines()
+
+    ok = [elapsed for status, elapsed in results if status == 200]
+    rejected = sum(1 for status, _ in results if status == 503)
+
+    print(f"Login burst: {args.users} concurrent users, bcrypt rounds={args.rounds}, "
+          f"hash workers={auth._hash_executor._max_workers}")
+    print(f"  succeeded: {len(ok)}  rejected (503): {rejected}  wall time: {duration:.2f}s")
+    print(f"  login p50: {percentile(ok, 50):8.1f} ms   p99: {percentile(ok, 99):8.1f} ms")
+    print(f"  /api/detections during burst: n={len(read_latencies)} "
+          f"p50={percentile(read_latencies, 50):.1f} ms p99={percentile(read_latencies, 99):.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
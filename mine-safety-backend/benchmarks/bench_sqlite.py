@@ -0,0 +1,125 @@
+"""Benchmark a mixed read/write workload on SQLite under each SQLITE_PROFILE.
+
+Each profile runs in its own process against a fresh database file, with
+concurrent writers inserting detections and readers paging through history.
+
+Usage (from mine-safety-backend/):
+    python benchmarks/bench_sqlite.py [--seconds 10] [--writers 16] [--readers 64]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+PROFILES = ("default", "concurrent")
+
+
+def make_detection(user_id: int, i: int):
+    import models
+    return models.Detection(
+        user_id=user_id, file_path=f"uploads/{i}.jpg", file_type="image",
+        is_safe=i % 3 != 0, confidence=90,
+        detected_items='["Hardhat", "Safety Vest"]',
+        missing_items='[]' if i % 3 != 0 else '["Safety Vest"]',
+        reason="bench", created_at=datetime.utcnow()
+    )
+
+
+async def workload(seconds: float, writers: int, readers: int):
+    import crud
+    import models
+    from sqlalchemy.exc import OperationalError
+    from database import (
+        AsyncSessionLocal, AsyncWriteSessionLocal, SessionLocal, dispose_async_engines, engine
+    )
+    from migrations import run_migrations
+
+    run_migrations(engine)
+    db = SessionLocal()
+    user = models.User(username="bench", email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.add_all([make_detection(user_id, i) for i in range(2000)])
+    db.commit()
+    db.close()
+
+    counts = {"writes": 0, "reads": 0, "lock_errors": 0, "other_errors": 0}
+    deadline = time.perf_counter() + seconds
+
+    async def guarded(kind, operation):
+        try:
+            await operation()
+            counts[kind] += 1
+        except OperationalError as e:
+            key = "lock_errors" if "locked" in str(e) or "busy" in str(e) else "other_errors"
+            counts[key] += 1
+        except Exception:
+            counts["other_errors"] += 1
+
+    async def write_one(i):
+        async with AsyncWriteSessionLocal() as session:
+            await session.run_sync(crud.add_detections, [make_detection(user_id, i)])
+            await session.commit()
+
+    async def read_one():
+        async with AsyncSessionLocal() as session:
+            await session.run_sync(crud.list_detections, user_id, 50)
+
+    async def writer(n):
+        i = n
+        while time.perf_counter() < deadline:
+            await guarded("writes", lambda: write_one(i))
+            i += writers
+
+    async def reader():
+        while time.perf_counter() < deadline:
+            await guarded("reads", read_one)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[writer(n) for n in range(writers)], *[reader() for _ in range(readers)])
+    duration = time.perf_counter() - start
+
+    await dispose_async_engines()
+    counts["seconds"] = duration
+    return counts
+
+
+def run_profile(profile: str, args) -> dict:
+    env = dict(os.environ)
+    env["SQLITE_PROFILE"] = profile
+    env["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='bench_sqlite_')}/bench.db"
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", "--seconds", str(args.seconds),
+         "--writers", str(args.writers), "--readers", str(args.readers)],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=64)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        print(json.dumps(asyncio.run(workload(args.seconds, args.writers, args.readers))))
+        sys.exit(0)
+
+    print(f"{args.writers} writers, {args.readers} readers, {args.seconds:g} s per profile")
+    for profile in PROFILES:
+        result = run_profile(profile, args)
+        print(
+            f"  {profile:10s} {result['writes'] / result['seconds']:8.1f} writes/s"
+            f" {result['reads'] / result['seconds']:8.1f} reads/s"
+            f"   lock errors: {result['lock_errors']}   other errors: {result['other_errors']}"
+        )
@@ -0,0 +1,101 @@
+"""Benchmark Detection insert throughput: per-request commits versus write-behind batches.
+
+Usage (from mine-safety-backend/):
+    python benchmarks/bench_write_behind.py [--records 2000] [--concurrency 32]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_write_behind_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crud
+import models
+from database import AsyncWriteSessionLocal, SessionLocal, dispose_async_engines, engine
+from migrations import run_migrations
+from write_behind import DetectionWriter
+
+
+def make_detection(user_id: int, i: int) -> models.Detection:
+    return models.Detection(
+        user_id=user_id, file_path=f"uploads/{i}.jpg", file_type="image",
+        is_safe=i % 2 == 0, confidence=90,
+        detected_items='["Hardhat", "Safety Vest"]' if i % 2 == 0 else '["Hardhat"]',
+        missing_items='[]' if i % 2 == 0 else '["Safety Vest"]',
+        reason="bench", created_at=datetime.utcnow()
+    )
+
+
+async def direct(records: int, concurrency: int, user_id: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def insert(i):
+        nonlocal errors
+        async with semaphore:
+            try:
+                async with AsyncWriteSessionLocal() as db:
+                    await db.run_sync(crud.add_detections, [make_detection(user_id, i)])
+                    await db.commit()
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*[insert(i) for i in range(records)])
+    return errors
+
+
+async def write_behind(records: int, concurrency: int, user_id: int, batch_size: int, flush_ms: int):
+    writer = DetectionWriter(batch_size=batch_size, flush_interval_ms=flush_ms)
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def insert(i):
+        nonlocal errors
+        async with semaphore:
+            try:
+                await writer.submit(make_detection(user_id, i), wait=True)
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*[insert(i) for i in range(records)])
+    await writer.close()
+    return errors
+
+
+async def run(args):
+    run_migrations(engine)
+    db = SessionLocal()
+    user = models.User(username="bench", email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+
+    for name, job in (
+        ("per-request commit", lambda: direct(args.records, args.concurrency, user_id)),
+        (f"write-behind (batch {args.batch_size}, {args.flush_ms} ms)",
+         lambda: write_behind(args.records, args.concurrency, user_id, args.batch_size, args.flush_ms)),
+    ):
+        start = time.perf_counter()
+        errors = await job()
+        duration = time.perf_counter() - start
+        print(f"  {name:38s} {args.records / duration:8.1f} inserts/s   errors: {errors}")
+
+    await dispose_async_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--flush-ms", type=int, default=20)
+    args = parser.parse_args()
+    print(f"{args.records} detections, {args.concurrency} concurrent writers")
+    asyncio.run(run(args))
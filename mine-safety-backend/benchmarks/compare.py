@@ -0,0 +1,54 @@
+"""Compare two run_suite.py result files case by case.
+
+Usage (from mine-safety-backend/):
+    python benchmarks/compare.py base.json head.json [--metric median_ms] [--threshold 10]
+
+Exits with status 1 when any case got slower by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--metric", default="median_ms", choices=["median_ms", "mean_ms", "p95_ms", "min_ms"])
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    for label, document in (("base", base), ("head", head)):
+        git = document["environment"].get("git") or {}
+        print(f"{label}: {git.get('branch')} {str(git.get('commit'))[:10]}"
+              f"{' (dirty)' if git.get('dirty') else ''}  model={document['environment']['model']}")
+    if base["environment"]["model"] != head["environment"]["model"]:
+        print("⚠️  results were taken with different model modes")
+
+    regressions = []
+    print(f"\n  {'case':18s} {'base':>10s} {'head':>10s} {'change':>9s}   ({args.metric})")
+    for case in sorted(set(base["results"]) | set(head["results"])):
+        if case not in base["results"] or case not in head["results"]:
+            print(f"  {case:18s} only in {'head' if case in head['results'] else 'base'}")
+            continue
+        before, after = base["results"][case][args.metric], head["results"][case][args.metric]
+        change = (after - before) / before * 100 if before else 0.0
+        marker = ""
+        if change > args.threshold:
+            marker = "  ❌ slower"
+            regressions.append(case)
+        elif change < -args.threshold:
+            marker = "  ✓ faster"
+        print(f"  {case:18s} {before:10.2f} {after:10.2f} {change:+8.1f}%{marker}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Load generator for the full API.
+
+Registers and logs in N virtual users. Each user then replays a weighted mix of
+/api/detect (image and video), /api/detections and /api/dashboard calls
+against a running server. Every --interval seconds it prints throughput, error
+rate and latency percentiles, and it can step the number of users up until the
+server saturates.
+
+Against a server you started yourself (start it with DETECTION_MODEL=stub to
+run without model weights):
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --users 20 --duration 60
+
+Or let the tool start a throwaway server (temp database, stub model):
+    python benchmarks/loadtest.py --spawn --users 20 --duration 60
+    python benchmarks/loadtest.py --spawn --find-saturation --slo-p95-ms 500
+
+Mix weights are relative, e.g. --mix detect_image=40,detect_video=5,detections=35,dashboard=20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+import synthetic
+
+DEFAULT_MIX = "detect_image=40,detect_video=5,detections=35,dashboard=20"
+_backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("detect_image", "detect_video", "detections", "dashboard"):
+            raise argparse.ArgumentTypeError(f"unknown request kind: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Recorder:
+    """Collects (finish time, kind, latency, ok) samples and summarizes time windows"""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, kind: str, latency: float, ok: bool):
+        self.samples.append((time.perf_counter(), kind, latency, ok))
+
+    def summary(self, start: float, end: float) -> dict:
+        window = [sample for sample in self.samples if start <= sample[0] < end]
+        latencies = [sample[2] * 1000 for sample in window]
+        errors = sum(1 for sample in window if not sample[3])
+        duration = max(end - start, 1e-9)
+        return {
+            "requests": len(window),
+            "throughput": len(window) / duration,
+            "error_rate": errors / len(window) if window else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "by_kind": dict(Counter(sample[1] for sample in window)),
+        }
+
+
+async def login_users(client: httpx.AsyncClient, count: int, prefix: str) -> List[dict]:
+    """Register and log in virtual users, honouring 503/Retry-After from the hashing pool"""
+    async def one(index: int) -> dict:
+        credentials = {"username": f"{prefix}_{index}", "password": "loadtest-password"}
+        for path, body in (
+            ("/api/auth/register", {**credentials, "email": f"{prefix}_{index}@example.com"}),
+            ("/api/auth/login", credentials),
+        ):
+            while True:
+                response = await client.post(path, json=body)
+                if response.status_code != 503:
+                    break
+                await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} failed for user {index}: {response.status_code} {response.text}")
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    # A few at a time, so registration does not itself saturate the hashing pool
+    semaphore = asyncio.Semaphore(4)
+
+    async def limited(index):
+        async with semaphore:
+            return await one(index)
+
+    return await asyncio.gather(*[limited(index) for index in range(count)])
+
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, float], think_ms: float, media: dict):
+        self.client = client
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.think = think_ms / 1000
+        self.media = media
+
+    async def request(self, kind: str, headers: dict, rng: random.Random) -> bool:
+        if kind == "detect_image":
+            image = rng.choice(self.media["images"])
+            response = await self.client.post("/api/detect", headers=headers,
+                                              files={"file": ("gate.jpg", image, "image/jpeg")})
+        elif kind == "detect_video":
+            response = await self.client.post("/api/detect", headers=headers,
+                                              files={"file": ("gate.mp4", self.media["video"], "video/mp4")})
+        elif kind == "detections":
+            response = await self.client.get("/api/detections", headers=headers, params={"limit": 50})
+        else:
+            response = await self.client.get("/api/dashboard", headers=headers)
+        return response.status_code == 200
+
+    async def user(self, headers: dict, seed: int, recorder: Recorder, stop: asyncio.Event):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            kind = rng.choices(self.kinds, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = await self.request(kind, headers, rng)
+            except httpx.HTTPError:
+                ok = False
+            recorder.add(kind, time.perf_counter() - start, ok)
+            if self.think:
+                await asyncio.sleep(rng.expovariate(1 / self.think))
+
+    async def run(self, users: List[dict], duration: float, interval: float, quiet: bool = False) -> dict:
+        recorder = Recorder()
+        stop = asyncio.Event()
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(self.user(headers, index, recorder, stop))
+                 for index, headers in enumerate(users)]
+        windows = []
+        window_start = start
+        while window_start < start + duration:
+            await asyncio.sleep(min(interval, start + duration - window_start))
+            now = time.perf_counter()
+            window = recorder.summary(window_start, now)
+            window["t"] = round(now - start, 1)
+            windows.append(window)
+            if not quiet:
+                print(f"  t={window['t']:6.1f}s  {window['throughput']:8.1f} req/s  "
+                      f"errors {window['error_rate'] * 100:5.1f}%  p50 {window['p50_ms']:7.1f} ms  "
+                      f"p95 {window['p95_ms']:7.1f} ms  p99 {window['p99_ms']:7.1f} ms")
+            window_start = now
+        stop.set()
+        await asyncio.gather(*tasks)
+        total = recorder.summary(start, start + duration)
+        total["users"] = len(users)
+        total["windows"] = windows
+        return total
+
+
+async def find_saturation(generator: LoadGenerator, all_users: List[dict], args) -> dict:
+    """Double the user count until throughput stops growing or the SLO or error budget breaks"""
+    steps = []
+    best = None
+    users = args.start_users
+    while users <= len(all_users):
+        print(f"{users} users for {args.step_duration:g}s")
+        result = await generator.run(all_users[:users], args.step_duration, args.step_duration, quiet=True)
+        steps.append(result)
+        print(f"  {result['throughput']:8.1f} req/s  errors {result['error_rate'] * 100:5.1f}%  "
+              f"p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms")
+
+        within_slo = result["error_rate"] <= args.max_error_rate and (
+            args.slo_p95_ms is None or result["p95_ms"] <= args.slo_p95_ms
+        )
+        if not within_slo:
+            print("  ✗ over the latency SLO or error budget")
+            break
+        if best is not None and result["throughput"] < best["throughput"] * (1 + args.min_gain):
+            print("  ✗ throughput stopped growing")
+            best = best if best["throughput"] >= result["throughput"] else result
+            break
+        best = result
+        users *= 2
+
+    if best is not None:
+        print(f"✓ Saturation at about {best['users']} users, {best['throughput']:.1f} req/s "
+              f"(p95 {best['p95_ms']:.1f} ms)")
+    return {"saturation": best, "steps": steps}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(args) -> (subprocess.Popen, str):
+    """Start uvicorn on a temp database with the stub model"""
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    port = _free_port()
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{workdir}/loadtest.db")
+    env.setdefault("DETECTION_MODEL", "stub")
+    env["DETECTION_STUB_INFERENCE_MS"] = str(args.stub_inference_ms)
+    env["PYTHONPATH"] = _backend_dir + os.pathsep + env.get("PYTHONPATH", "")
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited, see {log.name}")
+        try:
+            if httpx.get(url + "/", timeout=1).status_code == 200:
+                print(f"Started server at {url} (logs: {log.name})")
+                return process, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"server did not start, see {log.name}")
+
+
+async def main_async(args, url: str) -> dict:
+    media = {
+        "images": [synthetic.encode_image(seed) for seed in range(16)],
+        "video": None,
+    }
+    if args.mix.get("detect_video"):
+        video_path = synthetic.write_video(
+            os.path.join(tempfile.mkdtemp(prefix="loadtest_media_"), "gate.mp4"), frames=args.video_frames
+        )
+        with open(video_path, "rb") as handle:
+            media["video"] = handle.read()
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        user_count = args.max_users if args.find_saturation else args.users
+        print(f"Logging in {user_count} virtual users")
+        users = await login_users(client, user_count, f"lt{uuid.uuid4().hex[:8]}")
+        generator = LoadGenerator(client, args.mix, args.think_ms, media)
+        if args.find_saturation:
+            return await find_saturation(generator, users, args)
+        print(f"{args.users} users for {args.duration:g}s, mix {args.mix}")
+        result = await generator.run(users, args.duration, args.interval)
+        print(f"total: {result['throughput']:.1f} req/s  errors {result['error_rate'] * 100:.1f}%  "
+              f"p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  p99 {result['p99_ms']:.1f} ms")
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://127.0.0.1:8000")
+    target.add_argument("--spawn", action="store_true", help="start a throwaway server with the stub model")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers with --spawn")
+    parser.add_argument("--stub-inference-ms", type=float, default=30.0, help="stub model latency with --spawn")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--interval", type=float, default=5, help="seconds per reported window")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a user's requests")
+    parser.add_argument("--video-frames", type=int, default=60)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--find-saturation", action="store_true")
+    parser.add_argument("--start-users", type=int, default=2)
+    parser.add_argument("--max-users", type=int, default=256)
+    parser.add_argument("--step-duration", type=float, default=15)
+    parser.add_argument("--slo-p95-ms", type=float)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--min-gain", type=float, default=0.05,
+                        help="smallest relative throughput gain that counts as still scaling")
+    parser.add_argument("--output", help="write the full result as JSON")
+    args = parser.parse_args()
+
+    process: Optional[subprocess.Popen] = None
+    url = args.url
+    if args.spawn:
+        process, url = spawn_server(args)
+    try:
+        result = asyncio.run(main_async(args, url))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({"url": url, "mix": args.mix, "result": result}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Reproducible benchmark suite for the detection pipeline, emitting JSON.
+
+Runs offline on a CPU-only machine. Media is synthetic and seeded, the database
+is a throwaway SQLite file seeded with detections, and by default the model is
+the deterministic stub (stub_model.py). Use --model real to time the
+model that detection_service actually loads.
+
+Cases:
+    detect_image        detection_service.detect_image on JPEG files
+    detect_video        detection_service.detect_video on a short MP4
+    matching            box collection + nearest-person matching only
+    api_detect          POST /api/detect through an in-process ASGI client
+    dashboard           GET /api/dashboard, response cache cleared each time
+    dashboard_304       GET /api/dashboard revalidated with If-None-Match
+    history_page        GET /api/detections (first page, uncached)
+    compliance_trend    GET /api/analytics/compliance
+
+Usage (from mine-safety-backend/):
+    python benchmarks/run_suite.py [--model stub|real] [--repeat 30] [--only detect_image,matching]
+                                   [--output results.json]
+Compare two result files with benchmarks/compare.py.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_suite_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/bench.db")
+_backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _backend_dir)
+
+import cv2
+import numpy as np
+
+import synthetic
+from stub_model import StubModel
+
+CASES = [
+    "detect_image", "detect_video", "matching", "api_detect",
+    "dashboard", "dashboard_304", "history_page", "compliance_trend",
+]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "repeat": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))] * 1000,
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "stdev_ms": (statistics.stdev(samples) if len(samples) > 1 else 0.0) * 1000,
+        "ops_per_s": len(samples) / sum(samples) if sum(samples) else 0.0,
+    }
+
+
+def measure(function, repeat: int, warmup: int):
+    for index in range(warmup):
+        function(index)
+    samples = []
+    for index in range(repeat):
+        start = time.perf_counter()
+        function(index)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def measure_async(function, repeat: int, warmup: int):
+    for index in range(warmup):
+        await function(index)
+    samples = []
+    for index in range(repeat):
+        start = time.perf_counter()
+        await function(index)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def git_revision():
+    def run(*command):
+        try:
+            return subprocess.run(command, cwd=_backend_dir, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {
+        "commit": run("git", "rev-parse", "HEAD"),
+        "branch": run("git", "rev-parse", "--abbrev-ref", "HEAD"),
+        "dirty": bool(run("git", "status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def environment(args):
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+        "model": args.model,
+        "stub_inference_ms": args.stub_inference_ms if args.model == "stub" else None,
+        "seed_detections": args.seed_detections,
+        "git": git_revision(),
+    }
+
+
+def seed_database(detections: int):
+    """One user with `detections` rows spread over the last 90 days; returns a bearer token"""
+    import auth
+    import crud
+    import models
+    from database import SessionLocal
+
+    rng = random.Random(0)
+    db = SessionLocal()
+    try:
+        user = models.User(username="bench", email="bench@example.com",
+                           hashed_password=auth.get_password_hash("bench-password"))
+        db.add(user)
+        db.flush()
+        now = datetime.utcnow()
+        for start in range(0, detections, 1000):
+            batch = []
+            for _ in range(min(1000, detections - start)):
+                safe = rng.random() < 0.7
+                batch.append(models.Detection(
+                    user_id=user.id, file_path="uploads/seed.jpg", file_type="image",
+                    is_safe=safe, confidence=rng.randint(40, 99),
+                    detected_items='["Hardhat", "Safety Vest"]' if safe else '["Hardhat"]',
+                    missing_items='[]' if safe else '["Safety Vest"]',
+                    reason="seeded", created_at=now - timedelta(minutes=rng.randint(0, 90 * 24 * 60))
+                ))
+            crud.add_detections(db, batch)
+        db.commit()
+    finally:
+        db.close()
+    return auth.create_access_token({"sub": "bench"})
+
+
+def run_pipeline_cases(selected, args, service, results):
+    images = synthetic.write_images(os.path.join(_tmpdir, "media"), args.images)
+
+    if "detect_image" in selected:
+        results["detect_image"] = measure(
+            lambda i: service.detect_image(images[i % len(images)]), args.repeat, args.warmup
+        )
+
+    if "detect_video" in selected:
+        video = synthetic.write_video(os.path.join(_tmpdir, "media", "synthetic.mp4"), frames=args.video_frames)
+        results["detect_video"] = measure(
+            lambda i: service.detect_video(video), max(3, args.repeat // 5), 1
+        )
+
+    if "matching" in selected:
+        # Crowded frames from the stub, so matching has real work to do
+        crowd = StubModel(max_people=6, max_gear=10)
+        outputs = [crowd.predict(path, conf=service.conf_threshold) for path in images]
+        results["matching"] = measure(
+            lambda i: service._evaluate(*service._collect_boxes(outputs[i % len(outputs)])),
+            args.repeat * 10, args.warmup
+        )
+
+
+async def run_api_cases(selected, args, token, results):
+    import httpx
+
+    import http_cache
+    import main
+
+    headers = {"Authorization": f"Bearer {token}"}
+    uploads = [synthetic.encode_image(1000 + i) for i in range(args.images)]
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def get(path, expected=200, **kwargs):
+            response = await client.get(path, **kwargs)
+            assert response.status_code == expected, (path, response.status_code, response.text)
+            return response
+
+        if "api_detect" in selected:
+            async def detect(i):
+                response = await client.post("/api/detect", headers=headers, files={
+                    "file": (f"frame_{i % len(uploads)}.jpg", uploads[i % len(uploads)], "image/jpeg")
+                })
+                assert response.status_code == 200, response.text
+            results["api_detect"] = await measure_async(detect, args.repeat, args.warmup)
+
+        if "dashboard" in selected:
+            async def dashboard(i):
+                http_cache.response_cache.clear()
+                await get("/api/dashboard", headers=headers)
+            results["dashboard"] = await measure_async(dashboard, args.repeat, args.warmup)
+
+        if "dashboard_304" in selected:
+            etag = (await get("/api/dashboard", headers=headers)).headers["etag"]
+            results["dashboard_304"] = await measure_async(
+                lambda i: get("/api/dashboard", 304, headers={**headers, "If-None-Match": etag}),
+                args.repeat, args.warmup
+            )
+
+        if "history_page" in selected:
+            async def history(i):
+                http_cache.response_cache.clear()
+                await get("/api/detections", headers=headers, params={"limit": 50})
+            results["history_page"] = await measure_async(history, args.repeat, args.warmup)
+
+        if "compliance_trend" in selected:
+            results["compliance_trend"] = await measure_async(
+                lambda i: get("/api/analytics/compliance", headers=headers, params={"granularity": "day"}),
+                args.repeat, args.warmup
+            )
+
+    await main.dispose_async_engines()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", choices=["stub", "real"], default="stub")
+    parser.add_argument("--stub-inference-ms", type=float, default=0.0,
+                        help="simulated model latency per image in stub mode")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--images", type=int, default=8, help="distinct synthetic images to cycle through")
+    parser.add_argument("--video-frames", type=int, default=90)
+    parser.add_argument("--seed-detections", type=int, default=5000)
+    parser.add_argument("--only", help="comma-separated subset of: " + ", ".join(CASES))
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    selected = CASES if not args.only else [case.strip() for case in args.only.split(",")]
+    unknown = set(selected) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    os.chdir(_tmpdir)
+    results = {}
+    # The app logs with print(); keep stdout for the JSON document
+    with contextlib.redirect_stdout(sys.stderr):
+        import main  # creates the schema and the uploads directory
+        from detection_service import detection_service
+
+        if args.model == "stub":
+            detection_service.model = StubModel(inference_ms=args.stub_inference_ms)
+        elif detection_service.model is None:
+            print("❌ --model real needs a loadable model (best.onnx or yolov8n.pt)")
+            sys.exit(2)
+
+        token = seed_database(args.seed_detections)
+        run_pipeline_cases(selected, args, detection_service, results)
+        asyncio.run(run_api_cases(selected, args, token, results))
+
+        for case in selected:
+            stats = results[case]
+            print(f"  {case:18s} median {stats['median_ms']:9.2f} ms   p95 {stats['p95_ms']:9.2f} ms"
+                  f"   {stats['ops_per_s']:9.1f} ops/s")
+
+    document = {
+        "suite": "detection-pipeline",
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "environment": environment(args),
+        "results": {case: results[case] for case in selected},
+    }
+    output = json.dumps(document, indent=2)
+    if output_path:
+        with open(output_path, "w") as handle:
+            handle.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,60 @@
+"""Synthetic, seeded test media for the benchmarks (no dataset download needed)."""
+import os
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+
+def make_image(seed: int, size: Tuple[int, int] = (640, 480)) -> np.ndarray:
+    """A BGR frame with a gradient background, noise and a few person-sized blocks"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    image = np.broadcast_to(gradient, (height, width, 3)).astype(np.float32)
+    image = image * rng.uniform(0.3, 1.0, size=3) + rng.normal(0, 12, size=(height, width, 3))
+    image = np.ascontiguousarray(np.clip(image, 0, 255).astype(np.uint8))
+
+    for _ in range(rng.integers(1, 4)):
+        x1, y1 = int(rng.uniform(0, 0.7) * width), int(rng.uniform(0, 0.5) * height)
+        x2, y2 = x1 + int(0.2 * width), y1 + int(0.45 * height)
+        cv2.rectangle(image, (x1, y1), (x2, y2), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        # "Hardhat" and "vest" patches
+        cv2.circle(image, ((x1 + x2) // 2, y1 + 10), 12, (0, 215, 255), -1)
+        cv2.rectangle(image, (x1 + 5, y1 + 40), (x2 - 5, y1 + 90), (0, 140, 255), -1)
+    return image
+
+
+def write_images(directory: str, count: int, size: Tuple[int, int] = (640, 480),
+                 extension: str = "jpg", first_seed: int = 0) -> List[str]:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"synthetic_{first_seed + index}.{extension}")
+        cv2.imwrite(path, make_image(first_seed + index, size))
+        paths.append(path)
+    return paths
+
+
+def encode_image(seed: int, size: Tuple[int, int] = (640, 480)) -> bytes:
+    ok, buffer = cv2.imencode(".jpg", make_image(seed, size))
+    if not ok:
+        raise RuntimeError("JPEG encoding failed")
+    return buffer.tobytes()
+
+
+def write_video(path: str, frames: int = 90, size: Tuple[int, int] = (640, 480), fps: int = 30,
+                seed: int = 0) -> str:
+    """An MP4 whose scene changes every second, so sampled frames differ"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError("OpenCV cannot write MP4 files on this machine")
+    scene = None
+    for index in range(frames):
+        if index % fps == 0:
+            scene = make_image(seed + index // fps, size)
+        frame = np.roll(scene, index % fps * 4, axis=1)
+        writer.write(frame)
+    writer.release()
+    return path
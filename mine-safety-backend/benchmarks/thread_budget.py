@@ -0,0 +1,188 @@
+"""Find the best split of a worker's CPUs between threads per inference and
+inferences running at once.
+
+Every configuration runs in a fresh process, because BLAS and OpenMP only
+read their thread counts at load time. Each process applies the budget via
+thread_budget.apply() and then runs `concurrency` inference loops for
+--duration seconds. Before the grid, one run uses the libraries' own defaults
+(no budget) with --unbudgeted-concurrency loops, the way the threadpool used
+to run detections; that shows what oversubscription costs.
+
+By default an inference is a CPU-bound stand-in: YOLO-style letterbox
+preprocessing, a blur and BLAS matrix products (plus a small conv net when
+torch is installed). With --model real the loaded model runs through
+detection_service.detect_image; its baseline run still gets the service's
+default budget, since loading the service applies one.
+
+Usage (from mine-safety-backend/):
+    python benchmarks/thread_budget.py [--model real] [--duration 10] [--output budget.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _backend_dir)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def make_inference(model: str):
+    import cv2
+    import numpy as np
+
+    import synthetic
+    from stub_model import letterbox
+
+    if model == "real":
+        from detection_service import detection_service
+
+        path = synthetic.write_images(tempfile.mkdtemp(prefix="thread_budget_"), 1)[0]
+        return lambda: detection_service.detect_image(path)
+
+    image = synthetic.make_image(0)
+    rng = np.random.default_rng(0)
+    features = rng.random((1024, 1024), dtype=np.float32)
+    weights = rng.random((1024, 512), dtype=np.float32)
+    network = None
+    if "torch" in sys.modules or _has_torch():
+        import torch
+        network = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 32, 3, stride=2), torch.nn.ReLU(),
+            torch.nn.Conv2d(32, 64, 3, stride=2), torch.nn.ReLU(),
+        ).eval()
+        batch = torch.rand(1, 3, 320, 320)
+
+    def inference():
+        tensor = letterbox(image).astype(np.float32) / 255.0
+        cv2.GaussianBlur(tensor, (9, 9), 0)
+        for _ in range(3):
+            features @ weights
+        if network is not None:
+            with torch.no_grad():
+                network(batch)
+    return inference
+
+
+def _has_torch() -> bool:
+    try:
+        import torch  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def child(args):
+    """Run one configuration in this process and print its result as JSON"""
+    if args.threads:
+        # Before NumPy loads, as in the app; detection_service re-applies it from settings
+        os.environ["INFERENCE_THREADS"] = str(args.threads)
+        os.environ["INFERENCE_CONCURRENCY"] = str(args.concurrency)
+        for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[name] = str(args.threads)
+        import thread_budget
+        thread_budget.apply(args.threads)
+    else:
+        for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.pop(name, None)
+
+    inference = make_inference(args.model)
+    inference()  # warm up pools and caches
+
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def loop():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            inference()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=loop) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "threads": args.threads or "default",
+        "concurrency": args.concurrency,
+        "inferences_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }))
+
+
+def run_config(args, threads: int, concurrency: int) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--model", args.model,
+               "--duration", str(args.duration), "--threads", str(threads), "--concurrency", str(concurrency)]
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def powers_of_two(limit: int):
+    value = 1
+    while value <= limit:
+        yield value
+        value *= 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", choices=["stub", "real"], default="stub")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--cpus", type=int, help="CPUs to budget for (default: all available)")
+    parser.add_argument("--unbudgeted-concurrency", type=int,
+                        help="loops for the no-budget baseline (default: 2 x CPUs)")
+    parser.add_argument("--slo-p95-ms", type=float, help="only recommend configurations under this p95")
+    parser.add_argument("--output", help="write all results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--threads", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--concurrency", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    import thread_budget
+    cpus = args.cpus or thread_budget.cpu_count()
+    results = [run_config(args, 0, args.unbudgeted_concurrency or 2 * cpus)]
+    for threads in powers_of_two(cpus):
+        for concurrency in powers_of_two(max(1, cpus // threads) * 2):
+            results.append(run_config(args, threads, concurrency))
+
+    print(f"{'threads':>8s} {'at once':>8s} {'inf/s':>9s} {'p50 ms':>9s} {'p95 ms':>9s}")
+    for result in results:
+        print(f"{str(result['threads']):>8s} {result['concurrency']:8d} {result['inferences_per_s']:9.1f} "
+              f"{result['p50_ms']:9.1f} {result['p95_ms']:9.1f}")
+
+    candidates = [r for r in results[1:] if args.slo_p95_ms is None or r["p95_ms"] <= args.slo_p95_ms]
+    best = max(candidates, key=lambda r: r["inferences_per_s"]) if candidates else None
+    if best:
+        print(f"✓ Best: INFERENCE_THREADS={best['threads']} INFERENCE_CONCURRENCY={best['concurrency']} "
+              f"({best['inferences_per_s']:.1f} inferences/s, p95 {best['p95_ms']:.1f} ms, "
+              f"{best['inferences_per_s'] / max(results[0]['inferences_per_s'], 1e-9):.2f}x the unbudgeted run)")
+    else:
+        print("❌ No configuration meets the p95 SLO")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({"cpus": cpus, "model": args.model, "results": results, "best": best}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
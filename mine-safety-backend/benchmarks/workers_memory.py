@@ -0,0 +1,139 @@
+"""Per-worker memory and startup time of the gunicorn multi-worker launch.
+
+Starts `gunicorn -c gunicorn_conf.py main:app` with and without preload_app
+and, for each run, reports:
+    startup_s   launch until every worker has finished application startup
+    rss_mb      resident memory of each worker (shared pages counted in full)
+    pss_mb      proportional share: shared pages split between the processes
+    uss_mb      memory private to the worker, freed if it exits
+
+With preload the model is loaded once in the master, so USS per worker should
+stay far below the model's size. Linux only (reads /proc/<pid>/smaps_rollup).
+
+Usage (from mine-safety-backend/):
+    python benchmarks/workers_memory.py --workers 4 --stub-weights-mb 200
+    python benchmarks/workers_memory.py --workers 4 --model real --output memory.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+import synthetic
+
+_backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def memory(pid: int) -> dict:
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as handle:
+        for line in handle:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": round(values.get("Rss", 0), 1),
+        "pss_mb": round(values.get("Pss", 0), 1),
+        "uss_mb": round(values.get("Private_Clean", 0) + values.get("Private_Dirty", 0), 1),
+    }
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as handle:
+        return [int(child) for child in handle.read().split()]
+
+
+def run(preload: bool, args, port: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix="workers_memory_")
+    config = os.path.join(workdir, "gunicorn_bench.py")
+    with open(config, "w") as handle:
+        handle.write(f"from gunicorn_conf import *\npreload_app = {preload}\n")
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "DETECTION_MODEL": "stub" if args.model == "stub" else "auto",
+        "DETECTION_STUB_WEIGHTS_MB": str(args.stub_weights_mb),
+        "WEB_CONCURRENCY": str(args.workers),
+        "PYTHONPATH": _backend_dir + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    if args.model == "real":
+        # Model files are looked up next to detection_service.py
+        env.pop("DETECTION_STUB_WEIGHTS_MB")
+    log_path = os.path.join(workdir, "gunicorn.log")
+    log = open(log_path, "w")
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", config, "--bind", f"127.0.0.1:{port}", "main:app"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited, see {log_path}")
+            with open(log_path) as handle:
+                if handle.read().count("Application startup complete") >= args.workers:
+                    break
+            if time.perf_counter() - started > args.timeout:
+                raise RuntimeError(f"workers did not start, see {log_path}")
+            time.sleep(0.05)
+        startup = time.perf_counter() - started
+
+        # Serve some detections so each worker touches the model as it would in production
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            credentials = {"username": "bench", "password": "bench-password"}
+            client.post("/api/auth/register", json={**credentials, "email": "bench@example.com"})
+            token = client.post("/api/auth/login", json=credentials).json()["access_token"]
+            image = synthetic.encode_image(0)
+            for _ in range(args.requests):
+                client.post("/api/detect", headers={"Authorization": f"Bearer {token}"},
+                            files={"file": ("gate.jpg", image, "image/jpeg")})
+
+        workers = [memory(pid) for pid in children(process.pid)]
+        return {
+            "preload": preload,
+            "startup_s": round(startup, 2),
+            "master": memory(process.pid),
+            "workers": workers,
+            "total_pss_mb": round(memory(process.pid)["pss_mb"] + sum(w["pss_mb"] for w in workers), 1),
+            "mean_worker_uss_mb": round(sum(w["uss_mb"] for w in workers) / len(workers), 1),
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model", choices=["stub", "real"], default="stub")
+    parser.add_argument("--stub-weights-mb", type=int, default=200,
+                        help="size of the stub's fake weights, standing in for a real model")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for preload in (True, False):
+        result = run(preload, args, args.port)
+        results.append(result)
+        print(f"preload={str(preload):5s}  startup {result['startup_s']:6.2f}s  "
+              f"worker USS {result['mean_worker_uss_mb']:7.1f} MB  total PSS {result['total_pss_mb']:7.1f} MB")
+        for index, worker in enumerate(result["workers"]):
+            print(f"    worker {index}: RSS {worker['rss_mb']:7.1f} MB  PSS {worker['pss_mb']:7.1f} MB  "
+                  f"USS {worker['uss_mb']:7.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({"workers": args.workers, "model": args.model, "runs": results}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
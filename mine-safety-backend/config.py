@@ -1,3 +1,4 @@
+from typing import Literal
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -5,6 +6,164 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     DATABASE_URL: str = "sqlite:///./mine_safety.db"
+    # Async connection pool used by the API endpoints
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+
+    # SQLite: "concurrent" enables WAL, tuned pragmas and a single writer
+    # connection; "default" keeps the driver defaults
+    SQLITE_PROFILE: Literal["default", "concurrent"] = "concurrent"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_SYNCHRONOUS: Literal["OFF", "NORMAL", "FULL"] = "NORMAL"
+    SQLITE_CACHE_SIZE_KB: int = 65536
+    SQLITE_MMAP_SIZE_MB: int = 256
+
+    # Auth cache (token signatures and resolved users)
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    AUTH_TOKEN_CACHE_SIZE: int = 4096
+    AUTH_USER_CACHE_SIZE: int = 1024
+
+    # Password hashing (stored hashes are upgraded on login when the cost changes)
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE_SIZE: int = 32
+
+    # Conditional GET / response cache for dashboard and history
+    RESPONSE_CACHE_SIZE: int = 2048
+    RESPONSE_CACHE_TTL_SECONDS: int = 30
+    # How long a worker trusts its cached per-user version before re-reading it
+    # (bounds staleness when another worker wrote the detection)
+    RESPONSE_VERSION_TTL_SECONDS: float = 2.0
+
+    # Detection inserts: "direct" commits per request, "flush" batches and waits
+    # for the commit, "enqueue" batches and acknowledges once queued
+    DETECTION_WRITE_MODE: Literal["direct", "flush", "enqueue"] = "direct"
+    DETECTION_WRITE_BATCH_SIZE: int = 50
+    DETECTION_WRITE_FLUSH_MS: int = 50
+    DETECTION_WRITE_QUEUE_SIZE: int = 1000
+    # Retries of a failed batch (backoff doubling from RETRY_MS) before rows
+    # are written one by one; rows that still fail are appended here
+    DETECTION_WRITE_RETRIES: int = 3
+    DETECTION_WRITE_RETRY_MS: int = 100
+    DETECTION_WRITE_DEAD_LETTER_FILE: str = "failed_detections.jsonl"
+
+    # Retention: detections older than ARCHIVE_AFTER_DAYS move to the archive
+    # table and their files into compressed bundles under ARCHIVE_DIR; archived
+    # data older than ARCHIVE_RETENTION_DAYS is deleted (0 disables either step;
+    # archiving is opt-in, archived rows only show in History with archived=true)
+    ARCHIVE_AFTER_DAYS: int = 0
+    ARCHIVE_RETENTION_DAYS: int = 0
+    ARCHIVE_DIR: str = "archive"
+    ARCHIVE_BATCH_SIZE: int = 500
+    # How often the background archiver runs (0 leaves it to `python archive.py`)
+    ARCHIVE_INTERVAL_MINUTES: int = 60
+    
+    # "auto" loads best.onnx / yolov8n.pt; "stub" uses the deterministic model
+    # from stub_model.py so load tests run without weights
+    DETECTION_MODEL: Literal["auto", "stub"] = "auto"
+    DETECTION_STUB_INFERENCE_MS: float = 0.0
+    # Model registry (model_registry.py): manifest of named, versioned models,
+    # how often workers re-read it, and predictions run to warm a model up
+    MODEL_REGISTRY_FILE: str = "model_registry.json"
+    MODEL_REGISTRY_POLL_SECONDS: int = 10
+    MODEL_WARMUP_RUNS: int = 2
+    # Shadow evaluation caps (shadow.py): queued jobs, share of one core the
+    # shadow thread may use, its niceness, and how long a job may wait for
+    # the primary path to go idle before it is dropped
+    SHADOW_QUEUE_SIZE: int = 8
+    SHADOW_MAX_CPU_FRACTION: float = 0.25
+    SHADOW_NICE: int = 19
+    SHADOW_MAX_WAIT_SECONDS: float = 5.0
+    # Person gate before the full model (person_gate.py): "off", "hog" or
+    # "model"; HOG input width and score threshold; the small model, its
+    # input size, person class and confidence; share of skipped frames
+    # checked with the full model anyway; and the changed-pixel fraction
+    # below which a video frame reuses the previous result (0: off)
+    PERSON_GATE: Literal["off", "hog", "model"] = "off"
+    PERSON_GATE_WIDTH: int = 320
+    PERSON_GATE_HOG_THRESHOLD: float = 0.0
+    PERSON_GATE_MODEL: str = "yolov8n.pt"
+    PERSON_GATE_IMGSZ: int = 320
+    PERSON_GATE_CLASS: int = 0
+    PERSON_GATE_CONFIDENCE: float = 0.25
+    PERSON_GATE_AUDIT_RATE: float = 0.0
+    PERSON_GATE_MOTION_THRESHOLD: float = 0.0
+    # Second pass over padded person crops (crop_refine.py): "off",
+    # "nearest" or "all"; padding as a fraction of the box; the crops'
+    # inference size; people at least this tall are skipped; crops per
+    # image; and the pass's time budget per image (0: unlimited)
+    CROP_REFINE: Literal["off", "nearest", "all"] = "off"
+    CROP_REFINE_PADDING: float = 0.15
+    CROP_REFINE_IMGSZ: int = 640
+    CROP_REFINE_MIN_PERSON_PX: int = 320
+    CROP_REFINE_MAX_CROPS: int = 3
+    CROP_REFINE_BUDGET_MS: float = 250.0
+    # Tiled inference for large images (tiling.py): "off", "auto" (images
+    # whose long side reaches TILE_MIN_IMAGE_PX) or "always"; tile size and
+    # overlap, tiles per model call, the most tiles per image, NMS IoU for
+    # merging, whether the whole frame runs too, and the greyscale std-dev
+    # under which a tile counts as empty (0: run every tile)
+    TILED_INFERENCE: Literal["off", "auto", "always"] = "off"
+    TILE_MIN_IMAGE_PX: int = 1920
+    TILE_SIZE: int = 640
+    TILE_OVERLAP: float = 0.2
+    TILE_BATCH: int = 4
+    TILE_MAX_TILES: int = 16
+    TILE_NMS_IOU: float = 0.5
+    TILE_FULL_FRAME: bool = True
+    TILE_EMPTY_STD: float = 6.0
+    # Latency-SLO controller (quality.py): /api/detect p95 target (0: off),
+    # the window it is measured over, detections waiting for a slot that
+    # also count as overload (0: ignore), time and samples between steps,
+    # and the share of the target p95 must fall under to step back up.
+    # Levels are "imgsz/video frames[/registry model key]", best first
+    SLO_P95_MS: float = 0.0
+    SLO_WINDOW_SECONDS: float = 30.0
+    SLO_MAX_QUEUE: int = 8
+    SLO_HOLD_SECONDS: float = 10.0
+    SLO_MIN_SAMPLES: int = 20
+    SLO_RECOVER_FRACTION: float = 0.6
+    QUALITY_LEVELS: str = "640/10,640/5,640/2"
+    # Admission control for /api/detect (admission.py): detections waiting
+    # per worker, detections one user may run at once (0: half the slots)
+    # and have waiting, the longest a detection may wait, a video's cost in
+    # images, and fair-share weights by username ("name=2,other=0.5")
+    ADMISSION_QUEUE_SIZE: int = 32
+    ADMISSION_USER_CONCURRENCY: int = 0
+    ADMISSION_USER_QUEUE: int = 4
+    ADMISSION_MAX_WAIT_SECONDS: float = 30.0
+    ADMISSION_VIDEO_COST: float = 5.0
+    ADMISSION_USER_WEIGHTS: str = ""
+    # Size of the stub's fake weight buffer, to measure memory sharing between workers
+    DETECTION_STUB_WEIGHTS_MB: int = 0
+
+    # Multi-worker launch (gunicorn -c gunicorn_conf.py): 0 picks defaults so
+    # that workers x inference threads matches the CPUs available
+    WEB_CONCURRENCY: int = 0
+    # CPU thread budget (see thread_budget.py): cores per inference, torch
+    # inter-op threads, inferences at once per process (0: one, which then
+    # gets all the process's cores; predictions on one model are serialised)
+    # and CPU pinning ("" off, "auto" one slice per worker, or e.g. "0-3")
+    INFERENCE_THREADS: int = 0
+    INFERENCE_INTEROP_THREADS: int = 1
+    INFERENCE_CONCURRENCY: int = 0
+    CPU_AFFINITY: str = ""
+    # Directory where each worker process writes its metrics so that /metrics
+    # on any worker reports the sum over all of them (see metrics.py); with
+    # several workers gunicorn_conf.py uses a temporary one when this is empty
+    METRICS_MULTIPROC_DIR: str = ""
+    # How often a worker writes its metrics there (it also does on every scrape)
+    METRICS_SYNC_SECONDS: float = 5.0
+
+    # Admin endpoints and on-demand profiling are disabled while this is empty
+    ADMIN_TOKEN: str = ""
+    # Fraction of requests profiled at random (requests with X-Profile: 1 and
+    # the admin token are always profiled)
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_INTERVAL_MS: int = 5
+    PROFILE_MAX_CONCURRENT: int = 2
+    PROFILE_STORE_SIZE: int = 50
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,174 @@
+"""Second, higher-resolution pass over person crops for small, distant workers.
+
+At 640 px input the hardhat and vest of a distant worker are a few pixels
+wide and get missed. With CROP_REFINE set, every selected person box is
+padded by CROP_REFINE_PADDING of its size, cropped from the original frame
+and run through the same model at CROP_REFINE_IMGSZ (ultralytics upscales the
+crop to that size). Gear found in the crops is mapped back to frame
+coordinates and merged into the first pass's gear before the nearest-person
+check; where both passes found the same item, the more confident box stays.
+
+    nearest   only the person the verdict is based on (the largest box)
+    all       every person, largest first, up to CROP_REFINE_MAX_CROPS
+
+People at least CROP_REFINE_MIN_PERSON_PX tall are already well resolved and
+aren't refined. The pass stops once another crop would push it past
+CROP_REFINE_BUDGET_MS, estimated from recent crops. Its time is the
+crop_refine stage in Server-Timing and /metrics, and /api/admin/crop-refine
+summarises what it added in this worker.
+"""
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+import metrics
+import profiling
+from config import settings
+from person_gate import as_bgr
+
+# A crop box this much overlapping a first-pass box of the same class is the same item
+DUPLICATE_IOU = 0.5
+
+
+def _iou(a: List[float], b: List[float]) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _area(person: Dict) -> float:
+    x1, y1, x2, y2 = person["coords"]
+    return (x2 - x1) * (y2 - y1)
+
+
+class RefineStats:
+    """Crop refinement results in this process"""
+
+    def __init__(self):
+        self.since = datetime.utcnow()
+        self.outcomes: Counter = Counter()
+        self.crop_ms: deque = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str, count: int = 1):
+        if profiling.is_muted() or not count:
+            return
+        with self._lock:
+            self.outcomes[outcome] += count
+        metrics.CROP_REFINE_RESULTS.labels(outcome).inc(count)
+
+    def record_crop(self, seconds: float):
+        if profiling.is_muted():
+            return
+        with self._lock:
+            self.crop_ms.append(seconds * 1000)
+
+    def expected_crop_ms(self) -> float:
+        """Median of the recent crops, so one slow outlier doesn't stop the pass"""
+        with self._lock:
+            recent = sorted(list(self.crop_ms)[-50:])
+        return recent[len(recent) // 2] if recent else 0.0
+
+    def summary(self) -> dict:
+        with self._lock:
+            outcomes = dict(self.outcomes)
+            crop_ms = sorted(self.crop_ms)
+        return {
+            "since": self.since,
+            "crops": outcomes.get("cropped", 0),
+            "skipped_large": outcomes.get("skipped_large", 0),
+            "skipped_budget": outcomes.get("skipped_budget", 0),
+            "gear_added": outcomes.get("gear_added", 0),
+            "gear_replaced": outcomes.get("gear_replaced", 0),
+            "mean_crop_ms": round(sum(crop_ms) / len(crop_ms), 1) if crop_ms else None,
+            "p95_crop_ms": round(crop_ms[min(len(crop_ms) - 1, int(round(0.95 * (len(crop_ms) - 1))))], 1)
+            if crop_ms else None,
+        }
+
+
+class CropRefiner:
+    def __init__(self, class_mapping: Dict[int, str]):
+        self.mode = settings.CROP_REFINE
+        self.class_mapping = class_mapping
+        self.stats = RefineStats()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _select(self, persons: List[Dict]) -> List[Dict]:
+        ordered = sorted(persons, key=_area, reverse=True)
+        if self.mode == "nearest":
+            return ordered[:1]
+        return ordered[:max(1, settings.CROP_REFINE_MAX_CROPS)]
+
+    def _crop(self, image: np.ndarray, coords: List[float]):
+        """Padded crop of one person box and its top-left corner in the frame"""
+        height, width = image.shape[:2]
+        x1, y1, x2, y2 = coords
+        pad_x = (x2 - x1) * settings.CROP_REFINE_PADDING
+        pad_y = (y2 - y1) * settings.CROP_REFINE_PADDING
+        left, top = max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y))
+        right, bottom = min(width, int(np.ceil(x2 + pad_x))), min(height, int(np.ceil(y2 + pad_y)))
+        return image[top:bottom, left:right], left, top
+
+    def _detect(self, model, crop: np.ndarray, left: int, top: int, conf: float) -> List[Dict]:
+        found = []
+        for r in model.predict(source=crop, imgsz=settings.CROP_REFINE_IMGSZ, conf=conf, verbose=False):
+            if r.boxes is None:
+                continue
+            for box in r.boxes:
+                name = self.class_mapping.get(int(box.cls[0]), f"Unknown_{int(box.cls[0])}")
+                if name == "Person":
+                    continue
+                x1, y1, x2, y2 = box.xyxy[0].tolist()
+                found.append({
+                    "name": name,
+                    "coords": [x1 + left, y1 + top, x2 + left, y2 + top],
+                    "confidence": float(box.conf[0]),
+                })
+        return found
+
+    def _merge(self, gear: List[Dict], found: List[Dict]):
+        for item in found:
+            same = [g for g in gear if g["name"] == item["name"] and _iou(g["coords"], item["coords"]) >= DUPLICATE_IOU]
+            if not same:
+                gear.append(item)
+                self.stats.record("gear_added")
+                continue
+            best = max(same, key=lambda g: g["confidence"])
+            if item["confidence"] > best["confidence"]:
+                best.update(item)
+                self.stats.record("gear_replaced")
+
+    def refine(self, model, image, persons: List[Dict], gear: List[Dict], conf: float) -> List[Dict]:
+        """First-pass gear plus what the crops of the selected people add"""
+        image = as_bgr(image)
+        gear = [dict(item) for item in gear]
+        budget_ms = settings.CROP_REFINE_BUDGET_MS
+        start = time.perf_counter()
+        selected = self._select(persons)
+        for index, person in enumerate(selected):
+            x1, y1, x2, y2 = person["coords"]
+            if y2 - y1 >= settings.CROP_REFINE_MIN_PERSON_PX:
+                self.stats.record("skipped_large")
+                continue
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if budget_ms > 0 and elapsed_ms + self.stats.expected_crop_ms() > budget_ms:
+                self.stats.record("skipped_budget", len(selected) - index)
+                break
+            crop, left, top = self._crop(image, person["coords"])
+            if crop.size == 0:
+                continue
+            crop_start = time.perf_counter()
+            found = self._detect(model, crop, left, top, conf)
+            self.stats.record_crop(time.perf_counter() - crop_start)
+            self.stats.record("cropped")
+            self._merge(gear, found)
+        return gear
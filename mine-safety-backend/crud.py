@@ -0,0 +1,129 @@
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+import models
+import stats
+
+ITEM_KINDS = ("detected", "missing")
+
+
+def detection_item_rows(detection) -> List[Dict]:
+    """Normalized detection_items rows for a flushed detection (or a row with the same columns)"""
+    rows = []
+    for kind, value in (("detected", detection.detected_items), ("missing", detection.missing_items)):
+        for item in dict.fromkeys(stats.parse_items(value)):
+            rows.append({
+                "detection_id": detection.id,
+                "user_id": detection.user_id,
+                "created_at": detection.created_at,
+                "item": item,
+                "kind": kind
+            })
+    return rows
+
+
+def add_detections(db: Session, detections: List[models.Detection]) -> List[models.Detection]:
+    """Stage new detections and everything derived from them in the caller's transaction"""
+    db.add_all(detections)
+    db.flush()
+
+    item_rows = [row for detection in detections for row in detection_item_rows(detection)]
+    if item_rows:
+        db.execute(insert(models.DetectionItem), item_rows)
+
+    stats.record_detections(db, detections)
+    return detections
+
+
+def _item_filter(user_id: int, kind: str, item: Optional[str] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None):
+    criteria = [models.DetectionItem.user_id == user_id, models.DetectionItem.kind == kind]
+    if item is not None:
+        criteria.append(models.DetectionItem.item == item)
+    if start is not None:
+        criteria.append(models.DetectionItem.created_at >= start)
+    if end is not None:
+        criteria.append(models.DetectionItem.created_at <= end)
+    return criteria
+
+
+def detection_ids_with_item(user_id: int, kind: str, item: str,
+                            start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Subquery of detection ids carrying an item, served by the (user, kind, item, created_at) index"""
+    return select(models.DetectionItem.detection_id).where(*_item_filter(user_id, kind, item, start, end))
+
+
+def count_items(db: Session, user_id: int, kind: str,
+                start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """How many detections carried each item in a time range, most frequent first"""
+    total = func.count(models.DetectionItem.id)
+    return db.query(models.DetectionItem.item, total).filter(
+        *_item_filter(user_id, kind, start=start, end=end)
+    ).group_by(models.DetectionItem.item).order_by(total.desc(), models.DetectionItem.item).all()
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(detection: models.Detection) -> str:
+    """Opaque keyset cursor pointing just past a detection in (created_at, id) order"""
+    payload = json.dumps([detection.created_at.isoformat(), detection.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, detection_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(detection_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def list_detections(db: Session, user_id: int, limit: int, cursor: Optional[str] = None,
+                    is_safe: Optional[bool] = None, file_type: Optional[str] = None,
+                    start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    missing_item: Optional[str] = None,
+                    archived: bool = False) -> Tuple[List[models.Detection], Optional[str]]:
+    """One page of a user's live (or archived) detections, newest first, using keyset pagination on (created_at, id)"""
+    model = models.ArchivedDetection if archived else models.Detection
+    query = db.query(model).filter(model.user_id == user_id)
+
+    if is_safe is not None:
+        query = query.filter(model.is_safe == is_safe)
+    if file_type is not None:
+        query = query.filter(model.file_type == file_type)
+    if start is not None:
+        query = query.filter(model.created_at >= start)
+    if end is not None:
+        query = query.filter(model.created_at <= end)
+    if missing_item is not None:
+        if archived:
+            # Archived rows have no detection_items; match the JSON column instead
+            query = query.filter(model.missing_items.contains(json.dumps(missing_item), autoescape=True))
+        else:
+            query = query.filter(model.id.in_(
+                detection_ids_with_item(user_id, "missing", missing_item, start, end)
+            ))
+    if cursor is not None:
+        created_at, detection_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < detection_id)
+        ))
+
+    rows = query.order_by(
+        model.created_at.desc(),
+        model.id.desc()
+    ).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
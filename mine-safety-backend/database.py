@@ -1,14 +1,79 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
 
+def _async_database_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto its async driver (aiosqlite, asyncpg, aiomysql)"""
+    scheme, _, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    if dialect == "mysql":
+        return f"mysql+aiomysql://{rest}"
+    return url
+
+pool_settings = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+}
+
+def _apply_sqlite_profile(sync_engine, begin: str = "BEGIN"):
+    """Tune every new SQLite connection for concurrent readers alongside one writer.
+
+    WAL lets readers proceed while a write is in progress, busy_timeout makes
+    lock waits block instead of failing immediately, and emitting BEGIN
+    ourselves (instead of the driver's implicit transactions) makes SAVEPOINTs
+    work and lets the writer take its lock up front with BEGIN IMMEDIATE.
+    """
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(sync_engine, "begin")
+    def _on_begin(connection):
+        connection.exec_driver_sql(begin)
+
 # Create engine with appropriate settings based on database type
 if settings.DATABASE_URL.startswith("sqlite"):
     engine = create_engine(
         settings.DATABASE_URL, 
         connect_args={"check_same_thread": False}
     )
+    # aiosqlite defaults to NullPool; pool connections like the other databases
+    async_engine = create_async_engine(
+        _async_database_url(settings.DATABASE_URL),
+        poolclass=AsyncAdaptedQueuePool,
+        **pool_settings
+    )
+    if settings.SQLITE_PROFILE == "concurrent":
+        # All writes go through a single connection, so writers queue in the pool
+        # instead of fighting over SQLite's file lock; reads keep their own pool
+        async_write_engine = create_async_engine(
+            _async_database_url(settings.DATABASE_URL),
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=settings.DB_POOL_TIMEOUT
+        )
+        _apply_sqlite_profile(engine)
+        _apply_sqlite_profile(async_engine.sync_engine)
+        _apply_sqlite_profile(async_write_engine.sync_engine, begin="BEGIN IMMEDIATE")
+    else:
+        async_write_engine = async_engine
 else:
     # For MySQL and other databases
     engine = create_engine(
@@ -16,8 +81,19 @@ else:
         pool_pre_ping=True,
         pool_recycle=3600
     )
+    async_engine = create_async_engine(
+        _async_database_url(settings.DATABASE_URL),
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        **pool_settings
+    )
+    async_write_engine = async_engine
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Detached objects stay readable after commit, since endpoints serialize them afterwards
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+# Sessions that insert or update rows (the serialized writer connection on SQLite)
+AsyncWriteSessionLocal = async_sessionmaker(async_write_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -27,3 +103,20 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_async_engines():
+    """Close pooled async connections (aiosqlite keeps a thread per connection)"""
+    await async_engine.dispose()
+    if async_write_engine is not async_engine:
+        await async_write_engine.dispose()
+
+def dispose_after_fork():
+    """Drop pooled connections inherited from the parent process without closing them"""
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+    if async_write_engine is not async_engine:
+        async_write_engine.sync_engine.dispose(close=False)
@@ -1,17 +1,29 @@
 import os
 import json
 import io
+import time
+import thread_budget  # sets BLAS thread counts before NumPy loads
 import cv2
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
 from PIL import Image
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from pydantic import BaseModel
 
+import metrics
+import crop_refine
+import model_registry
+import person_gate
+import profiling
+import quality
+import tiling
+from config import settings
+
 
 class DetectionService:
     def __init__(self):
-        self.model = None
+        self.registry = model_registry.ModelRegistry(settings.MODEL_REGISTRY_FILE,
+                                                     settings.MODEL_REGISTRY_POLL_SECONDS)
         self.conf_threshold = 0.45
         
         # Required safety equipment
@@ -46,56 +58,45 @@ class DetectionService:
             24: "wheel loader"
         }
         
-        # Load model
+        # Load model (warmed later, in the serving process)
         self.load_model()
+        self.gate = person_gate.PersonGate()
+        self.refiner = crop_refine.CropRefiner(self.class_mapping)
+        self.tiler = tiling.Tiler()
+        metrics.MODEL_LOADED.set_function(lambda: 1 if self.model is not None else 0)
+        self.set_threads(thread_budget.default_threads())
+
+    def set_threads(self, threads: int, cpus: Optional[List[int]] = None, processes: int = 1):
+        """Apply the CPU thread budget (see thread_budget.py) to every inference library"""
+        budget = thread_budget.apply(threads, settings.INFERENCE_INTEROP_THREADS, cpus, processes)
+        pinned = f", pinned to CPUs {budget['cpus']}" if budget["cpus"] else ""
+        print(f"✓ Thread budget: {budget['threads']} threads per inference, "
+              f"{budget['concurrency']} inferences at once{pinned}")
+
+    def prepare_for_fork(self):
+        """Finish building the model before workers are forked, so they share its weights.
+
+        ultralytics fuses Conv+BatchNorm layers on the first prediction, which
+        would give every worker its own fused copy. ONNX models have no module
+        here; their runtime session is created in each worker on first use.
+        """
+        for entry in self.registry.entries.values():
+            network = getattr(entry.model, "model", None)
+            if hasattr(network, "fuse"):
+                network.fuse(verbose=False)
     
     def load_model(self):
-        """Load YOLO model"""
-        try:
-            from ultralytics import YOLO
-            
-            # Try to load model (check multiple possible locations)
-            model_paths = [
-                os.path.join(os.path.dirname(__file__), "best.onnx"),  # Same dir as this file
-                "best.onnx",  # Current directory
-                os.path.join(os.path.dirname(__file__), "yolov8n.pt"),  # PyTorch model fallback
-                "yolov8n.pt"
-            ]
-            
-            for model_path in model_paths:
-                if not os.path.exists(model_path):
-                    continue
-                    
-                full_path = os.path.abspath(model_path)
-                print(f"Attempting to load: {full_path}")
-                
-                try:
-                    # Explicitly declare task="detect" to suppress the Ultralytics warning
-                    if model_path.endswith('.onnx'):
-                        print("  Loading ONNX model...")
-                        self.model = YOLO(model_path, task="detect")
-                    else:
-                        print("  Loading PyTorch model...")
-                        self.model = YOLO(model_path, task="detect")
-                    
-                    if self.model is not None:
-                        print(f"✓ Model loaded successfully!")
-                        return
-                        
-                except Exception as load_error:
-                    print(f"  Failed: {load_error}")
-                    self.model = None
-                    continue
-            
-            print("❌ No valid model could be loaded")
-            self.model = None
-            
-        except ImportError as e:
-            print(f"❌ ultralytics not installed: {e}")
-            self.model = None
-        except Exception as e:
-            print(f"❌ Unexpected error: {e}")
-            self.model = None
+        """Load the models listed in the registry manifest, or the default model file"""
+        self.registry.sync(warm=False)
+
+    @property
+    def model(self):
+        entry = self.registry.active
+        return entry.model if entry is not None else None
+
+    @model.setter
+    def model(self, model):
+        self.registry.use(model)
     
     def calculate_iou(self, boxA: List[float], boxB: List[float]) -> float:
         """Calculate how much Box A overlaps with Box B"""
@@ -115,141 +116,224 @@ class DetectionService:
         return interArea / float(boxAArea)
 
 
-    def detect_image(self, image: Image.Image) -> Dict:
-        """Detect safety equipment using spatial logic focused ONLY on the nearest person."""
-        if self.model is None:
-            return self._placeholder_detection()
+    def _decode(self, image_path: str) -> np.ndarray:
+        """Read an image file into the BGR array the model expects"""
+        image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"Could not decode image: {image_path}")
+        return image
+
+    def _collect_boxes(self, results):
+        """Split raw model output into people and gear, recording the model's own stage timings"""
+        persons = []
+        gear = []
         
-        try:
-            results = self.model.predict(
-                source=image, 
-                conf=self.conf_threshold,
-                verbose=False
-            )
+        for r in results:
+            speed = getattr(r, "speed", None) or {}
+            for stage in ("preprocess", "inference", "postprocess"):
+                if speed.get(stage) is not None:
+                    profiling.record_stage(stage, speed[stage] / 1000)
             
-            persons = []
-            gear = []
+            if r.boxes is None or len(r.boxes) == 0:
+                continue
             
-            for r in results:
-                if r.boxes is None or len(r.boxes) == 0:
-                    continue
+            for box in r.boxes:
+                class_id = int(box.cls[0])
                 
-                for box in r.boxes:
-                    class_id = int(box.cls[0])
-                    
-                    # USE OUR LOCAL DICTIONARY INSTEAD OF THE MODEL'S
-                    class_name = self.class_mapping.get(class_id, f"Unknown_{class_id}")
-                    
-                    coords = box.xyxy[0].tolist()
-                    confidence = float(box.conf[0])
-                    
-                    if class_name == "Person":
-                        persons.append({
-                            'coords': coords,
-                            'confidence': confidence
-                        })
-                    else:
-                        gear.append({
-                            'name': class_name,
-                            'coords': coords,
-                            'confidence': confidence
-                        })
-            
-            # 1. Check if any person is in frame
-            if not persons:
-                return {
-                    "is_safe": False,
-                    "confidence": 0,
-                    "detected_items": json.dumps([]),
-                    "missing_items": json.dumps(self.required_items),
-                    "reason": "No person detected in the frame."
-                }
-            
-            # 2. ISOLATE NEAREST PERSON: Find the person with the largest bounding box area
-            nearest_person = max(
-                persons,
-                key=lambda p: (p['coords'][2] - p['coords'][0]) * (p['coords'][3] - p['coords'][1])
-            )
-            
-            # 3. ONLY match gear that physically overlaps with this specific nearest person
-            nearest_person_gear = []
-            overlap_threshold = 0.30
-            
-            for item in gear:
-                overlap = self.calculate_iou(item['coords'], nearest_person['coords'])
-                if overlap > overlap_threshold:
-                    nearest_person_gear.append(item)
-            
-            # 4. Extract just the names of the gear found on the nearest person
-            # Use a set to remove duplicates (e.g., if two hardhats overlap the same person)
-            detected_gear_names = list(set([item['name'] for item in nearest_person_gear]))
-            
-            # 5. Check what is missing
-            missing_items = [req for req in self.required_items if req not in detected_gear_names]
-            is_safe = len(missing_items) == 0
-            
-            # 6. Calculate confidence ONLY from the gear on the nearest person
-            if nearest_person_gear:
-                avg_conf = sum(item['confidence'] for item in nearest_person_gear) / len(nearest_person_gear)
-                confidence = int(avg_conf * 100)
-                # Cap at 100 to be perfectly safe
-                confidence = min(100, max(0, confidence))
-            else:
-                # If they have no gear, use the confidence of the person detection itself
-                confidence = int(nearest_person['confidence'] * 100)
-            
-            # 7. Format the response
-            reason = (f"Nearest person verified safe: {', '.join(detected_gear_names)}. Entry approved." 
-                      if is_safe else 
-                      f"Nearest person missing gear: {', '.join(missing_items)}.")
-            
+                # USE OUR LOCAL DICTIONARY INSTEAD OF THE MODEL'S
+                class_name = self.class_mapping.get(class_id, f"Unknown_{class_id}")
+                
+                coords = box.xyxy[0].tolist()
+                confidence = float(box.conf[0])
+                
+                if class_name == "Person":
+                    persons.append({
+                        'coords': coords,
+                        'confidence': confidence
+                    })
+                else:
+                    gear.append({
+                        'name': class_name,
+                        'coords': coords,
+                        'confidence': confidence
+                    })
+        return persons, gear
+
+    def _evaluate(self, persons: List[Dict], gear: List[Dict]) -> Dict:
+        """Decide the verdict from the gear overlapping the nearest person"""
+        # 1. Check if any person is in frame
+        if not persons:
             return {
-                "is_safe": is_safe,
-                "confidence": confidence,
-                "detected_items": json.dumps(detected_gear_names),
-                "missing_items": json.dumps(missing_items),
-                "reason": reason
+                "is_safe": False,
+                "confidence": 0,
+                "detected_items": json.dumps([]),
+                "missing_items": json.dumps(self.required_items),
+                "reason": "No person detected in the frame."
             }
+        
+        # 2. ISOLATE NEAREST PERSON: Find the person with the largest bounding box area
+        nearest_person = max(
+            persons,
+            key=lambda p: (p['coords'][2] - p['coords'][0]) * (p['coords'][3] - p['coords'][1])
+        )
+        
+        # 3. ONLY match gear that physically overlaps with this specific nearest person
+        nearest_person_gear = []
+        overlap_threshold = 0.30
+        
+        for item in gear:
+            overlap = self.calculate_iou(item['coords'], nearest_person['coords'])
+            if overlap > overlap_threshold:
+                nearest_person_gear.append(item)
+        
+        # 4. Extract just the names of the gear found on the nearest person
+        # Use a set to remove duplicates (e.g., if two hardhats overlap the same person)
+        detected_gear_names = list(set([item['name'] for item in nearest_person_gear]))
+        
+        # 5. Check what is missing
+        missing_items = [req for req in self.required_items if req not in detected_gear_names]
+        is_safe = len(missing_items) == 0
+        
+        # 6. Calculate confidence ONLY from the gear on the nearest person
+        if nearest_person_gear:
+            avg_conf = sum(item['confidence'] for item in nearest_person_gear) / len(nearest_person_gear)
+            confidence = int(avg_conf * 100)
+            # Cap at 100 to be perfectly safe
+            confidence = min(100, max(0, confidence))
+        else:
+            # If they have no gear, use the confidence of the person detection itself
+            confidence = int(nearest_person['confidence'] * 100)
+        
+        # 7. Format the response
+        reason = (f"Nearest person verified safe: {', '.join(detected_gear_names)}. Entry approved." 
+                  if is_safe else 
+                  f"Nearest person missing gear: {', '.join(missing_items)}.")
+        
+        return {
+            "is_safe": is_safe,
+            "confidence": confidence,
+            "detected_items": json.dumps(detected_gear_names),
+            "missing_items": json.dumps(missing_items),
+            "reason": reason
+        }
+
+    def _entry_for(self, entry: Optional[model_registry.ModelEntry], level: int):
+        """The caller's model, else the quality level's model if loaded, else the active one"""
+        if entry is not None:
+            return entry
+        key = quality.level(level).model
+        candidate = self.registry.entries.get(key) if key else None
+        return candidate if candidate is not None and candidate.model is not None else self.registry.active
+
+    def detect_image(self, image: Union[str, Image.Image, np.ndarray],
+                     entry: Optional[model_registry.ModelEntry] = None, level: int = 0) -> Dict:
+        """Detect safety equipment using spatial logic focused ONLY on the nearest person."""
+        # Taken once, so a model switch mid-request doesn't change this result's model
+        entry = self._entry_for(entry, level)
+        preset = quality.level(level)
+        if entry is None or entry.model is None:
+            return self._placeholder_detection("model_unavailable")
+        
+        try:
+            if isinstance(image, str):
+                with profiling.stage("decode"):
+                    image = self._decode(image)
+
+            gated = False
+            if self.gate.enabled:
+                start = time.perf_counter()
+                with profiling.stage("person_gate"):
+                    gated = not self.gate.person_likely(image)
+                gate_seconds = time.perf_counter() - start
+                if not gated:
+                    self.gate.stats.record("passed", gate_seconds)
+                elif not self.gate.audit():
+                    self.gate.stats.record("skipped", gate_seconds)
+                    result = self._evaluate([], [])
+                    result["model_version"] = entry.key
+                    result["quality_level"] = level
+                    return result
+            
+            # Only full quality (level 0) pays for the extra passes
+            with entry.lock:
+                if level == 0 and self.tiler.applies(image):
+                    results = self.tiler.predict(entry.model, image, self.conf_threshold)
+                else:
+                    results = entry.model.predict(
+                        source=image, 
+                        conf=self.conf_threshold,
+                        imgsz=preset.imgsz,
+                        verbose=False
+                    )
+            
+            with profiling.stage("matching"):
+                persons, gear = self._collect_boxes(results)
+            if level == 0 and persons and self.refiner.enabled:
+                with profiling.stage("crop_refine"), entry.lock:
+                    gear = self.refiner.refine(entry.model, image, persons, gear, self.conf_threshold)
+            with profiling.stage("matching"):
+                result = self._evaluate(persons, gear)
+            if gated:
+                self.gate.stats.record("audit_missed" if persons else "audit_agreed", gate_seconds)
+            result["model_version"] = entry.key
+            result["quality_level"] = level
+            return result
             
         except Exception as e:
             print(f"❌ Detection error: {e}")
             import traceback
             traceback.print_exc()
-            return self._placeholder_detection()
+            return self._placeholder_detection("error")
 
             
-    def detect_video(self, video_path: str) -> Dict:
+    def detect_video(self, video_path: str, entry: Optional[model_registry.ModelEntry] = None,
+                     level: int = 0) -> Dict:
         """Video detection - analyze key frames"""
+        # Every frame of one video goes through the same model
+        entry = self._entry_for(entry, level)
+        if entry is None or entry.model is None:
+            return self._placeholder_detection("model_unavailable")
         try:
             cap = cv2.VideoCapture(video_path)
             frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
             
-            # Analyze every 30th frame
-            frames_to_analyze = max(1, min(frame_count // 30, 10))
+            # Analyze every 30th frame, up to the quality level's frame count
+            frames_to_analyze = max(1, min(frame_count // 30, quality.level(level).video_frames))
             frame_interval = frame_count // frames_to_analyze if frames_to_analyze > 0 else 1
             
             all_results = []
+            # (thumbnail, result) of the last frame the model analysed, for the motion check
+            previous = None
             
             for i in range(frames_to_analyze):
                 frame_idx = i * frame_interval
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                ret, frame = cap.read()
-                
-                if not ret:
-                    break
-                
-                # Convert OpenCV BGR frame to PIL RGB Image
-                color_converted = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                pil_image = Image.fromarray(color_converted)
+                with profiling.stage("decode"):
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                    ret, frame = cap.read()
+                    
+                    if not ret:
+                        break
+
+                    # A frame that hardly changed gets the previous frame's result
+                    thumbnail = self.gate.thumbnail(frame)
+                    if previous is not None and thumbnail is not None and not self.gate.moved(previous[0], thumbnail):
+                        self.gate.stats.record("static")
+                        all_results.append(previous[1])
+                        continue
+                    
+                    # Convert OpenCV BGR frame to PIL RGB Image
+                    color_converted = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    pil_image = Image.fromarray(color_converted)
                 
                 # Detect on frame
-                result = self.detect_image(pil_image)
+                result = self.detect_image(pil_image, entry, level)
                 all_results.append(result)
+                previous = (thumbnail, result)
                 
             cap.release()
             
             if not all_results:
-                return self._placeholder_detection()
+                return self._placeholder_detection("no_frames")
             
             # Use most conservative result (if any frame is unsafe, video is unsafe)
             is_safe = all(r['is_safe'] for r in all_results)
@@ -273,23 +357,29 @@ class DetectionService:
                 "confidence": avg_confidence,
                 "detected_items": json.dumps(list(all_detected)),
                 "missing_items": json.dumps(list(all_missing)),
-                "reason": reason
+                "reason": reason,
+                "model_version": entry.key,
+                "quality_level": level
             }
         
         except Exception as e:
             print(f"Video detection error: {e}")
             import traceback
             traceback.print_exc()
-            return self._placeholder_detection()
+            return self._placeholder_detection("error")
 
-    def _placeholder_detection(self) -> Dict:
+    def _placeholder_detection(self, cause: str = "model_unavailable") -> Dict:
         """Fallback when model fails"""
+        if not profiling.is_muted():
+            metrics.PLACEHOLDER_FALLBACKS.labels(cause).inc()
         return {
             "is_safe": False,
             "confidence": 0,
             "detected_items": json.dumps([]),
             "missing_items": json.dumps(self.required_items),
-            "reason": "Detection service unavailable. Please check model configuration."
+            "reason": "Detection service unavailable. Please check model configuration.",
+            "model_version": None,
+            "quality_level": None
         }
 
 # Singleton instance
@@ -0,0 +1,76 @@
+"""Gunicorn settings for several uvicorn workers sharing one copy of the model.
+
+    gunicorn -c gunicorn_conf.py main:app
+
+The app (and with it the detection model) is imported once in the master
+process and the workers are forked from it, so the model weights and the
+imported libraries sit in copy-on-write pages shared by every worker. Each
+worker only pays for what it writes to afterwards.
+
+WEB_CONCURRENCY and INFERENCE_THREADS default to filling the available CPUs:
+two inference threads per worker from 4 CPUs up, one below (thread_budget.py).
+Measure a setup with benchmarks/workers_memory.py and benchmarks/thread_budget.py.
+
+Each worker writes its metrics to METRICS_MULTIPROC_DIR (a temporary
+directory unless set), so that /metrics on any worker covers all of them.
+"""
+import gc
+import glob
+import os
+import tempfile
+
+import thread_budget
+from config import settings
+from thread_budget import cpu_count, worker_budget
+
+
+workers, inference_threads = worker_budget(cpu_count())
+
+if workers > 1 and not settings.METRICS_MULTIPROC_DIR:
+    settings.METRICS_MULTIPROC_DIR = tempfile.mkdtemp(prefix="mine_safety_metrics_")
+    # For workers that import the app themselves (preload_app off)
+    os.environ["METRICS_MULTIPROC_DIR"] = settings.METRICS_MULTIPROC_DIR
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Video detections can take a while on small instances
+timeout = 120
+graceful_timeout = 30
+
+
+def on_starting(server):
+    directory = settings.METRICS_MULTIPROC_DIR
+    if directory:
+        # Values left by a previous run would be added to this one's
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            os.remove(path)
+
+
+def when_ready(server):
+    server.log.info(f"Forking {workers} workers x {inference_threads} inference threads")
+    if not server.cfg.preload_app:
+        return
+    from detection_service import detection_service
+
+    detection_service.prepare_for_fork()
+    # Move everything loaded so far out of the collector's reach: a worker's GC
+    # pass would otherwise write to every object header and unshare the pages
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from database import dispose_after_fork
+    from detection_service import detection_service
+
+    # Connections opened by migrations in the master must not be shared
+    dispose_after_fork()
+    detection_service.set_threads(inference_threads, thread_budget.worker_cpus(worker.age - 1, workers), workers)
+
+
+def child_exit(server, worker):
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,65 @@
+"""Conditional GET and short-lived response caching for per-user read endpoints.
+
+Every user has a data version (user_stats.version) that is bumped with each new
+Detection. ETags are derived from (user, version, path, query) alone, so a
+matching If-None-Match is answered with 304 without touching the database, and
+serialized bodies are reused until the version moves on.
+"""
+import hashlib
+from typing import Callable
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import metrics
+import stats
+from cache import TTLCache
+from config import settings
+
+# Last known data version per user; entries for local writes are dropped immediately
+version_cache = TTLCache(maxsize=settings.RESPONSE_CACHE_SIZE, ttl=settings.RESPONSE_VERSION_TTL_SECONDS)
+# Serialized JSON bodies keyed by (user, version, path, query)
+response_cache = TTLCache(maxsize=settings.RESPONSE_CACHE_SIZE, ttl=settings.RESPONSE_CACHE_TTL_SECONDS)
+metrics.register_cache("response_version", version_cache)
+metrics.register_cache("response_body", response_cache)
+
+
+async def current_version(db: AsyncSession, user_id: int) -> int:
+    version = version_cache.get(user_id)
+    if version is None:
+        version = await db.run_sync(stats.get_user_version, user_id)
+        version_cache.set(user_id, version)
+    return version
+
+
+def invalidate_user(user_id: int):
+    """Forget a user's cached version after their detections changed"""
+    version_cache.pop(user_id)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+async def cached_json_response(request: Request, db: AsyncSession, user_id: int,
+                               render: Callable[[Session], BaseModel]) -> Response:
+    """Serve render(session) as JSON with a strong ETag, answering 304 or a cached body when unchanged"""
+    version = await current_version(db, user_id)
+    key = (user_id, version, request.url.path, tuple(sorted(request.query_params.multi_items())))
+    etag = '"' + hashlib.sha1(repr(key).encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    body = response_cache.get(key)
+    if body is None:
+        body = (await db.run_sync(render)).model_dump_json().encode()
+        response_cache.set(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
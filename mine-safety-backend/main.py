@@ -1,29 +1,91 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import uvicorn
-from datetime import timedelta
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Optional
 import os
+import mimetypes
 import shutil
+import time
+import anyio
+import anyio.to_thread
+import uuid
 from pathlib import Path
 
-from database import engine, get_db, Base
+from database import engine, get_async_db, AsyncWriteSessionLocal, dispose_async_engines
 import models
 import schemas
+import crud
+import stats
+import http_cache
+import metrics
+import profiling
+import shadow
+import quality
+import admission
+import archive
+from archive import archiver
+from write_behind import detection_writer
+from migrations import run_migrations
 from auth import (
-    get_password_hash,
-    verify_password,
+    get_password_hash_async,
+    verify_and_update_password_async,
     create_access_token,
-    get_current_user
+    get_current_user,
+    require_admin
 )
 from config import settings
 from detection_service import detection_service
+import thread_budget
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+# Create database tables and apply pending migrations
+run_migrations(engine)
 
-app = FastAPI(title="Mine Safety Detection API")
+# Inferences running at once; sized in lifespan, after a gunicorn worker re-split the budget
+inference_limiter = anyio.CapacityLimiter(1)
+# Hands the same slots out fairly between users, and sheds load when they run out
+admission_scheduler = admission.AdmissionScheduler()
+
+shadow_evaluator = shadow.ShadowEvaluator(detection_service, admission_scheduler.busy)
+# Degrades detection quality while requests queue for inference slots
+quality_controller = quality.QualityController(lambda: admission_scheduler.queued)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    inference_limiter.total_tokens = thread_budget.current["concurrency"]
+    admission_scheduler.capacity = inference_limiter.total_tokens
+    metrics.INFERENCE_SLOTS.set(inference_limiter.total_tokens)
+    # Warm the models here, in the serving process (not a gunicorn master)
+    await anyio.to_thread.run_sync(detection_service.registry.warm_all)
+    await anyio.to_thread.run_sync(detection_service.gate.warm)
+    detection_service.registry.start()
+    shadow_evaluator.start()
+    if detection_writer is not None:
+        detection_writer.start()
+    if archiver is not None:
+        archiver.start()
+    metrics.start_sync()
+    yield
+    await anyio.to_thread.run_sync(shadow_evaluator.close)
+    await detection_service.registry.close()
+    if archiver is not None:
+        await archiver.close()
+    if detection_writer is not None:
+        # Commit every queued detection before the process exits
+        await detection_writer.close()
+    metrics.stop_sync()
+    await dispose_async_engines()
+
+app = FastAPI(title="Mine Safety Detection API", lifespan=lifespan)
+
+# Server-Timing headers and opt-in request profiling
+app.add_middleware(profiling.TimingMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -51,36 +113,57 @@ def read_root():
     return {"message": "Mine Safety Detection API", "status": "running"}
 
 # Auth endpoints
+async def _find_user(db: AsyncSession, *criteria):
+    """Look up a user and end the transaction so no connection is held while hashing"""
+    result = await db.execute(select(models.User).where(*criteria))
+    db_user = result.scalars().first()
+    await db.close()
+    return db_user
+
+async def _save_user(db_user: models.User):
+    async with AsyncWriteSessionLocal() as db:
+        db_user = await db.merge(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+    return db_user
+
 @app.post("/api/auth/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await _find_user(db, models.User.username == user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+    db_user = await _find_user(db, models.User.email == user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    # Created with the user so the dashboard never has to write it
+    db_user.stats = models.UserStats(total_detections=0, total_accepted=0, total_denied=0, version=0)
+    return await _save_user(db_user)
 
 @app.post("/api/auth/login", response_model=schemas.Token)
-def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+async def login(user: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    db_user = await _find_user(db, models.User.username == user.username)
+    is_valid, new_hash = False, None
+    if db_user:
+        is_valid, new_hash = await verify_and_update_password_async(user.password, db_user.hashed_password)
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
         )
     
+    # Transparently upgrade hashes created with a different bcrypt cost
+    if new_hash:
+        db_user.hashed_password = new_hash
+        await _save_user(db_user)
+    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": db_user.username}, expires_delta=access_token_expires
@@ -92,95 +175,378 @@ def get_me(current_user: models.User = Depends(get_current_user)):
     return current_user
 
 # Detection endpoints
+def _upload_suffix(filename: Optional[str], file_type: str) -> str:
+    """Extension of the uploaded file name (the video reader goes by it), or a default"""
+    suffix = Path(filename or "").suffix.lower()
+    if len(suffix) > 1 and suffix[1:].isalnum():
+        return suffix
+    return ".jpg" if file_type == "image" else ".mp4"
+
+def _save_upload(source, file_path: Path):
+    with profiling.profiled_thread(), profiling.stage("save"):
+        with open(file_path, "wb") as buffer:
+            shutil.copyfileobj(source, buffer)
+
+def _run_detection(file_type: str, file_path: str):
+    """Returns the result and the inference time (without waiting for a slot)"""
+    with profiling.profiled_thread(), metrics.INFERENCE_IN_PROGRESS.track_inprogress():
+        start = time.perf_counter()
+        # Read once the slot is ours, so queued requests get the level set while they waited
+        level = quality_controller.level
+        if file_type == "image":
+            result = detection_service.detect_image(file_path, level=level)
+        else:
+            result = detection_service.detect_video(file_path, level=level)
+        return result, time.perf_counter() - start
+
 @app.post("/api/detect", response_model=schemas.DetectionResponse)
 async def detect_safety(
+    request: Request,
     file: UploadFile = File(...),
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user)
 ):
     # Validate file type
     allowed_types = ["image/jpeg", "image/png", "image/jpg", "video/mp4", "video/avi"]
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Invalid file type")
+    started = time.perf_counter()
     
-    # Save uploaded file
-    if file.filename:
-        file_extension = file.filename.split(".")[-1]
-    else:
-        file_extension = "jpg"  # Default extension
-    
-    file_path = UPLOAD_DIR / f"{current_user.id}_{file.filename or 'upload.jpg'}"
+    # Determine file type
+    file_type = "image" if file.content_type.startswith("image") else "video"
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Queue for an inference slot first, so an overloaded worker answers before the upload is written
+    try:
+        ticket = admission_scheduler.enqueue(
+            current_user.username, settings.ADMISSION_VIDEO_COST if file_type == "video" else 1.0
+        )
+    except admission.Rejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
     
-    # Determine file type and run detection
-    file_type = "image" if file.content_type.startswith("image") else "video"
+    # Save uploaded file under a name of its own: concurrent uploads of the same
+    # file name must never overwrite each other's evidence
+    file_path = UPLOAD_DIR / f"{current_user.id}_{uuid.uuid4().hex}{_upload_suffix(file.filename, file_type)}"
     
-    if file_type == "image":
-        result = detection_service.detect_image(str(file_path))
-    else:
-        result = detection_service.detect_video(str(file_path))
+    try:
+        # Detections beyond the thread budget wait here rather than oversubscribing the CPUs.
+        # The upload is only written once admitted, so a shed request leaves nothing on disk
+        try:
+            await ticket.wait(request.is_disconnected)
+        except admission.Rejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail,
+                                headers={"Retry-After": str(e.retry_after)})
+        except admission.ClientDisconnected:
+            raise HTTPException(status_code=499, detail="Client closed request")
+        
+        # Disk writes and inference are blocking, keep them off the event loop
+        await run_in_threadpool(_save_upload, file.file, file_path)
+        result, inference_seconds = await anyio.to_thread.run_sync(
+            _run_detection, file_type, str(file_path), limiter=inference_limiter
+        )
+    finally:
+        ticket.release()
+    metrics.VERDICTS.labels(file_type, "safe" if result["is_safe"] else "unsafe").inc()
     
     # Save detection to database
     detection = models.Detection(
         user_id=current_user.id,
         file_path=str(file_path),
+        file_name=file.filename,
         file_type=file_type,
         is_safe=result["is_safe"],
         confidence=result["confidence"],
         detected_items=result["detected_items"],
         missing_items=result["missing_items"],
-        reason=result["reason"]
+        reason=result["reason"],
+        created_at=datetime.utcnow(),
+        model_version=result["model_version"],
+        quality_level=result["quality_level"]
     )
-    db.add(detection)
-    db.commit()
-    db.refresh(detection)
+    with profiling.stage("db_write"):
+        if detection_writer is not None:
+            await detection_writer.submit(detection, wait=settings.DETECTION_WRITE_MODE == "flush")
+        else:
+            async with AsyncWriteSessionLocal() as db:
+                await db.run_sync(crud.add_detections, [detection])
+                await db.commit()
+            http_cache.invalidate_user(current_user.id)
     
+    # Queued for the shadow model's thread, if this detection is sampled
+    shadow_evaluator.submit(file_type, str(file_path), result, inference_seconds)
+    elapsed = time.perf_counter() - started
+    metrics.DETECT_SECONDS.labels(file_type).observe(elapsed)
+    quality_controller.observe(elapsed)
     return detection
 
-@app.get("/api/detections", response_model=list[schemas.DetectionResponse])
-def get_detections(
-    skip: int = 0,
-    limit: int = 50,
+@app.get("/api/detections", response_model=schemas.DetectionPage)
+async def get_detections(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    is_safe: Optional[bool] = None,
+    file_type: Optional[str] = Query(None, pattern="^(image|video)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    missing_item: Optional[str] = None,
+    archived: bool = False,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    detections = db.query(models.Detection).filter(
+    def render(session):
+        try:
+            detections, next_cursor = crud.list_detections(
+                session, current_user.id, limit,
+                cursor=cursor,
+                is_safe=is_safe,
+                file_type=file_type,
+                start=stats.as_naive_utc(start),
+                end=stats.as_naive_utc(end),
+                missing_item=missing_item,
+                archived=archived
+            )
+        except crud.InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return schemas.DetectionPage.model_validate({"items": detections, "next_cursor": next_cursor})
+    
+    return await http_cache.cached_json_response(request, db, current_user.id, render)
+
+@app.get("/api/detections/{detection_id}/file")
+async def get_detection_file(
+    detection_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    result = await db.execute(select(models.Detection).where(
+        models.Detection.id == detection_id,
         models.Detection.user_id == current_user.id
-    ).order_by(models.Detection.created_at.desc()).offset(skip).limit(limit).all()
-    return detections
+    ))
+    detection = result.scalars().first()
+    if detection is not None:
+        if not detection.file_path or not os.path.exists(detection.file_path):
+            raise HTTPException(status_code=404, detail="File not found")
+        return FileResponse(detection.file_path)
+    
+    # Not live any more: fetch it from its archive bundle on demand
+    result = await db.execute(select(models.ArchivedDetection).where(
+        models.ArchivedDetection.id == detection_id,
+        models.ArchivedDetection.user_id == current_user.id
+    ))
+    archived = result.scalars().first()
+    await db.close()
+    if archived is None or archived.file_sha256 is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    try:
+        content = await run_in_threadpool(archive.read_archived_file, archived.bundle, archived.file_sha256)
+    except (OSError, KeyError, ValueError):
+        raise HTTPException(status_code=404, detail="File not found")
+    media_type = mimetypes.guess_type(archived.file_path or "")[0] or "application/octet-stream"
+    return Response(content=content, media_type=media_type)
 
 @app.get("/api/dashboard", response_model=schemas.DashboardStats)
-def get_dashboard_stats(
+async def get_dashboard_stats(
+    request: Request,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    total_detections = db.query(models.Detection).filter(
-        models.Detection.user_id == current_user.id
-    ).count()
+    def render(session):
+        # Lifetime totals are a primary-key lookup on the maintained counters
+        user_stats = stats.get_user_stats(session, current_user.id)
+        
+        recent_detections = session.query(models.Detection).filter(
+            models.Detection.user_id == current_user.id
+        ).order_by(models.Detection.created_at.desc()).limit(10).all()
+        
+        return schemas.DashboardStats.model_validate({
+            "total_detections": user_stats.total_detections,
+            "total_accepted": user_stats.total_accepted,
+            "total_denied": user_stats.total_denied,
+            "recent_detections": recent_detections
+        })
     
-    total_accepted = db.query(models.Detection).filter(
-        models.Detection.user_id == current_user.id,
-        models.Detection.is_safe == True
-    ).count()
+    return await http_cache.cached_json_response(request, db, current_user.id, render)
+
+# Analytics endpoints (served from the rollup tables only)
+@app.get("/api/analytics/compliance", response_model=schemas.ComplianceTrend)
+async def get_compliance_trend(
+    granularity: str = Query("day", pattern="^(hour|day|week)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    start, end = stats.resolve_range(granularity, start, end)
+    rollups = await db.run_sync(stats.compliance_trend, current_user.id, granularity, start, end)
+    top_missing = await db.run_sync(stats.missing_item_counts, current_user.id, granularity, start, end, 1)
     
-    total_denied = db.query(models.Detection).filter(
-        models.Detection.user_id == current_user.id,
-        models.Detection.is_safe == False
-    ).count()
+    return {
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "buckets": [
+            {
+                "bucket_start": rollup.bucket_start,
+                "total": rollup.total,
+                "safe": rollup.safe,
+                "unsafe": rollup.unsafe,
+                "compliance_rate": rollup.safe / rollup.total if rollup.total else 0.0
+            }
+            for rollup in rollups
+        ],
+        "most_missing_item": top_missing[0][0] if top_missing else None
+    }
+
+@app.get("/api/analytics/items", response_model=schemas.ItemTrend)
+async def get_item_counts(
+    kind: str = Query("missing", pattern="^(detected|missing)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    start, end = stats.resolve_range("day", start, end)
+    counts = await db.run_sync(crud.count_items, current_user.id, kind, start, end)
     
-    recent_detections = db.query(models.Detection).filter(
-        models.Detection.user_id == current_user.id
-    ).order_by(models.Detection.created_at.desc()).limit(10).all()
+    return {
+        "kind": kind,
+        "start": start,
+        "end": end,
+        "items": [{"item": item, "count": count} for item, count in counts]
+    }
+
+@app.get("/api/analytics/missing-items", response_model=schemas.MissingItemTrend)
+async def get_missing_item_trend(
+    granularity: str = Query("day", pattern="^(hour|day|week)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    start, end = stats.resolve_range(granularity, start, end)
+    counts = await db.run_sync(stats.missing_item_counts, current_user.id, granularity, start, end)
     
     return {
-        "total_detections": total_detections,
-        "total_accepted": total_accepted,
-        "total_denied": total_denied,
-        "recent_detections": recent_detections
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "items": [{"item": item, "count": count} for item, count in counts]
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    # The request threadpool belongs to the running event loop, so sample it here
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    metrics.WORKER_THREADS.labels("busy").set(limiter.borrowed_tokens)
+    metrics.WORKER_THREADS.labels("total").set(limiter.total_tokens)
+    metrics.QUEUE_DEPTH.labels("threadpool").set(limiter.statistics().tasks_waiting)
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+# Admin endpoints (require the X-Admin-Token header)
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    """Recent request profiles of this worker, newest first"""
+    return [profile.summary() for profile in reversed(profiling.profiles)]
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def get_profile(profile_id: str):
+    """Collapsed stacks of one profile (flamegraph.pl / speedscope input)"""
+    profile = profiling.find_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(content=profile.collapsed(), media_type="text/plain")
+
+@app.get("/api/admin/models", response_model=schemas.ModelRegistryState, dependencies=[Depends(require_admin)])
+def list_models():
+    """Models loaded in this worker and the one serving detections"""
+    return detection_service.registry.summary()
+
+@app.post("/api/admin/models", response_model=schemas.ModelInfo, dependencies=[Depends(require_admin)])
+def register_model(registration: schemas.ModelRegistration):
+    """Load and warm a model, add it to the manifest and optionally switch to it"""
+    # The manifest is only written once the model loaded and warmed up
+    try:
+        entry = detection_service.registry.register(
+            registration.name, registration.version, registration.path, registration.activate
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not load model: {e}")
+    return entry.summary()
+
+@app.post("/api/admin/models/{name}/{version}/activate", response_model=schemas.ModelInfo,
+          dependencies=[Depends(require_admin)])
+def activate_model(name: str, version: str):
+    """Switch every worker to a registered model (also used to roll back)"""
+    try:
+        entry = detection_service.registry.set_active(f"{name}:{version}")
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Model not registered")
+    except Exception as e:
+        # e.g. the listed file is gone; the manifest and the served model are unchanged
+        raise HTTPException(status_code=400, detail=f"Could not load model: {e}")
+    return entry.summary()
+
+@app.delete("/api/admin/models/{name}/{version}", status_code=204, dependencies=[Depends(require_admin)])
+def remove_model(name: str, version: str):
+    try:
+        detection_service.registry.remove(f"{name}:{version}")
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Model not registered")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(status_code=204)
+
+@app.get("/api/admin/shadow", dependencies=[Depends(require_admin)])
+def get_shadow_summary():
+    """Agreement and latency of the shadow model against the active one, in this worker"""
+    registry = detection_service.registry
+    return {
+        "model": registry.shadow.key if registry.shadow else None,
+        "sample_rate": registry.shadow_rate,
+        "queued": shadow_evaluator.qsize(),
+        **shadow_evaluator.stats.summary()
     }
 
+@app.put("/api/admin/shadow", dependencies=[Depends(require_admin)])
+def configure_shadow(config: schemas.ShadowConfig):
+    """Shadow a registered model on a fraction of detections (model=null stops it)"""
+    try:
+        detection_service.registry.set_shadow(config.model, config.sample_rate)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Model not registered")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not load model: {e}")
+    return get_shadow_summary()
+
+@app.get("/api/admin/person-gate", dependencies=[Depends(require_admin)])
+def get_person_gate_summary():
+    """How often the person gate let this worker skip the full model"""
+    gate = detection_service.gate
+    return {
+        "mode": gate.mode,
+        "motion_threshold": gate.motion_threshold,
+        **gate.stats.summary()
+    }
+
+@app.get("/api/admin/crop-refine", dependencies=[Depends(require_admin)])
+def get_crop_refine_summary():
+    """What the person-crop pass added in this worker, and what it cost"""
+    refiner = detection_service.refiner
+    return {
+        "mode": refiner.mode,
+        "budget_ms": settings.CROP_REFINE_BUDGET_MS,
+        **refiner.stats.summary()
+    }
+
+@app.get("/api/admin/admission", dependencies=[Depends(require_admin)])
+async def get_admission_state():
+    """Running and queued detections per user in this worker"""
+    # On the event loop, like every other use of the scheduler
+    return admission_scheduler.summary()
+
+@app.get("/api/admin/quality", dependencies=[Depends(require_admin)])
+def get_quality_state():
+    """The latency-SLO controller's level and the latency it is reacting to, in this worker"""
+    return quality_controller.summary()
+
 if __name__ == "__main__":
     
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,446 @@
+"""In-process metrics exposed in the Prometheus text format at /metrics.
+
+Counters, gauges and histograms aggregate in memory under a per-metric lock,
+so recording a sample costs a dict lookup and a few additions. Values that
+already live elsewhere (cache hit counts, queue sizes) are read through
+callbacks only when /metrics is scraped.
+
+Gunicorn hands each scrape to whichever worker accepts it, so with several
+workers the values of a single process would jump between scrapes and look
+like counter resets. With METRICS_MULTIPROC_DIR set, every worker writes its
+values to a file there every METRICS_SYNC_SECONDS (and before answering a
+scrape), and /metrics merges the files: counters and histograms are summed
+over the workers, gauges are reported per worker with a worker="<pid>"
+label. When a worker exits, gunicorn_conf.py folds its counters and
+histograms into exited.json so the totals keep growing across restarts, and
+its gauges are dropped.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import settings
+
+# Seconds; spans cache hits up to slow CPU inference on large videos
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        registry.register(self)
+
+    def labels(self, *values) -> object:
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self, labelnames, key, value) -> List[str]:
+        raise NotImplementedError
+
+    def values(self) -> Dict[Tuple[str, ...], object]:
+        """Current value of every child, by label values"""
+        return {key: child.get() for key, child in list(self._children.items())}
+
+    def render(self, values: Optional[Dict] = None, labelnames: Optional[Tuple[str, ...]] = None) -> List[str]:
+        values = self.values() if values is None else values
+        labelnames = self.labelnames if labelnames is None else labelnames
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(values.items()):
+            lines.extend(self._samples(labelnames, key, value))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function at scrape time instead of storing it"""
+        self._function = function
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def get(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._children[()].set_function(function)
+
+    def _samples(self, labelnames, key, value):
+        return [f"{self.name}_total{_format_labels(labelnames, key)} {_format_value(value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._children[()].set_function(function)
+
+    def track_inprogress(self):
+        return self._children[()].track_inprogress()
+
+    def _samples(self, labelnames, key, value):
+        return [f"{self.name}{_format_labels(labelnames, key)} {_format_value(value)}"]
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def values(self):
+        return {key: child.snapshot() for key, child in list(self._children.items())}
+
+    def _samples(self, labelnames, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+        labels = _format_labels(labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        if settings.METRICS_MULTIPROC_DIR:
+            write_snapshot()
+            return self._render_merged(settings.METRICS_MULTIPROC_DIR)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """{metric name: [[label values, value], ...]} for this process"""
+        return {
+            metric.name: [[list(key), value] for key, value in metric.values().items()]
+            for metric in self._metrics
+        }
+
+    def _render_merged(self, directory: str) -> str:
+        snapshots = _read_snapshots(directory)
+        lines = []
+        for metric in self._metrics:
+            if isinstance(metric, Gauge):
+                values = {
+                    tuple(key) + (pid,): value
+                    for pid, snapshot in snapshots.items() if pid != EXITED
+                    for key, value in snapshot.get(metric.name, [])
+                }
+                lines.extend(metric.render(values, metric.labelnames + ("worker",)))
+            else:
+                values = {}
+                for snapshot in snapshots.values():
+                    _add_samples(values, snapshot.get(metric.name, []))
+                lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Counters and histograms of workers that have exited
+EXITED = "exited"
+
+
+def _snapshot_path(directory: str, pid) -> str:
+    return os.path.join(directory, f"{pid}.json")
+
+
+def _write_json(path: str, data: dict):
+    # Written aside and renamed, so a scrape never reads half a file
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "w") as handle:
+        json.dump(data, handle)
+    os.replace(partial, path)
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def _read_snapshots(directory: str) -> Dict[str, dict]:
+    snapshots = {}
+    for filename in os.listdir(directory):
+        if filename.endswith(".json"):
+            snapshots[filename[:-len(".json")]] = _read_json(os.path.join(directory, filename))
+    return snapshots
+
+
+def _add_samples(values: dict, samples: list):
+    """Sum counter values or histogram (bucket counts, sum) pairs into values"""
+    for key, value in samples:
+        key = tuple(key)
+        if isinstance(value, list):
+            counts, total = values.get(key, ([0] * len(value[0]), 0.0))
+            values[key] = ([a + b for a, b in zip(counts, value[0])], total + value[1])
+        else:
+            values[key] = values.get(key, 0.0) + value
+
+
+def write_snapshot():
+    """Write this process's values to METRICS_MULTIPROC_DIR"""
+    directory = settings.METRICS_MULTIPROC_DIR
+    if directory:
+        _write_json(_snapshot_path(directory, os.getpid()), registry.snapshot())
+
+
+def mark_process_dead(pid: int):
+    """Fold an exited worker's counters and histograms into exited.json and drop its gauges"""
+    directory = settings.METRICS_MULTIPROC_DIR
+    path = _snapshot_path(directory, pid)
+    if not directory or not os.path.exists(path):
+        return
+    snapshot = _read_json(path)
+    exited = _read_json(_snapshot_path(directory, EXITED))
+    for metric in registry._metrics:
+        if isinstance(metric, Gauge) or metric.name not in snapshot:
+            continue
+        values = {tuple(key): value for key, value in exited.get(metric.name, [])}
+        _add_samples(values, snapshot[metric.name])
+        exited[metric.name] = [[list(key), value] for key, value in values.items()]
+    _write_json(_snapshot_path(directory, EXITED), exited)
+    os.remove(path)
+
+
+_sync_stop = threading.Event()
+
+
+def start_sync():
+    """Keep this worker's file in METRICS_MULTIPROC_DIR fresh between scrapes"""
+    if not settings.METRICS_MULTIPROC_DIR or settings.METRICS_SYNC_SECONDS <= 0:
+        return
+    _sync_stop.clear()
+
+    def run():
+        while not _sync_stop.wait(settings.METRICS_SYNC_SECONDS):
+            try:
+                write_snapshot()
+            except OSError as e:
+                print(f"❌ Could not write metrics to {settings.METRICS_MULTIPROC_DIR}: {e}")
+
+    threading.Thread(target=run, name="metrics-sync", daemon=True).start()
+
+
+def stop_sync():
+    _sync_stop.set()
+    if settings.METRICS_MULTIPROC_DIR:
+        write_snapshot()
+
+# /api/detect, broken down by stage. save is writing the upload to disk (the
+# request body has already been received by then, so receiving it only shows
+# in the Server-Timing total); preprocess/inference/postprocess come from the model's own timings;
+# matching is the nearest-person gear check; person_gate is the cheap check
+# that may skip the model; crop_refine is the second pass over person crops;
+# tiling is cutting large images into tiles and merging their boxes
+DETECT_STAGE_SECONDS = Histogram(
+    "detect_stage_seconds", "Time spent in each stage of /api/detect", ["stage"]
+)
+DETECT_SECONDS = Histogram(
+    "detect_request_seconds", "End-to-end /api/detect handler time", ["file_type"]
+)
+VERDICTS = Counter(
+    "detect_verdicts", "Detection results by verdict", ["file_type", "verdict"]
+)
+PLACEHOLDER_FALLBACKS = Counter(
+    "detect_placeholder_fallbacks", "Images or video frames answered with the placeholder result", ["cause"]
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests", "Lookups in the in-process caches", ["cache", "result"]
+)
+INFERENCE_IN_PROGRESS = Gauge(
+    "detect_inference_in_progress", "Detections currently running on a worker thread"
+)
+INFERENCE_SLOTS = Gauge(
+    "detect_inference_slots", "Inferences allowed at once by the CPU thread budget"
+)
+WORKER_THREADS = Gauge(
+    "worker_threads", "Request threadpool slots by state", ["state"]
+)
+DETECTION_WRITE_RETRIES = Counter(
+    "detection_write_retries", "Retries of write-behind batches that failed to commit"
+)
+DETECTION_WRITE_FAILED_ROWS = Counter(
+    "detection_write_failed_rows", "Detections the write-behind writer could not insert (see the dead-letter file)"
+)
+QUEUE_DEPTH = Gauge(
+    "queue_depth", "Work waiting to be picked up", ["queue"]
+)
+SHADOW_COMPARISONS = Counter(
+    "shadow_comparisons", "Detections sampled for the shadow model, by outcome", ["outcome"]
+)
+SHADOW_INFERENCE_SECONDS = Histogram(
+    "shadow_inference_seconds", "Time the shadow model took per sampled detection"
+)
+PERSON_GATE_DECISIONS = Counter(
+    "person_gate_decisions", "Person gate decisions on images and video frames", ["outcome"]
+)
+CROP_REFINE_RESULTS = Counter(
+    "crop_refine_results", "Person crops refined or skipped, and the gear they added", ["outcome"]
+)
+TILE_INFERENCE = Counter(
+    "tile_inference", "Tiles of large images run through the model or skipped as empty", ["outcome"]
+)
+QUALITY_LEVEL = Gauge(
+    "detect_quality_level", "Quality level detections run at (0 is full quality)"
+)
+QUALITY_LEVEL_CHANGES = Counter(
+    "detect_quality_level_changes", "Steps of the latency-SLO controller", ["direction"]
+)
+ADMISSION_DECISIONS = Counter(
+    "admission_decisions", "/api/detect admission outcomes", ["outcome"]
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "admission_wait_seconds", "Time detections waited for an inference slot"
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "model_load_seconds", "How long loading the detection model took"
+)
+ACTIVE_MODEL = Gauge(
+    "model_active", "1 for the registry model currently serving detections", ["name", "version"]
+)
+MODEL_LOADED = Gauge(
+    "model_loaded", "1 if a detection model is loaded, 0 if the placeholder is served"
+)
+
+
+def register_cache(name: str, cache):
+    """Expose a TTLCache's hit and miss counts"""
+    CACHE_REQUESTS.labels(name, "hit").set_function(lambda: cache.hits)
+    CACHE_REQUESTS.labels(name, "miss").set_function(lambda: cache.misses)
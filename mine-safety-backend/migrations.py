@@ -0,0 +1,162 @@
+"""Schema and data migrations applied at startup.
+
+create_all only creates missing tables, so columns and indexes added to existing
+tables and one-off data backfills are handled here. Run manually with:
+    python migrations.py
+"""
+from sqlalchemy import MetaData, inspect, insert, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import Session
+
+import models
+import stats
+from database import Base
+
+
+def _add_missing_columns(engine: Engine):
+    """Add columns introduced after a table was created (they must be nullable or have a server default)"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            print(f"  Adding column {table.name}.{column.name}")
+            with engine.begin() as connection:
+                connection.execute(text(ddl))
+
+
+def _create_missing_indexes(engine: Engine):
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"  Creating index {index.name}")
+                index.create(bind=engine)
+
+
+def _use_autoincrement_ids(engine: Engine):
+    """Rebuild a SQLite detections table created without AUTOINCREMENT.
+
+    Without it SQLite hands out max(id) + 1, so once the newest rows were
+    archived their ids came back for new detections and clashed with
+    detection_archive. The counter starts above the largest id of both tables.
+    """
+    table = models.Detection.__table__
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect() as connection:
+        ddl = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+        ).scalar()
+    if ddl is None or "AUTOINCREMENT" in ddl.upper():
+        return
+
+    print(f"  Rebuilding {table.name} with AUTOINCREMENT ids")
+    # A copy of the table under another name (with users, for its foreign key)
+    metadata = MetaData()
+    models.User.__table__.to_metadata(metadata)
+    rebuilt = table.to_metadata(metadata, name=f"{table.name}_rebuild")
+    columns = ", ".join(column.name for column in table.columns)
+    archive = models.ArchivedDetection.__table__.name
+    raw = engine.raw_connection()
+    connection = raw.driver_connection
+    isolation_level = connection.isolation_level
+    foreign_keys = connection.execute("PRAGMA foreign_keys").fetchone()[0]
+    try:
+        # Explicit transaction; foreign keys off so dropping the old table can't cascade to detection_items
+        connection.isolation_level = None
+        connection.execute("PRAGMA foreign_keys=OFF")
+        connection.execute("BEGIN")
+        try:
+            connection.execute(str(CreateTable(rebuilt).compile(dialect=engine.dialect)))
+            connection.execute(f"INSERT INTO {rebuilt.name} ({columns}) SELECT {columns} FROM {table.name}")
+            last_id = connection.execute(
+                f"SELECT MAX(COALESCE((SELECT MAX(id) FROM {table.name}), 0), "
+                f"COALESCE((SELECT MAX(id) FROM {archive}), 0))"
+            ).fetchone()[0]
+            connection.execute(f"DROP TABLE {table.name}")
+            connection.execute(f"ALTER TABLE {rebuilt.name} RENAME TO {table.name}")
+            connection.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table.name,))
+            connection.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table.name, last_id))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.execute(f"PRAGMA foreign_keys={'ON' if foreign_keys else 'OFF'}")
+        connection.isolation_level = isolation_level
+        raw.close()
+
+
+def _backfill_detection_items(db: Session, batch_size: int = 5000):
+    """Split the JSON item columns of existing detections into detection_items rows"""
+    import crud
+
+    last_id = 0
+    while True:
+        batch = db.execute(
+            select(
+                models.Detection.id,
+                models.Detection.user_id,
+                models.Detection.created_at,
+                models.Detection.detected_items,
+                models.Detection.missing_items
+            )
+            .where(
+                models.Detection.id > last_id,
+                models.Detection.user_id.isnot(None),
+                ~models.Detection.items.any()
+            )
+            .order_by(models.Detection.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return
+
+        item_rows = [item for row in batch for item in crud.detection_item_rows(row)]
+        if item_rows:
+            db.execute(insert(models.DetectionItem), item_rows)
+        last_id = batch[-1].id
+
+
+# Applied once each, in order, and recorded in schema_migrations
+DATA_MIGRATIONS = [
+    ("0001_backfill_detection_items", _backfill_detection_items),
+    ("0002_backfill_rollups", lambda db: stats.backfill_rollups(db)),
+]
+
+
+def run_migrations(engine: Engine):
+    _add_missing_columns(engine)
+    Base.metadata.create_all(bind=engine)
+    # Before the indexes, which the rebuild drops with the old table
+    _use_autoincrement_ids(engine)
+    _create_missing_indexes(engine)
+
+    with Session(engine) as db:
+        applied = set(db.scalars(select(models.SchemaMigration.name)))
+        for name, migrate in DATA_MIGRATIONS:
+            if name in applied:
+                continue
+            print(f"Applying migration {name}")
+            migrate(db)
+            db.add(models.SchemaMigration(name=name))
+            db.commit()
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    run_migrations(engine)
+    print("✓ Database is up to date")
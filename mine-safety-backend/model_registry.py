@@ -0,0 +1,362 @@
+"""Named, versioned detection models that can be swapped under live traffic.
+
+The registry's desired state is a manifest (MODEL_REGISTRY_FILE, JSON):
+
+    {"active": "ppe:2024-06-int8",
+     "models": [{"name": "ppe", "version": "2024-05", "path": "models/best.onnx"},
+                {"name": "ppe", "version": "2024-06-int8", "path": "models/best-int8.onnx"}]}
+
+Every process (each gunicorn worker included) loads the listed models side by
+side and warms a model with a few predictions before switching to it. The
+switch replaces a single reference, so in-flight requests finish on the model
+they started with, and every detection records the version it was made with.
+The admin endpoints under /api/admin/models edit the manifest; other workers
+pick the change up within MODEL_REGISTRY_POLL_SECONDS. Rolling back means
+activating the previous version again. An optional "shadow" entry
+({"model": key, "sample_rate": 0.1}) names a candidate for shadow.py.
+
+Without a manifest (or an active model in it) the first of best.onnx /
+yolov8n.pt found is served, versioned by the SHA-256 of the file.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import anyio.to_thread
+import numpy as np
+
+import metrics
+from config import settings
+
+_backend_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATHS = [
+    os.path.join(_backend_dir, "best.onnx"),  # Same dir as this file
+    "best.onnx",  # Current directory
+    os.path.join(_backend_dir, "yolov8n.pt"),  # PyTorch model fallback
+    "yolov8n.pt"
+]
+
+
+def open_model(path: str):
+    """Load a model file with ultralytics ("stub" gives the deterministic benchmark model)"""
+    if path == "stub":
+        from stub_model import StubModel
+        return StubModel(inference_ms=settings.DETECTION_STUB_INFERENCE_MS,
+                         weights_mb=settings.DETECTION_STUB_WEIGHTS_MB)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model file not found: {path}")
+    from ultralytics import YOLO
+    # Explicitly declare task="detect" to suppress the Ultralytics warning
+    return YOLO(path, task="detect")
+
+
+def file_version(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class ModelEntry:
+    def __init__(self, name: str, version: str, path: Optional[str], model):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.model = model
+        # An ultralytics model keeps per-call settings (imgsz, conf) on its shared
+        # predictor, so only one thread may predict with it at a time
+        self.lock = threading.Lock()
+        self.loaded_at = datetime.utcnow()
+        self.warmup_ms: Optional[float] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.version}"
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "path": self.path,
+            "loaded_at": self.loaded_at,
+            "warmup_ms": self.warmup_ms,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, manifest_path: str, poll_seconds: int = 10):
+        self.manifest_path = Path(manifest_path)
+        self.poll_seconds = poll_seconds
+        self.entries: Dict[str, ModelEntry] = {}
+        # Replaced in one assignment; readers take it once per detection
+        self.active: Optional[ModelEntry] = None
+        # Candidate run beside the active model on sampled traffic (see shadow.py)
+        self.shadow: Optional[ModelEntry] = None
+        self.shadow_rate = 0.0
+        self._lock = threading.RLock()
+        self._manifest_mtime: Optional[int] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # Manifest
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as handle:
+                manifest = json.load(handle)
+        except FileNotFoundError:
+            manifest = {}
+        return {"active": manifest.get("active"), "models": manifest.get("models", []),
+                "shadow": manifest.get("shadow")}
+
+    def write_manifest(self, manifest: dict):
+        """Replace the manifest atomically, so other workers never read half of it"""
+        directory = self.manifest_path.parent
+        directory.mkdir(parents=True, exist_ok=True)
+        handle = tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False)
+        with handle:
+            json.dump(manifest, handle, indent=2)
+        os.replace(handle.name, self.manifest_path)
+        self._manifest_mtime = self._mtime()
+
+    def _mtime(self) -> Optional[int]:
+        try:
+            return self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    # Loading and switching
+
+    def load(self, name: str, version: str, path: str, warm: bool = True) -> ModelEntry:
+        with self._lock:
+            key = f"{name}:{version}"
+            if key in self.entries:
+                return self.entries[key]
+            start = time.perf_counter()
+            entry = ModelEntry(name, version, path, open_model(path))
+            metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
+            print(f"✓ Loaded model {key} from {path}")
+            if warm:
+                self.warm(entry)
+            self.entries[key] = entry
+            return entry
+
+    def use(self, model, name: str = "custom", version: str = "unversioned") -> ModelEntry:
+        """Serve an already constructed model object (benchmarks and tests)"""
+        with self._lock:
+            entry = ModelEntry(name, version, None, model)
+            self.entries[entry.key] = entry
+            self._switch(entry)
+            return entry
+
+    def warm(self, entry: ModelEntry):
+        """Run a few predictions so the first real request doesn't pay for lazy setup"""
+        if entry.model is None or settings.MODEL_WARMUP_RUNS <= 0:
+            return
+        frame = np.full((480, 640, 3), 114, dtype=np.uint8)
+        start = time.perf_counter()
+        for _ in range(settings.MODEL_WARMUP_RUNS):
+            entry.model.predict(source=frame, conf=0.25, verbose=False)
+        entry.warmup_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    def warm_all(self):
+        for entry in list(self.entries.values()):
+            if entry.warmup_ms is None:
+                self.warm(entry)
+
+    def activate(self, key: str):
+        with self._lock:
+            entry = self.entries[key]
+            if entry.warmup_ms is None:
+                self.warm(entry)
+            self._switch(entry)
+
+    def _switch(self, entry: ModelEntry):
+        previous = self.active
+        self.active = entry
+        if previous is not None:
+            metrics.ACTIVE_MODEL.labels(previous.name, previous.version).set(0)
+        metrics.ACTIVE_MODEL.labels(entry.name, entry.version).set(1)
+        if previous is not entry:
+            print(f"✓ Active model: {entry.key}" + (f" (was {previous.key})" if previous else ""))
+
+    def _load_default(self, warm: bool):
+        if settings.DETECTION_MODEL == "stub":
+            self._switch(self.load("stub", "builtin", "stub", warm=warm))
+            print("✓ Using the stub detection model (DETECTION_MODEL=stub, for load tests only)")
+            return
+        for path in DEFAULT_MODEL_PATHS:
+            if not os.path.exists(path):
+                continue
+            try:
+                entry = self.load(Path(path).stem, file_version(path), os.path.abspath(path), warm=warm)
+            except ImportError as e:
+                print(f"❌ ultralytics not installed: {e}")
+                return
+            except Exception as e:
+                print(f"  Failed to load {path}: {e}")
+                continue
+            self._switch(entry)
+            return
+        print("❌ No valid model could be loaded")
+
+    def sync(self, warm: bool = True):
+        """Bring this process in line with the manifest (loads before it switches)"""
+        mtime = self._mtime()
+        if mtime == self._manifest_mtime and self.active is not None:
+            return
+        with self._lock:
+            manifest = self.read_manifest()
+            listed = {f"{spec['name']}:{spec['version']}": spec for spec in manifest["models"]}
+            for key, spec in listed.items():
+                if key not in self.entries:
+                    try:
+                        self.load(spec["name"], spec["version"], spec["path"], warm=warm)
+                    except Exception as e:
+                        print(f"❌ Could not load model {key}: {e}")
+
+            active = manifest["active"]
+            if active in self.entries:
+                if warm:
+                    self.activate(active)
+                else:
+                    self._switch(self.entries[active])
+            elif active:
+                print(f"❌ Active model {active} is not loaded; still serving "
+                      f"{self.active.key if self.active else 'nothing'}")
+            if self.active is None:
+                self._load_default(warm)
+            self._apply_shadow(manifest["shadow"], warm)
+
+            for key in list(self.entries):
+                if key not in listed and self.entries[key] is not self.active:
+                    # Requests still holding the entry finish on it; memory goes with the last one
+                    del self.entries[key]
+                    print(f"✓ Unloaded model {key}")
+            self._manifest_mtime = mtime
+
+    # Admin operations: update the manifest, then apply it to this process
+
+    def register(self, name: str, version: str, path: str, activate: bool = False) -> ModelEntry:
+        with self._lock:
+            entry = self.load(name, version, path)
+            manifest = self.read_manifest()
+            manifest["models"] = [spec for spec in manifest["models"]
+                                  if f"{spec['name']}:{spec['version']}" != entry.key]
+            manifest["models"].append({"name": name, "version": version, "path": path})
+            if activate:
+                manifest["active"] = entry.key
+                self.activate(entry.key)
+            elif manifest["active"] is None and self.active is not None:
+                manifest["active"] = self.active.key
+            self._list_active(manifest)
+            self.write_manifest(manifest)
+            return entry
+
+    def _apply_shadow(self, spec: Optional[dict], warm: bool):
+        key = (spec or {}).get("model")
+        entry = self.entries.get(key) if key else None
+        if key and entry is None:
+            print(f"❌ Shadow model {key} is not loaded; shadow evaluation is off")
+        if entry is not None and warm and entry.warmup_ms is None:
+            self.warm(entry)
+        self.shadow = entry
+        self.shadow_rate = float((spec or {}).get("sample_rate", 0.0)) if entry is not None else 0.0
+
+    def _ensure_loaded(self, key: str, manifest: dict) -> ModelEntry:
+        if key not in self.entries:
+            specs = {f"{spec['name']}:{spec['version']}": spec for spec in manifest["models"]}
+            if key not in specs:
+                raise KeyError(key)
+            spec = specs[key]
+            self.load(spec["name"], spec["version"], spec["path"])
+        return self.entries[key]
+
+    def set_active(self, key: str) -> ModelEntry:
+        with self._lock:
+            manifest = self.read_manifest()
+            self._ensure_loaded(key, manifest)
+            self.activate(key)
+            manifest["active"] = key
+            self._list_active(manifest)
+            self.write_manifest(manifest)
+            return self.entries[key]
+
+    def set_shadow(self, key: Optional[str], sample_rate: float):
+        """Start shadowing `key` on a fraction of detections in every worker (None stops it)"""
+        with self._lock:
+            manifest = self.read_manifest()
+            manifest["shadow"] = None
+            if key:
+                entry = self._ensure_loaded(key, manifest)
+                manifest["shadow"] = {"model": key, "sample_rate": sample_rate}
+                if all(f"{spec['name']}:{spec['version']}" != key for spec in manifest["models"]):
+                    manifest["models"].append({"name": entry.name, "version": entry.version, "path": entry.path})
+            self._list_active(manifest)
+            self._apply_shadow(manifest["shadow"], warm=True)
+            self.write_manifest(manifest)
+
+    def remove(self, key: str):
+        with self._lock:
+            if self.active is not None and self.active.key == key:
+                raise ValueError("The active model cannot be removed; activate another one first")
+            if self.shadow is not None and self.shadow.key == key:
+                raise ValueError("The model is being shadowed; stop shadow evaluation first")
+            manifest = self.read_manifest()
+            remaining = [spec for spec in manifest["models"] if f"{spec['name']}:{spec['version']}" != key]
+            if len(remaining) == len(manifest["models"]) and key not in self.entries:
+                raise KeyError(key)
+            manifest["models"] = remaining
+            self.write_manifest(manifest)
+            self.entries.pop(key, None)
+
+    def _list_active(self, manifest: dict):
+        """Keep the served model in the manifest, so it stays available for rollback"""
+        if self.active is None or self.active.path is None:
+            return
+        if all(f"{spec['name']}:{spec['version']}" != self.active.key for spec in manifest["models"]):
+            manifest["models"].insert(0, {"name": self.active.name, "version": self.active.version,
+                                          "path": self.active.path})
+
+    def summary(self) -> dict:
+        return {
+            "active": self.active.key if self.active else None,
+            "shadow": self.shadow.key if self.shadow else None,
+            "shadow_sample_rate": self.shadow_rate,
+            "models": [entry.summary() for entry in self.entries.values()],
+        }
+
+    # Background polling of the manifest (changes made through other workers)
+
+    def start(self):
+        if self._task is None and self.poll_seconds > 0:
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            if self._stop.is_set():
+                break
+            try:
+                await anyio.to_thread.run_sync(self.sync)
+            except Exception as e:
+                print(f"❌ Model registry sync failed: {e}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -13,13 +13,15 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     detections = relationship("Detection", back_populates="user")
+    stats = relationship("UserStats", back_populates="user", uselist=False)
 
 class Detection(Base):
     __tablename__ = "detections"
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    file_path = Column(String)
+    file_path = Column(String)  # unique per upload
+    file_name = Column(String)  # name of the uploaded file, for display only
     file_type = Column(String)  # image or video
     is_safe = Column(Boolean)
     confidence = Column(Integer)
@@ -27,5 +29,112 @@ class Detection(Base):
     missing_items = Column(Text)  # JSON string of missing safety items
     reason = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    model_version = Column(String(128))  # "<name>:<version>" from the model registry
+    quality_level = Column(Integer)  # 0 is full quality; higher levels were degraded under load (quality.py)
     
     user = relationship("User", back_populates="detections")
+    items = relationship("DetectionItem", back_populates="detection", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("ix_detections_user_id_created_at", "user_id", "created_at"),
+        Index("ix_detections_user_id_is_safe_created_at", "user_id", "is_safe", "created_at"),
+        Index("ix_detections_user_id_file_type_created_at", "user_id", "file_type", "created_at"),
+        # Never reuse the id of a row moved to detection_archive
+        {"sqlite_autoincrement": True},
+    )
+
+class DetectionItem(Base):
+    """One detected or missing safety item of a detection, normalized for indexed filtering"""
+    __tablename__ = "detection_items"
+    
+    id = Column(Integer, primary_key=True)
+    detection_id = Column(Integer, ForeignKey("detections.id", ondelete="CASCADE"), nullable=False, index=True)
+    # Copied from the detection so item filters never need to join back for user/time ranges
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    item = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # detected or missing
+    
+    detection = relationship("Detection", back_populates="items")
+    
+    __table_args__ = (
+        Index("ix_detection_items_user_kind_item_created_at", "user_id", "kind", "item", "created_at"),
+    )
+
+class ArchivedDetection(Base):
+    """A detection moved out of the live table by the archiver (see archive.py).
+
+    On PostgreSQL the table is range-partitioned by month of created_at. The
+    evidence file, if it still existed, is stored in a content-addressed bundle.
+    """
+    __tablename__ = "detection_archive"
+    
+    # Ids are kept from the live table, which never hands out an id again (a
+    # sequence on PostgreSQL, AUTOINCREMENT on SQLite), so an id is unique
+    # across both tables for rows inserted since (see migrations.py)
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    # Partition key; PostgreSQL requires it in the primary key
+    created_at = Column(DateTime, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    file_path = Column(String)
+    file_name = Column(String)
+    file_type = Column(String)
+    is_safe = Column(Boolean)
+    confidence = Column(Integer)
+    detected_items = Column(Text)
+    missing_items = Column(Text)
+    reason = Column(Text)
+    model_version = Column(String(128))
+    quality_level = Column(Integer)
+    file_sha256 = Column(String(64))  # None when the file was already gone
+    bundle = Column(String(64))
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_detection_archive_user_id_created_at", "user_id", "created_at"),
+        Index("ix_detection_archive_file_sha256", "file_sha256"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+class UserStats(Base):
+    """Per-user lifetime counters, updated in the same transaction as each Detection insert"""
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_detections = Column(Integer, nullable=False, default=0)
+    total_accepted = Column(Integer, nullable=False, default=0)
+    total_denied = Column(Integer, nullable=False, default=0)
+    # Bumped whenever the user's detections change; drives ETags and the response cache
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    user = relationship("User", back_populates="stats")
+
+class ComplianceRollup(Base):
+    """Detection verdict counts per user and time bucket (hour, day or week)"""
+    __tablename__ = "compliance_rollups"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+    safe = Column(Integer, nullable=False, default=0)
+    unsafe = Column(Integer, nullable=False, default=0)
+
+class MissingItemRollup(Base):
+    """How often each required item was missing per user and time bucket"""
+    __tablename__ = "missing_item_rollups"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    item = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class SchemaMigration(Base):
+    """Data migrations that have already been applied to this database"""
+    __tablename__ = "schema_migrations"
+    
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,178 @@
+"""Cheap first stage that skips the full PPE model on frames without a person.
+
+Most gate-camera frames and video frames show nobody, and the full 25-class
+model then only concludes "No person detected in the frame." With
+PERSON_GATE set, a cheap check runs first and the full model only runs when
+a person is likely:
+
+    hog     OpenCV's HOG people detector on a PERSON_GATE_WIDTH-wide greyscale
+            copy; a window scoring above PERSON_GATE_HOG_THRESHOLD passes
+    model   a small detector (PERSON_GATE_MODEL, e.g. yolov8n at
+            PERSON_GATE_IMGSZ) looking only for class PERSON_GATE_CLASS above
+            PERSON_GATE_CONFIDENCE
+
+Both err towards passing: lower thresholds skip fewer frames. To measure what
+the gate misses, PERSON_GATE_AUDIT_RATE of the skipped frames still run the
+full model; "missed" counts those where it found a person (and that result is
+used).
+
+Independently, PERSON_GATE_MOTION_THRESHOLD > 0 lets video analysis reuse
+the previous analysed frame's result when less than that fraction of pixels
+changed since it.
+
+/api/admin/person-gate summarises the decisions of this worker, and
+person_gate_decisions in /metrics counts them (summed over the workers when
+METRICS_MULTIPROC_DIR is set, see metrics.py).
+"""
+import random
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from typing import Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import metrics
+import model_registry
+import profiling
+from config import settings
+
+MOTION_SIZE = (160, 90)
+MOTION_PIXEL_DELTA = 25
+
+
+def as_bgr(image) -> np.ndarray:
+    """BGR (or greyscale) array for a decoded image or a PIL frame"""
+    if isinstance(image, Image.Image):
+        return cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return image
+
+
+def _gray(image) -> np.ndarray:
+    image = as_bgr(image)
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+class GateStats:
+    """Gate decisions in this process"""
+
+    def __init__(self):
+        self.since = datetime.utcnow()
+        self.outcomes: Counter = Counter()
+        self.gate_ms: deque = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str, gate_seconds: Optional[float] = None):
+        # Shadow evaluation runs the gate too, but isn't traffic
+        if profiling.is_muted():
+            return
+        with self._lock:
+            self.outcomes[outcome] += 1
+            if gate_seconds is not None:
+                self.gate_ms.append(gate_seconds * 1000)
+        metrics.PERSON_GATE_DECISIONS.labels(outcome).inc()
+
+    def summary(self) -> dict:
+        with self._lock:
+            outcomes = dict(self.outcomes)
+            gate_ms = list(self.gate_ms)
+        checked = sum(outcomes.get(key, 0) for key in ("passed", "skipped", "audit_agreed", "audit_missed"))
+        skipped = outcomes.get("skipped", 0)
+        audited = outcomes.get("audit_agreed", 0) + outcomes.get("audit_missed", 0)
+        return {
+            "since": self.since,
+            "checked": checked,
+            "passed": outcomes.get("passed", 0),
+            "skipped": skipped,
+            "skip_rate": round(skipped / checked, 4) if checked else None,
+            "audited": audited,
+            "missed": outcomes.get("audit_missed", 0),
+            "miss_rate": round(outcomes.get("audit_missed", 0) / audited, 4) if audited else None,
+            "static_video_frames": outcomes.get("static", 0),
+            "mean_gate_ms": round(sum(gate_ms) / len(gate_ms), 2) if gate_ms else None,
+        }
+
+
+class PersonGate:
+    def __init__(self):
+        self.mode = settings.PERSON_GATE
+        self.motion_threshold = settings.PERSON_GATE_MOTION_THRESHOLD
+        self.stats = GateStats()
+        self.model = None
+        # Shared by every inference thread; ultralytics predictors aren't thread-safe
+        self._model_lock = threading.Lock()
+        # HOGDescriptor isn't documented as thread-safe; one per inference thread
+        self._local = threading.local()
+        if self.mode == "hog" and not hasattr(cv2, "HOGDescriptor"):
+            print(f"❌ OpenCV {cv2.__version__} has no HOG people detector, person gate disabled")
+            self.mode = "off"
+        if self.mode == "model":
+            try:
+                self.model = model_registry.open_model(settings.PERSON_GATE_MODEL)
+                print(f"✓ Person gate model loaded from {settings.PERSON_GATE_MODEL}")
+            except Exception as e:
+                print(f"❌ Person gate model failed to load, gate disabled: {e}")
+                self.mode = "off"
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def warm(self):
+        if self.model is not None:
+            frame = np.full((480, 640, 3), 114, dtype=np.uint8)
+            for _ in range(max(1, settings.MODEL_WARMUP_RUNS)):
+                self.model.predict(source=frame, imgsz=settings.PERSON_GATE_IMGSZ, verbose=False)
+
+    def person_likely(self, image) -> bool:
+        """Whether the full model should run on this frame"""
+        if self.mode == "hog":
+            return self._hog(image)
+        if self.mode == "model":
+            return self._model(image)
+        return True
+
+    def _hog(self, image) -> bool:
+        hog = getattr(self._local, "hog", None)
+        if hog is None:
+            hog = self._local.hog = cv2.HOGDescriptor()
+            hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        gray = _gray(image)
+        height, width = gray.shape[:2]
+        if width > settings.PERSON_GATE_WIDTH:
+            scale = settings.PERSON_GATE_WIDTH / width
+            gray = cv2.resize(gray, (settings.PERSON_GATE_WIDTH, int(round(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+        if gray.shape[0] < 128 or gray.shape[1] < 64:
+            # Smaller than one detection window: can't tell, so don't skip
+            return True
+        rects, _ = hog.detectMultiScale(gray, hitThreshold=settings.PERSON_GATE_HOG_THRESHOLD,
+                                        winStride=(8, 8), padding=(8, 8), scale=1.1)
+        return len(rects) > 0
+
+    def _model(self, image) -> bool:
+        with self._model_lock:
+            results = self.model.predict(source=image, imgsz=settings.PERSON_GATE_IMGSZ,
+                                         conf=settings.PERSON_GATE_CONFIDENCE,
+                                         classes=[settings.PERSON_GATE_CLASS], verbose=False)
+        for r in results:
+            if r.boxes is not None and any(int(box.cls[0]) == settings.PERSON_GATE_CLASS for box in r.boxes):
+                return True
+        return False
+
+    def audit(self) -> bool:
+        """Whether a skipped frame should run the full model anyway"""
+        return random.random() < settings.PERSON_GATE_AUDIT_RATE
+
+    def thumbnail(self, image) -> Optional[np.ndarray]:
+        """Small blurred greyscale copy for motion checks (None when they're off)"""
+        if self.motion_threshold <= 0:
+            return None
+        small = cv2.resize(_gray(image), MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def moved(self, previous: np.ndarray, current: np.ndarray) -> bool:
+        changed = np.count_nonzero(cv2.absdiff(previous, current) > MOTION_PIXEL_DELTA)
+        return changed / current.size >= self.motion_threshold
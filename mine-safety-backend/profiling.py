@@ -0,0 +1,242 @@
+"""Per-request stage timings (Server-Timing) and an opt-in sampling profiler.
+
+Code paths wrap their stages in `stage(name)`. Each stage is observed in the
+detect_stage_seconds histogram and, for the request being served, summed into
+the Server-Timing response header. Every response carries Server-Timing,
+with at least the total time (also on errors and rejections).
+
+A request is profiled when it carries `X-Profile: 1` together with a valid
+`X-Admin-Token`, or at random with probability PROFILE_SAMPLE_RATE. A profiled
+request gets a background thread that samples the stacks of the worker
+threads running its blocking work (`profiled_thread()`: the upload write and
+the detection) every PROFILE_INTERVAL_MS. The event-loop thread is not
+sampled, since it serves every other request at the same time. The result is
+kept in memory as collapsed stacks (the input format of flamegraph.pl and
+speedscope) and served from /api/admin/profiles. The response carries the
+profile's id in X-Profile-Id.
+"""
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+import metrics
+from auth import is_admin_token
+from config import settings
+
+# Paths never sampled at random (scrapes and the profile endpoints themselves)
+_UNSAMPLED_PREFIXES = ("/metrics", "/api/admin")
+
+
+class RequestTimings:
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def header(self, total: float) -> str:
+        with self._lock:
+            entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+_profile: ContextVar[Optional["SamplingProfile"]] = ContextVar("request_profile", default=None)
+# Set for work done beside the request path (shadow evaluation), which must not skew the histograms
+_muted: ContextVar[bool] = ContextVar("stage_recording_muted", default=False)
+
+
+def mute():
+    """Stop recording stages in the current context"""
+    _muted.set(True)
+
+
+def is_muted() -> bool:
+    return _muted.get()
+
+
+def record_stage(name: str, seconds: float):
+    """Record a stage duration measured elsewhere (e.g. the model's own timings)"""
+    if _muted.get():
+        return
+    metrics.DETECT_STAGE_SECONDS.labels(name).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def profiled_thread():
+    """Sample the current thread while it works for a profiled request"""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    ident = threading.get_ident()
+    profile.add_thread(ident)
+    try:
+        yield
+    finally:
+        profile.remove_thread(ident)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{code.co_name}:{code.co_firstlineno}"
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfile:
+    """Statistical profile of one request, built from periodic stack samples"""
+
+    def __init__(self, method: str, path: str, interval: float):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.interval = interval
+        self.started_at = datetime.utcnow()
+        self.duration = 0.0
+        self.samples = 0
+        self.server_timing: Optional[str] = None
+        self.stacks: Counter = Counter()
+        self._threads: Dict[int, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.id[:8]}", daemon=True)
+
+    def add_thread(self, ident: int):
+        self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def remove_thread(self, ident: int):
+        remaining = self._threads.get(ident, 0) - 1
+        if remaining > 0:
+            self._threads[ident] = remaining
+        else:
+            self._threads.pop(ident, None)
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start_time
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self._threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[_collapse(frame)] += 1
+                    self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1),
+            "samples": self.samples,
+            "server_timing": self.server_timing
+        }
+
+
+# Most recent finished profiles of this process, newest last
+profiles: deque = deque(maxlen=settings.PROFILE_STORE_SIZE)
+_active = threading.BoundedSemaphore(max(1, settings.PROFILE_MAX_CONCURRENT))
+
+
+def find_profile(profile_id: str) -> Optional[SamplingProfile]:
+    for profile in list(profiles):
+        if profile.id == profile_id:
+            return profile
+    return None
+
+
+def _wants_profile(scope, headers: Headers) -> bool:
+    if headers.get("x-profile") == "1":
+        return is_admin_token(headers.get("x-admin-token"))
+    if settings.PROFILE_SAMPLE_RATE <= 0 or scope["path"].startswith(_UNSAMPLED_PREFIXES):
+        return False
+    return random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+class TimingMiddleware:
+    """ASGI middleware adding Server-Timing headers and running requested profiles"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = RequestTimings()
+        timings_token = _timings.set(timings)
+
+        profile = None
+        # Concurrent profiles are capped; over the cap the request just runs unprofiled
+        if _wants_profile(scope, Headers(scope=scope)) and _active.acquire(blocking=False):
+            profile = SamplingProfile(scope["method"], scope["path"], settings.PROFILE_INTERVAL_MS / 1000)
+            profile.start()
+        profile_token = _profile.set(profile)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                server_timing = timings.header(time.perf_counter() - started)
+                headers.append("Server-Timing", server_timing)
+                if profile is not None:
+                    profile.server_timing = server_timing
+                    headers.append("X-Profile-Id", profile.id)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _profile.reset(profile_token)
+            _timings.reset(timings_token)
+            if profile is not None:
+                try:
+                    # Joins the sampler thread, so not on the event loop
+                    await anyio.to_thread.run_sync(profile.stop)
+                    profiles.append(profile)
+                finally:
+                    _active.release()
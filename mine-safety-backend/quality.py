@@ -0,0 +1,127 @@
+"""Latency-SLO controller that lowers detection quality while the API is overloaded.
+
+At shift change detections queue up for the inference slots, every request
+slows down and clients time out and retry. With SLO_P95_MS set, the
+controller watches the p95 of /api/detect over the last SLO_WINDOW_SECONDS
+and the number of detections waiting for a slot. When either is over its
+target (SLO_P95_MS, SLO_MAX_QUEUE) it steps one quality level down. It steps
+back up once p95 is under SLO_RECOVER_FRACTION of the target with nothing
+queued. After each step it holds for SLO_HOLD_SECONDS and needs
+SLO_MIN_SAMPLES new requests before deciding again, so it doesn't flap.
+
+QUALITY_LEVELS lists the levels from best to cheapest as
+"imgsz/video frames[/registry model key]":
+
+    640/10,640/5,480/3/ppe-small:v1
+
+Level 0 also runs the optional extra passes (tiling, crop refinement); lower
+levels skip them. An imgsz other than the model's export size needs a
+dynamic ONNX export or a .pt model. A model key must be registered in the
+model registry, and the active model is used when it isn't loaded.
+
+Each detection records the level it ran at (quality_level). /metrics has the
+current level as detect_quality_level, and /api/admin/quality shows the
+controller's state in this worker.
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+import metrics
+from config import settings
+
+
+class QualityLevel:
+    def __init__(self, imgsz: int, video_frames: int, model: Optional[str] = None):
+        self.imgsz = imgsz
+        self.video_frames = video_frames
+        self.model = model
+
+    def summary(self) -> dict:
+        return {"imgsz": self.imgsz, "video_frames": self.video_frames, "model": self.model}
+
+
+def parse_levels(value: str) -> List[QualityLevel]:
+    """'640/10,480/6/small:v1' -> [QualityLevel(640, 10), QualityLevel(480, 6, 'small:v1')]"""
+    levels = []
+    for part in value.split(","):
+        fields = part.strip().split("/")
+        levels.append(QualityLevel(int(fields[0]), int(fields[1]), fields[2] if len(fields) > 2 else None))
+    return levels or [QualityLevel(640, 10)]
+
+
+LEVELS = parse_levels(settings.QUALITY_LEVELS)
+
+
+def level(index: Optional[int]) -> QualityLevel:
+    return LEVELS[min(max(0, index or 0), len(LEVELS) - 1)]
+
+
+class QualityController:
+    def __init__(self, queue_depth: Callable[[], int]):
+        self.queue_depth = queue_depth
+        self.level = 0
+        self.last_change: Optional[dict] = None
+        self._latencies: deque = deque()
+        self._changed_at = 0.0
+        self._lock = threading.Lock()
+        metrics.QUALITY_LEVEL.set(0)
+
+    @property
+    def enabled(self) -> bool:
+        return settings.SLO_P95_MS > 0 and len(LEVELS) > 1
+
+    def _p95_ms(self) -> Optional[float]:
+        ordered = sorted(seconds for _, seconds in self._latencies)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))] * 1000
+
+    def observe(self, seconds: float):
+        """Record one /api/detect latency and adjust the level if needed"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._latencies.append((now, seconds))
+            while self._latencies and self._latencies[0][0] < now - settings.SLO_WINDOW_SECONDS:
+                self._latencies.popleft()
+            if now - self._changed_at < settings.SLO_HOLD_SECONDS or len(self._latencies) < settings.SLO_MIN_SAMPLES:
+                return
+            p95, waiting = self._p95_ms(), self.queue_depth()
+            overloaded = p95 > settings.SLO_P95_MS or (settings.SLO_MAX_QUEUE > 0 and waiting > settings.SLO_MAX_QUEUE)
+            if overloaded and self.level < len(LEVELS) - 1:
+                self._step(1, now, p95, waiting)
+            elif not overloaded and self.level > 0 and waiting == 0 \
+                    and p95 < settings.SLO_P95_MS * settings.SLO_RECOVER_FRACTION:
+                self._step(-1, now, p95, waiting)
+
+    def _step(self, delta: int, now: float, p95: float, waiting: int):
+        previous = self.level
+        self.level += delta
+        self._changed_at = now
+        # Latencies from the previous level say nothing about this one
+        self._latencies.clear()
+        direction = "down" if delta > 0 else "up"
+        self.last_change = {"from": previous, "to": self.level, "p95_ms": round(p95, 1), "queued": waiting,
+                            "at": time.time()}
+        metrics.QUALITY_LEVEL.set(self.level)
+        metrics.QUALITY_LEVEL_CHANGES.labels(direction).inc()
+        print(f"{'❌' if delta > 0 else '✓'} Quality level {previous} -> {self.level} "
+              f"(p95 {p95:.0f} ms, {waiting} queued, SLO {settings.SLO_P95_MS:.0f} ms)")
+
+    def summary(self) -> dict:
+        with self._lock:
+            p95 = self._p95_ms()
+            samples = len(self._latencies)
+        return {
+            "enabled": self.enabled,
+            "level": self.level,
+            "levels": [level.summary() for level in LEVELS],
+            "slo_p95_ms": settings.SLO_P95_MS,
+            "window_p95_ms": round(p95, 1) if p95 is not None else None,
+            "window_samples": samples,
+            "queued": self.queue_depth(),
+            "last_change": self.last_change,
+        }
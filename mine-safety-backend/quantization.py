@@ -0,0 +1,355 @@
+"""Static INT8 quantization of the ONNX detection model, and an FP32 vs INT8 report.
+
+Quantize best.onnx with a folder of our own gate images as calibration data:
+    python quantization.py quantize --calibration calib_images/ [--model best.onnx] [--output best-int8.onnx]
+
+The result is a QDQ model (weights per-channel int8, activations uint8, with
+reduce_range for x86 CPUs without VNNI). The non-convolution ops of the
+detection head (box decoding, class sigmoid, concat) stay in float, as
+quantizing them costs far more accuracy than time.
+
+Compare the two models on labelled images (YOLO layout: images/*.jpg with
+labels/*.txt next to them; without labels the FP32 predictions are the
+reference):
+    python quantization.py report --fp32 best.onnx --int8 best-int8.onnx --images eval/images [--output report.json]
+
+The report has per-class precision/recall (IoU 0.5) for every class in
+class_mapping, agreement of the gate verdict and missing required_items with
+the FP32 model, and per-image latency and memory for each model. Each model
+runs in its own process, so memory figures don't mix.
+
+The INT8 file is served like any other model: register it through
+/api/admin/models, shadow it (PUT /api/admin/shadow), then activate it.
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import thread_budget  # before cv2/NumPy size their thread pools
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+# Detection-head ops kept in float (module "/model.<last>/" of an ultralytics export)
+HEAD_FLOAT_OPS = {"Concat", "Split", "Slice", "Softmax", "Sigmoid", "Mul", "Add", "Sub", "Div",
+                  "Reshape", "Transpose"}
+
+
+def list_images(folder: str) -> List[Path]:
+    return sorted(path for path in Path(folder).rglob("*") if path.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def letterbox(image: np.ndarray, size: int) -> np.ndarray:
+    """Resize keeping the aspect ratio and pad to size x size, centred like ultralytics"""
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    resized = cv2.resize(image, (int(round(width * scale)), int(round(height * scale))),
+                         interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top = (size - resized.shape[0]) // 2
+    left = (size - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return canvas
+
+
+def preprocess(image: np.ndarray, size: int) -> np.ndarray:
+    """BGR image -> 1x3xSxS float32 RGB tensor in [0, 1], the model's input"""
+    tensor = letterbox(image, size)[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+    return np.ascontiguousarray(tensor)[None]
+
+
+# Quantization
+
+def head_nodes(model_path: str) -> List[str]:
+    """Names of the float-only ops in the detection head"""
+    import onnx
+
+    graph = onnx.load(model_path, load_external_data=False).graph
+    modules = [int(match.group(1)) for node in graph.node
+               if (match := re.match(r"^/model\.(\d+)/", node.name))]
+    if not modules:
+        return []
+    prefix = f"/model.{max(modules)}/"
+    return [node.name for node in graph.node if node.name.startswith(prefix) and node.op_type in HEAD_FLOAT_OPS]
+
+
+def calibration_reader(model_path: str, folder: str, limit: int):
+    from onnxruntime.quantization import CalibrationDataReader
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    model_input = session.get_inputs()[0]
+    size = model_input.shape[2] if isinstance(model_input.shape[2], int) else 640
+
+    class GateImages(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(list_images(folder)[:limit])
+
+        def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+            for path in self.paths:
+                image = cv2.imread(str(path))
+                if image is not None:
+                    return {model_input.name: preprocess(image, size)}
+            return None
+
+    return GateImages()
+
+
+def quantize(args):
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    images = list_images(args.calibration)
+    if not images:
+        print(f"❌ No calibration images found in {args.calibration}")
+        sys.exit(1)
+    print(f"Calibrating on {min(len(images), args.limit)} images from {args.calibration}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Shape inference and graph cleanup make more nodes quantizable
+        prepared = os.path.join(workdir, "prepared.onnx")
+        quant_pre_process(args.model, prepared)
+        excluded = head_nodes(prepared) if not args.quantize_head else []
+        quantize_static(
+            prepared,
+            args.output,
+            calibration_reader(prepared, args.calibration, args.limit),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            reduce_range=not args.no_reduce_range,
+            calibrate_method=getattr(CalibrationMethod, args.method),
+            nodes_to_exclude=excluded,
+        )
+
+    fp32_mb = os.path.getsize(args.model) / 1024 / 1024
+    int8_mb = os.path.getsize(args.output) / 1024 / 1024
+    print(f"✓ Wrote {args.output} ({int8_mb:.1f} MB, FP32 was {fp32_mb:.1f} MB; "
+          f"{len(excluded)} head ops left in float)")
+
+
+# Report
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as handle:
+        return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def predict_child(args):
+    """Run one model over the images and print predictions, latency and memory as JSON"""
+    thread_budget.apply(args.threads)
+    from ultralytics import YOLO
+
+    baseline = _rss_mb()
+    model = YOLO(args.model, task="detect")
+    images = [cv2.imread(str(path)) for path in list_images(args.images)]
+    for image in images[:args.warmup]:
+        model.predict(source=image, conf=args.conf, verbose=False)
+    loaded = _rss_mb()
+
+    predictions, latencies = [], []
+    for image in images:
+        start = time.perf_counter()
+        result = model.predict(source=image, conf=args.conf, verbose=False)[0]
+        latencies.append(time.perf_counter() - start)
+        predictions.append([
+            [int(box.cls[0]), float(box.conf[0]), *[float(v) for v in box.xyxy[0]]] for box in result.boxes
+        ])
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "predictions": predictions,
+        "latencies_ms": [latency * 1000 for latency in latencies],
+        "memory": {
+            "model_mb": round(loaded - baseline, 1),
+            "peak_rss_mb": round(peak_kb / 1024, 1),
+            "file_mb": round(os.path.getsize(args.model) / 1024 / 1024, 1),
+        },
+    }))
+
+
+def run_model(model: str, args) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), "_predict", "--model", model, "--images", args.images,
+               "--conf", str(args.conf), "--threads", str(args.threads), "--warmup", str(args.warmup)]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def read_labels(image_path: Path, shape) -> Optional[List[list]]:
+    """YOLO label file (class cx cy w h, normalised) -> [class, x1, y1, x2, y2] in pixels"""
+    label_path = Path(str(image_path.with_suffix(".txt")).replace(f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"))
+    if not label_path.exists():
+        return None
+    height, width = shape[:2]
+    boxes = []
+    for line in label_path.read_text().splitlines():
+        parts = line.split()
+        if len(parts) < 5:
+            continue
+        cls, cx, cy, w, h = int(parts[0]), *map(float, parts[1:5])
+        boxes.append([cls, (cx - w / 2) * width, (cy - h / 2) * height, (cx + w / 2) * width, (cy + h / 2) * height])
+    return boxes
+
+
+def _iou(a, b) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match_counts(predictions: List[list], truths: List[list], iou_threshold: float, counts: dict):
+    """Greedy per-class matching by confidence; adds tp/fp/fn per class to counts"""
+    by_class = defaultdict(lambda: ([], []))
+    for cls, conf, *box in predictions:
+        by_class[cls][0].append((conf, box))
+    for cls, *box in truths:
+        by_class[cls][1].append(box)
+    for cls, (predicted, expected) in by_class.items():
+        unmatched = list(expected)
+        for conf, box in sorted(predicted, key=lambda p: -p[0]):
+            best = max(range(len(unmatched)), key=lambda i: _iou(box, unmatched[i]), default=None)
+            if best is not None and _iou(box, unmatched[best]) >= iou_threshold:
+                unmatched.pop(best)
+                counts[cls]["tp"] += 1
+            else:
+                counts[cls]["fp"] += 1
+        counts[cls]["fn"] += len(unmatched)
+
+
+def verdict(service, predictions: List[list]) -> dict:
+    """The service's gate verdict for [class, conf, x1, y1, x2, y2] predictions"""
+    persons, gear = [], []
+    for cls, conf, *box in predictions:
+        class_name = service.class_mapping.get(int(cls), f"Unknown_{int(cls)}")
+        if class_name == "Person":
+            persons.append({"coords": box, "confidence": conf})
+        else:
+            gear.append({"name": class_name, "coords": box, "confidence": conf})
+    return service._evaluate(persons, gear)
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    ordered = sorted(latencies)
+    pick = lambda pct: round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 1)
+    return {"mean_ms": round(sum(ordered) / len(ordered), 1), "p50_ms": pick(50), "p95_ms": pick(95)}
+
+
+def report(args):
+    # Only the service's box matching and verdict logic is needed here, not a model.
+    # config.settings already exists (thread_budget imports it), so set it directly
+    from config import settings
+    settings.DETECTION_MODEL = "stub"
+    settings.MODEL_REGISTRY_FILE = os.path.join(tempfile.mkdtemp(), "none.json")
+    from detection_service import detection_service
+
+    paths = list_images(args.images)
+    if not paths:
+        print(f"❌ No images found in {args.images}")
+        sys.exit(1)
+    runs = {"fp32": run_model(args.fp32, args), "int8": run_model(args.int8, args)}
+    shapes = [cv2.imread(str(path)).shape for path in paths]
+    labels = [read_labels(path, shape) for path, shape in zip(paths, shapes)]
+    labelled = all(label is not None for label in labels)
+    if not labelled:
+        print("No labels found; using the FP32 predictions as ground truth")
+        labels = [[[cls, *box] for cls, conf, *box in image] for image in runs["fp32"]["predictions"]]
+
+    models = {}
+    for name, run in runs.items():
+        counts = defaultdict(lambda: {"tp": 0, "fp": 0, "fn": 0})
+        for predictions, truths in zip(run["predictions"], labels):
+            match_counts(predictions, truths, args.iou, counts)
+        per_class = {}
+        for cls, class_name in detection_service.class_mapping.items():
+            c = counts.get(cls, {"tp": 0, "fp": 0, "fn": 0})
+            per_class[class_name] = {
+                **c,
+                "precision": round(c["tp"] / (c["tp"] + c["fp"]), 4) if c["tp"] + c["fp"] else None,
+                "recall": round(c["tp"] / (c["tp"] + c["fn"]), 4) if c["tp"] + c["fn"] else None,
+            }
+        models[name] = {"latency": latency_summary(run["latencies_ms"]), "memory": run["memory"],
+                        "per_class": per_class}
+
+    same_verdict = same_missing = 0
+    for fp32, int8 in zip(runs["fp32"]["predictions"], runs["int8"]["predictions"]):
+        a, b = verdict(detection_service, fp32), verdict(detection_service, int8)
+        same_verdict += a["is_safe"] == b["is_safe"]
+        same_missing += sorted(json.loads(a["missing_items"])) == sorted(json.loads(b["missing_items"]))
+
+    document = {
+        "images": len(paths),
+        "ground_truth": "labels" if labelled else "fp32 predictions",
+        "iou_threshold": args.iou,
+        "conf_threshold": args.conf,
+        "threads": args.threads,
+        "required_items": detection_service.required_items,
+        "verdict_agreement": round(same_verdict / len(paths), 4),
+        "missing_items_agreement": round(same_missing / len(paths), 4),
+        "speedup": round(models["fp32"]["latency"]["mean_ms"] / models["int8"]["latency"]["mean_ms"], 2),
+        "models": models,
+    }
+
+    print(f"{'class':18s} {'FP32 P':>8s} {'FP32 R':>8s} {'INT8 P':>8s} {'INT8 R':>8s}")
+    fmt = lambda value: f"{value:8.3f}" if value is not None else f"{'-':>8s}"
+    for class_name in detection_service.class_mapping.values():
+        a, b = models["fp32"]["per_class"][class_name], models["int8"]["per_class"][class_name]
+        if a["tp"] + a["fn"] + a["fp"] + b["fp"]:
+            print(f"{class_name:18s} {fmt(a['precision'])} {fmt(a['recall'])} {fmt(b['precision'])} {fmt(b['recall'])}")
+    for name in ("fp32", "int8"):
+        latency, memory = models[name]["latency"], models[name]["memory"]
+        print(f"{name}: p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms, "
+              f"model {memory['model_mb']} MB, peak RSS {memory['peak_rss_mb']} MB, file {memory['file_mb']} MB")
+    print(f"✓ Verdict agreement {document['verdict_agreement']:.1%}, missing items agreement "
+          f"{document['missing_items_agreement']:.1%}, INT8 {document['speedup']}x faster")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(document, handle, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="INT8 quantization of the detection model")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    quantize_parser = commands.add_parser("quantize", help="write a static INT8 model")
+    quantize_parser.add_argument("--model", default="best.onnx")
+    quantize_parser.add_argument("--output", default="best-int8.onnx")
+    quantize_parser.add_argument("--calibration", required=True, help="folder of representative images")
+    quantize_parser.add_argument("--limit", type=int, default=300, help="calibration images to use at most")
+    quantize_parser.add_argument("--method", choices=["MinMax", "Entropy", "Percentile"], default="MinMax")
+    quantize_parser.add_argument("--quantize-head", action="store_true", help="also quantize the detection head")
+    quantize_parser.add_argument("--no-reduce-range", action="store_true",
+                                 help="full 8-bit weights (for CPUs with VNNI)")
+
+    for name, help_text in (("report", "compare FP32 and INT8"), ("_predict", argparse.SUPPRESS)):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument("--images", required=True)
+        sub.add_argument("--conf", type=float, default=0.45)
+        sub.add_argument("--threads", type=int, default=1, help="inference threads for both models")
+        sub.add_argument("--warmup", type=int, default=3)
+    report_parser = commands.choices["report"]
+    report_parser.add_argument("--fp32", default="best.onnx")
+    report_parser.add_argument("--int8", default="best-int8.onnx")
+    report_parser.add_argument("--iou", type=float, default=0.5)
+    report_parser.add_argument("--output", help="write the report as JSON")
+    commands.choices["_predict"].add_argument("--model", required=True)
+
+    args = parser.parse_args()
+    if args.command == "quantize":
+        quantize(args)
+    elif args.command == "report":
+        report(args)
+    else:
+        predict_child(args)
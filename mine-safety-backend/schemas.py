@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 from typing import Optional, List
 
@@ -25,8 +25,9 @@ class Token(BaseModel):
     token_type: str
 
 class DetectionResponse(BaseModel):
-    id: int
+    id: Optional[int]  # None when the write was only queued (DETECTION_WRITE_MODE=enqueue)
     file_path: str
+    file_name: Optional[str] = None
     file_type: str
     is_safe: bool
     confidence: int
@@ -34,12 +35,71 @@ class DetectionResponse(BaseModel):
     missing_items: str
     reason: str
     created_at: datetime
+    model_version: Optional[str] = None
+    quality_level: Optional[int] = None
     
     class Config:
         from_attributes = True
 
+class DetectionPage(BaseModel):
+    items: List[DetectionResponse]
+    next_cursor: Optional[str]
+
 class DashboardStats(BaseModel):
     total_detections: int
     total_accepted: int
     total_denied: int
     recent_detections: List[DetectionResponse]
+
+class ComplianceBucket(BaseModel):
+    bucket_start: datetime
+    total: int
+    safe: int
+    unsafe: int
+    compliance_rate: float
+
+class ItemCount(BaseModel):
+    item: str
+    count: int
+
+class ComplianceTrend(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    buckets: List[ComplianceBucket]
+    most_missing_item: Optional[str]
+
+class MissingItemTrend(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    items: List[ItemCount]
+
+class ItemTrend(BaseModel):
+    kind: str
+    start: datetime
+    end: datetime
+    items: List[ItemCount]
+
+class ModelRegistration(BaseModel):
+    name: str = Field(pattern=r"^[\w.-]+$")
+    version: str = Field(pattern=r"^[\w.-]+$")
+    path: str
+    activate: bool = False
+
+class ModelInfo(BaseModel):
+    name: str
+    version: str
+    path: Optional[str]
+    loaded_at: datetime
+    warmup_ms: Optional[float]
+
+class ModelRegistryState(BaseModel):
+    active: Optional[str]
+    shadow: Optional[str]
+    shadow_sample_rate: float
+    models: List[ModelInfo]
+
+class ShadowConfig(BaseModel):
+    model: Optional[str] = None  # "<name>:<version>" of a registered model
+    sample_rate: float = Field(0.1, ge=0.0, le=1.0)
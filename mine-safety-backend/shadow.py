@@ -0,0 +1,193 @@
+"""Shadow evaluation of a candidate model on live /api/detect traffic.
+
+A fraction of detections (the registry's shadow sample rate) is run a second
+time through the shadow model, after the response has been sent. Each
+comparison records whether both models gave the same verdict and the same
+missing items, and the latency of both. /api/admin/shadow summarises the
+results of this worker, and shadow_comparisons in /metrics counts them
+(summed over the workers when METRICS_MULTIPROC_DIR is set, see metrics.py).
+
+Shadowing is kept off the primary path's CPU:
+- one background thread runs at most one shadow inference at a time, at the
+  lowest scheduling priority (SHADOW_NICE) where the OS allows it
+- a job only starts while no primary inference is waiting for a slot; jobs
+  that can't start within SHADOW_MAX_WAIT_SECONDS are dropped, as are samples
+  arriving while SHADOW_QUEUE_SIZE jobs are already queued
+- after each job the thread rests, so that it is busy at most
+  SHADOW_MAX_CPU_FRACTION of the time
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Callable, Optional
+
+import metrics
+import profiling
+from config import settings
+
+
+def _percentile(values, pct: float) -> Optional[float]:
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 1)
+
+
+class ShadowStats:
+    """Comparison results for one candidate in this process"""
+
+    def __init__(self, candidate: Optional[str] = None, primary: Optional[str] = None):
+        self.candidate = candidate
+        self.primary = primary
+        self.since = datetime.utcnow()
+        self.outcomes: Counter = Counter()
+        self.primary_ms: deque = deque(maxlen=1000)
+        self.shadow_ms: deque = deque(maxlen=1000)
+        self.confidence_delta = 0.0
+        self.disagreements: deque = deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str):
+        with self._lock:
+            self.outcomes[outcome] += 1
+        metrics.SHADOW_COMPARISONS.labels(outcome).inc()
+
+    def compare(self, file_path: str, primary: dict, primary_seconds: float, shadow: dict, shadow_seconds: float):
+        same_verdict = primary["is_safe"] == shadow["is_safe"]
+        same_items = sorted(json.loads(primary["missing_items"])) == sorted(json.loads(shadow["missing_items"]))
+        with self._lock:
+            self.primary_ms.append(primary_seconds * 1000)
+            self.shadow_ms.append(shadow_seconds * 1000)
+            self.confidence_delta += shadow["confidence"] - primary["confidence"]
+            if not same_verdict:
+                self.disagreements.append({
+                    "file_path": file_path,
+                    "at": datetime.utcnow(),
+                    "primary": {key: primary[key] for key in ("is_safe", "confidence", "missing_items", "model_version")},
+                    "shadow": {key: shadow[key] for key in ("is_safe", "confidence", "missing_items", "model_version")},
+                })
+            if same_verdict and not same_items:
+                self.outcomes["item_mismatch"] += 1
+        self.record("agree" if same_verdict else "disagree")
+        metrics.SHADOW_INFERENCE_SECONDS.observe(shadow_seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            compared = self.outcomes["agree"] + self.outcomes["disagree"]
+            return {
+                "candidate": self.candidate,
+                "primary": self.primary,
+                "since": self.since,
+                "compared": compared,
+                "agreement_rate": round(self.outcomes["agree"] / compared, 4) if compared else None,
+                "item_mismatches": self.outcomes["item_mismatch"],
+                "errors": self.outcomes["error"],
+                "dropped_busy": self.outcomes["dropped_busy"],
+                "dropped_queue_full": self.outcomes["dropped_queue_full"],
+                "mean_confidence_delta": round(self.confidence_delta / compared, 2) if compared else None,
+                "primary_p50_ms": _percentile(self.primary_ms, 50),
+                "primary_p95_ms": _percentile(self.primary_ms, 95),
+                "shadow_p50_ms": _percentile(self.shadow_ms, 50),
+                "shadow_p95_ms": _percentile(self.shadow_ms, 95),
+                "recent_disagreements": list(self.disagreements),
+            }
+
+
+class ShadowEvaluator:
+    def __init__(self, service, primary_busy: Callable[[], bool]):
+        self.service = service
+        self.primary_busy = primary_busy
+        self.stats = ShadowStats()
+        # Guards swapping self.stats for a new candidate
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, settings.SHADOW_QUEUE_SIZE))
+        self._thread: Optional[threading.Thread] = None
+        metrics.QUEUE_DEPTH.labels("shadow").set_function(self.qsize)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="shadow-evaluator", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        if self._thread is None:
+            return
+        # Queued jobs are dropped; shadow results are not worth delaying shutdown for
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put(None)
+        self._thread.join(timeout=30)
+        self._thread = None
+
+    def submit(self, file_type: str, file_path: str, primary: dict, primary_seconds: float):
+        """Maybe queue a detection for the shadow model; never blocks the request"""
+        registry = self.service.registry
+        candidate = registry.shadow
+        if candidate is None or candidate is registry.active or primary["model_version"] is None:
+            return
+        if random.random() >= registry.shadow_rate:
+            return
+        with self._lock:
+            if self.stats.candidate != candidate.key or self.stats.primary != primary["model_version"]:
+                self.stats = ShadowStats(candidate.key, primary["model_version"])
+            stats = self.stats
+        try:
+            self._queue.put_nowait((candidate, file_type, file_path, primary, primary_seconds, stats))
+        except queue.Full:
+            stats.record("dropped_queue_full")
+
+    def _wait_for_idle(self) -> bool:
+        deadline = time.monotonic() + settings.SHADOW_MAX_WAIT_SECONDS
+        while self.primary_busy():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def _run(self):
+        profiling.mute()
+        try:
+            # Linux applies niceness per thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), settings.SHADOW_NICE)
+        except (AttributeError, OSError):
+            pass
+
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            candidate, file_type, file_path, primary, primary_seconds, stats = job
+            if not self._wait_for_idle():
+                stats.record("dropped_busy")
+                continue
+
+            start = time.perf_counter()
+            try:
+                if file_type == "image":
+                    result = self.service.detect_image(file_path, candidate, primary["quality_level"] or 0)
+                else:
+                    result = self.service.detect_video(file_path, candidate, primary["quality_level"] or 0)
+            except Exception as e:
+                print(f"❌ Shadow detection failed: {e}")
+                result = None
+            elapsed = time.perf_counter() - start
+
+            if result is None or result["model_version"] is None:
+                stats.record("error")
+            else:
+                stats.compare(file_path, primary, primary_seconds, result, elapsed)
+
+            # Duty cycle: busy for `elapsed`, so rest long enough to stay under the CPU fraction
+            fraction = min(1.0, max(0.01, settings.SHADOW_MAX_CPU_FRACTION))
+            time.sleep(elapsed * (1 - fraction) / fraction)
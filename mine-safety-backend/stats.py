@@ -0,0 +1,324 @@
+"""Incrementally maintained per-user detection counters and time-bucketed rollups.
+
+Rebuild every counter from the detections table with:
+    python stats.py rebuild
+Recompute the hourly/daily/weekly compliance rollups with:
+    python stats.py backfill-rollups
+"""
+import argparse
+import json
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+
+
+def _count_detections(db: Session, user_id: int):
+    """Aggregate a user's counters straight from the detections table"""
+    total, accepted, denied = db.query(
+        func.count(models.Detection.id),
+        func.coalesce(func.sum(case((models.Detection.is_safe == True, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((models.Detection.is_safe == False, 1), else_=0)), 0),
+    ).filter(models.Detection.user_id == user_id).one()
+    return total, accepted, denied
+
+
+def _increment(db: Session, user_id: int, total: int, accepted: int, denied: int) -> bool:
+    updated = db.query(models.UserStats).filter(models.UserStats.user_id == user_id).update({
+        models.UserStats.total_detections: models.UserStats.total_detections + total,
+        models.UserStats.total_accepted: models.UserStats.total_accepted + accepted,
+        models.UserStats.total_denied: models.UserStats.total_denied + denied,
+        models.UserStats.version: models.UserStats.version + 1,
+    }, synchronize_session=False)
+    return updated > 0
+
+
+def _initialize(db: Session, user_id: int) -> models.UserStats:
+    """Create a user's counter row from existing history (including rows flushed in this transaction)"""
+    total, accepted, denied = _count_detections(db, user_id)
+    user_stats = models.UserStats(
+        user_id=user_id,
+        total_detections=total,
+        total_accepted=accepted,
+        total_denied=denied,
+        version=1
+    )
+    with db.begin_nested():
+        db.add(user_stats)
+    return user_stats
+
+
+def record_detections(db: Session, detections: Iterable[models.Detection]):
+    """Fold newly flushed detections into their users' counters and rollups.
+
+    Runs inside the caller's transaction so the counters commit (or roll back)
+    together with the detection rows.
+    """
+    detections = list(detections)
+    record_rollups(db, detections)
+
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for detection in detections:
+        delta = deltas[detection.user_id]
+        delta[0] += 1
+        if detection.is_safe is True:
+            delta[1] += 1
+        elif detection.is_safe is False:
+            delta[2] += 1
+
+    for user_id, (total, accepted, denied) in deltas.items():
+        if _increment(db, user_id, total, accepted, denied):
+            continue
+        try:
+            _initialize(db, user_id)
+        except IntegrityError:
+            # Another transaction created the row first; its counts exclude our uncommitted rows
+            _increment(db, user_id, total, accepted, denied)
+
+
+def bump_versions(db: Session, user_ids: Iterable[int]):
+    """Mark users' data as changed without touching their counters (e.g. rows were archived)"""
+    user_ids = list(user_ids)
+    if user_ids:
+        db.query(models.UserStats).filter(models.UserStats.user_id.in_(user_ids)).update({
+            models.UserStats.version: models.UserStats.version + 1,
+        }, synchronize_session=False)
+
+
+def get_user_version(db: Session, user_id: int) -> int:
+    """Current data version of a user (0 before their first detection)"""
+    version = db.query(models.UserStats.version).filter(models.UserStats.user_id == user_id).scalar()
+    return version or 0
+
+
+def get_user_stats(db: Session, user_id: int) -> models.UserStats:
+    """Primary-key lookup of a user's counters; read-only, so safe on the read session.
+
+    The row is created on the write path (at registration or with the user's
+    first detection). Until then the counts are aggregated from the
+    detections table and returned unsaved.
+    """
+    user_stats = db.get(models.UserStats, user_id)
+    if user_stats is not None:
+        return user_stats
+
+    total, accepted, denied = _count_detections(db, user_id)
+    return models.UserStats(user_id=user_id, total_detections=total, total_accepted=accepted,
+                            total_denied=denied, version=0)
+
+
+def rebuild_user_stats(db: Session) -> int:
+    """Recompute every user's counters from the detections table"""
+    rows = db.query(
+        models.Detection.user_id,
+        func.count(models.Detection.id),
+        func.coalesce(func.sum(case((models.Detection.is_safe == True, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((models.Detection.is_safe == False, 1), else_=0)), 0),
+    ).filter(models.Detection.user_id.isnot(None)).group_by(models.Detection.user_id).all()
+
+    # Carry versions forward so rebuilt counters still invalidate cached responses
+    versions = dict(db.query(models.UserStats.user_id, models.UserStats.version).all())
+    db.query(models.UserStats).delete(synchronize_session=False)
+    db.add_all([
+        models.UserStats(
+            user_id=user_id,
+            total_detections=total,
+            total_accepted=accepted,
+            total_denied=denied,
+            version=versions.get(user_id, 0) + 1
+        )
+        for user_id, total, accepted, denied in rows
+    ])
+    db.commit()
+    return len(rows)
+
+
+GRANULARITIES = ("hour", "day", "week")
+
+# Range returned by the trend endpoints when the caller does not give a start
+DEFAULT_SPANS = {
+    "hour": timedelta(hours=48),
+    "day": timedelta(days=30),
+    "week": timedelta(weeks=26),
+}
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    """Floor a timestamp to the start of its hour, day or (Monday-based) week"""
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def as_naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """Convert an aware timestamp to the naive UTC form stored in created_at columns"""
+    if moment is not None and moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def resolve_range(granularity: str, start: Optional[datetime], end: Optional[datetime]):
+    """Fill in a default trend range and normalize both ends to naive UTC like created_at"""
+    end = as_naive_utc(end) if end else datetime.utcnow()
+    start = as_naive_utc(start) if start else end - DEFAULT_SPANS[granularity]
+    return start, end
+
+
+def parse_items(value: Optional[str]) -> List[str]:
+    """Decode a JSON-encoded item list column, tolerating malformed rows"""
+    try:
+        items = json.loads(value or "[]")
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(items, list):
+        return []
+    return [item for item in items if isinstance(item, str)]
+
+
+def _aggregate_rollups(detections: Iterable[models.Detection]) -> Tuple[Dict, Dict]:
+    """Group detections into (user, granularity, bucket) verdict and missing-item deltas"""
+    verdicts = defaultdict(lambda: [0, 0, 0])
+    missing = Counter()
+    for detection in detections:
+        created_at = detection.created_at or datetime.utcnow()
+        items = parse_items(detection.missing_items)
+        for granularity in GRANULARITIES:
+            key = (detection.user_id, granularity, bucket_start(created_at, granularity))
+            delta = verdicts[key]
+            delta[0] += 1
+            if detection.is_safe is True:
+                delta[1] += 1
+            elif detection.is_safe is False:
+                delta[2] += 1
+            for item in items:
+                missing[key + (item,)] += 1
+    return verdicts, missing
+
+
+def _add_to_row(db: Session, model, key: dict, deltas: dict):
+    """Increment counter columns of a keyed row, inserting it if it does not exist yet"""
+    values = {getattr(model, column): getattr(model, column) + amount for column, amount in deltas.items()}
+    if db.query(model).filter_by(**key).update(values, synchronize_session=False):
+        return
+    try:
+        with db.begin_nested():
+            db.add(model(**key, **deltas))
+    except IntegrityError:
+        db.query(model).filter_by(**key).update(values, synchronize_session=False)
+
+
+def record_rollups(db: Session, detections: Iterable[models.Detection]):
+    """Fold newly flushed detections into the hourly/daily/weekly rollups"""
+    verdicts, missing = _aggregate_rollups(detections)
+    for (user_id, granularity, start), (total, safe, unsafe) in verdicts.items():
+        _add_to_row(
+            db, models.ComplianceRollup,
+            {"user_id": user_id, "granularity": granularity, "bucket_start": start},
+            {"total": total, "safe": safe, "unsafe": unsafe}
+        )
+    for (user_id, granularity, start, item), count in missing.items():
+        _add_to_row(
+            db, models.MissingItemRollup,
+            {"user_id": user_id, "granularity": granularity, "bucket_start": start, "item": item},
+            {"count": count}
+        )
+
+
+def backfill_rollups(db: Session, batch_size: int = 5000) -> int:
+    """Recompute every rollup from the detections table"""
+    verdicts = defaultdict(lambda: [0, 0, 0])
+    missing = Counter()
+    processed = 0
+    rows = db.execute(
+        select(
+            models.Detection.user_id,
+            models.Detection.created_at,
+            models.Detection.is_safe,
+            models.Detection.missing_items
+        )
+        .where(models.Detection.user_id.isnot(None))
+        .execution_options(yield_per=batch_size)
+    )
+    for batch in rows.partitions():
+        batch_verdicts, batch_missing = _aggregate_rollups(batch)
+        for key, (total, safe, unsafe) in batch_verdicts.items():
+            delta = verdicts[key]
+            delta[0] += total
+            delta[1] += safe
+            delta[2] += unsafe
+        missing.update(batch_missing)
+        processed += len(batch)
+
+    db.query(models.ComplianceRollup).delete(synchronize_session=False)
+    db.query(models.MissingItemRollup).delete(synchronize_session=False)
+    db.add_all([
+        models.ComplianceRollup(
+            user_id=user_id, granularity=granularity, bucket_start=start,
+            total=total, safe=safe, unsafe=unsafe
+        )
+        for (user_id, granularity, start), (total, safe, unsafe) in verdicts.items()
+    ])
+    db.add_all([
+        models.MissingItemRollup(
+            user_id=user_id, granularity=granularity, bucket_start=start, item=item, count=count
+        )
+        for (user_id, granularity, start, item), count in missing.items()
+    ])
+    db.commit()
+    return processed
+
+
+def compliance_trend(db: Session, user_id: int, granularity: str, start: datetime, end: datetime):
+    """Read verdict buckets for a time range from the rollups only"""
+    return db.query(models.ComplianceRollup).filter(
+        models.ComplianceRollup.user_id == user_id,
+        models.ComplianceRollup.granularity == granularity,
+        models.ComplianceRollup.bucket_start >= bucket_start(start, granularity),
+        models.ComplianceRollup.bucket_start <= end
+    ).order_by(models.ComplianceRollup.bucket_start).all()
+
+
+def missing_item_counts(db: Session, user_id: int, granularity: str, start: datetime, end: datetime,
+                        limit: Optional[int] = None):
+    """Sum missing-item counts over a time range from the rollups, most frequent first"""
+    total = func.sum(models.MissingItemRollup.count)
+    query = db.query(models.MissingItemRollup.item, total).filter(
+        models.MissingItemRollup.user_id == user_id,
+        models.MissingItemRollup.granularity == granularity,
+        models.MissingItemRollup.bucket_start >= bucket_start(start, granularity),
+        models.MissingItemRollup.bucket_start <= end
+    ).group_by(models.MissingItemRollup.item).order_by(total.desc(), models.MissingItemRollup.item)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+    from migrations import run_migrations
+
+    parser = argparse.ArgumentParser(description="Maintain per-user detection counters and rollups")
+    parser.add_argument("command", choices=["rebuild", "backfill-rollups"])
+    args = parser.parse_args()
+
+    run_migrations(engine)
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            count = rebuild_user_stats(db)
+            print(f"✓ Rebuilt counters for {count} users")
+        else:
+            count = backfill_rollups(db)
+            print(f"✓ Rebuilt rollups from {count} detections")
+    finally:
+        db.close()
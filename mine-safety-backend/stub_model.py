@@ -0,0 +1,124 @@
+"""Deterministic stand-in for the YOLO model (DETECTION_MODEL=stub), for benchmarks
+and load tests that must run offline.
+
+StubModel.predict() takes the same sources as ultralytics (path, PIL image or
+BGR array) and returns objects with the same shape as ultralytics Results:
+`.boxes` iterates boxes with `.cls`, `.conf` and `.xyxy`, and `.speed` holds
+the preprocess/inference/postprocess times in milliseconds.
+
+Preprocessing does the real letterbox resize and normalisation work. The boxes
+come from a checksum of the image, so the same image always gives the same
+detections. Inference is simulated by an optional fixed delay, and an optional
+weight buffer stands in for the model's memory footprint.
+"""
+import time
+import zlib
+from typing import List
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PERSON = 8
+GEAR_CLASSES = (2, 11, 1, 4, 5, 7)  # Hardhat, Safety Vest, Gloves, Mask, NO-Hardhat, NO-Safety Vest
+
+
+class StubBox:
+    def __init__(self, class_id: int, xyxy, confidence: float):
+        self.cls = np.array([class_id], dtype=np.float32)
+        self.conf = np.array([confidence], dtype=np.float32)
+        self.xyxy = np.array([xyxy], dtype=np.float32)
+
+
+class StubBoxes(list):
+    pass
+
+
+class StubResult:
+    def __init__(self, boxes: List[StubBox], speed: dict, shape):
+        self.boxes = StubBoxes(boxes)
+        self.speed = speed
+        self.orig_shape = shape
+
+
+def _to_bgr(source) -> np.ndarray:
+    if isinstance(source, str):
+        image = cv2.imread(source)
+        if image is None:
+            raise ValueError(f"Could not read {source}")
+        return image
+    if isinstance(source, Image.Image):
+        return cv2.cvtColor(np.asarray(source.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return source
+
+
+def letterbox(image: np.ndarray, size: int = 640) -> np.ndarray:
+    """Resize keeping the aspect ratio and pad to size x size, like YOLO preprocessing"""
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    resized = cv2.resize(image, (int(round(width * scale)), int(round(height * scale))),
+                         interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[:resized.shape[0], :resized.shape[1]] = resized
+    return canvas
+
+
+class StubModel:
+    def __init__(self, inference_ms: float = 0.0, max_people: int = 3, max_gear: int = 6, imgsz: int = 640,
+                 weights_mb: int = 0):
+        self.inference_ms = inference_ms
+        self.max_people = max_people
+        self.max_gear = max_gear
+        self.imgsz = imgsz
+        # Written once at load, only read afterwards, like real weights
+        self.weights = np.random.default_rng(0).random(weights_mb * 1024 * 1024 // 8) if weights_mb else None
+
+    def _boxes(self, image: np.ndarray) -> List[StubBox]:
+        height, width = image.shape[:2]
+        thumbnail = cv2.resize(image, (16, 16), interpolation=cv2.INTER_AREA)
+        rng = np.random.default_rng(zlib.crc32(thumbnail.tobytes()))
+
+        boxes = []
+        for _ in range(rng.integers(0, self.max_people + 1)):
+            x1, y1 = rng.uniform(0, 0.6) * width, rng.uniform(0, 0.5) * height
+            w, h = rng.uniform(0.15, 0.4) * width, rng.uniform(0.3, 0.5) * height
+            person = [x1, y1, min(width, x1 + w), min(height, y1 + h)]
+            boxes.append(StubBox(PERSON, person, rng.uniform(0.5, 0.99)))
+            for _ in range(rng.integers(0, self.max_gear + 1)):
+                # Gear mostly sits inside its person, sometimes drifts off
+                gx = person[0] + rng.uniform(-0.2, 0.8) * (person[2] - person[0])
+                gy = person[1] + rng.uniform(-0.1, 0.8) * (person[3] - person[1])
+                size = rng.uniform(0.1, 0.4) * (person[2] - person[0])
+                boxes.append(StubBox(
+                    int(rng.choice(GEAR_CLASSES)),
+                    [gx, gy, gx + size, gy + size],
+                    rng.uniform(0.3, 0.99)
+                ))
+        return boxes
+
+    def predict(self, source, conf: float = 0.25, verbose: bool = False, **kwargs):
+        if isinstance(source, list):
+            # A batch: one result per image, like ultralytics
+            return [self.predict(item, conf, verbose, **kwargs)[0] for item in source]
+        start = time.perf_counter()
+        image = _to_bgr(source)
+        tensor = letterbox(image, self.imgsz).astype(np.float32) / 255.0
+        tensor = np.ascontiguousarray(tensor.transpose(2, 0, 1))[None]
+        preprocessed = time.perf_counter()
+
+        if self.weights is not None:
+            float(self.weights[::4096].sum())
+        if self.inference_ms:
+            time.sleep(self.inference_ms / 1000)
+        boxes = self._boxes(image)
+        inferred = time.perf_counter()
+
+        boxes = [box for box in boxes if float(box.conf[0]) >= conf]
+        done = time.perf_counter()
+
+        speed = {
+            "preprocess": (preprocessed - start) * 1000,
+            "inference": (inferred - preprocessed) * 1000,
+            "postprocess": (done - inferred) * 1000,
+        }
+        return [StubResult(boxes, speed, image.shape[:2])]
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# main.py creates uploads/ and the database relative to the working directory
+_workdir = tempfile.mkdtemp(prefix="mine_safety_tests_")
+os.chdir(_workdir)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_workdir}/test.db")
+os.environ.setdefault("DETECTION_MODEL", "stub")
+os.environ.setdefault("MODEL_REGISTRY_FILE", os.path.join(_workdir, "model_registry.json"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,208 @@
+import asyncio
+import io
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import admission
+from config import settings
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_free_slots_alternate_between_users(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_USER_CONCURRENCY", 1)
+
+    async def scenario():
+        scheduler = admission.AdmissionScheduler(capacity=1)
+        tickets = [scheduler.enqueue("a") for _ in range(3)] + [scheduler.enqueue("b") for _ in range(3)]
+        order = []
+        for _ in tickets:
+            ticket = next(t for t in tickets if t.granted is not None and not t.released)
+            order.append(ticket.user)
+            ticket.release()
+        return order
+
+    # a arrived first with three, but b gets every other slot
+    assert run(scenario()) == ["a", "b", "a", "b", "a", "b"]
+
+
+def test_weights_share_slots_in_proportion(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_USER_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "ADMISSION_USER_WEIGHTS", "a=2")
+
+    async def scenario():
+        scheduler = admission.AdmissionScheduler(capacity=1)
+        tickets = [scheduler.enqueue("a") for _ in range(4)] + [scheduler.enqueue("b") for _ in range(2)]
+        order = []
+        for _ in tickets:
+            ticket = next(t for t in tickets if t.granted is not None and not t.released)
+            order.append(ticket.user)
+            ticket.release()
+        return order
+
+    assert run(scenario()) == ["a", "a", "b", "a", "a", "b"]
+
+
+def test_user_over_its_queue_gets_429(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_USER_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "ADMISSION_USER_QUEUE", 2)
+
+    async def scenario():
+        scheduler = admission.AdmissionScheduler(capacity=1)
+        for _ in range(3):  # one running, two waiting
+            scheduler.enqueue("a")
+        with pytest.raises(admission.Rejected) as rejected:
+            scheduler.enqueue("a")
+        # Other users are still admitted
+        scheduler.enqueue("b")
+        return rejected.value
+
+    rejected = run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+
+
+def test_full_queue_gets_503(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_QUEUE_SIZE", 2)
+
+    async def scenario():
+        scheduler = admission.AdmissionScheduler(capacity=1)
+        for user in ("a", "b", "c"):  # one running, two waiting
+            scheduler.enqueue(user)
+        with pytest.raises(admission.Rejected) as rejected:
+            scheduler.enqueue("d")
+        return rejected.value
+
+    rejected = run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.retry_after >= 1
+
+
+def test_ticket_past_max_wait_is_shed_with_503(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_MAX_WAIT_SECONDS", 0.1)
+
+    async def scenario():
+        scheduler = admission.AdmissionScheduler(capacity=1)
+        scheduler.enqueue("a")
+        waiting = scheduler.enqueue("b")
+        with pytest.raises(admission.Rejected) as rejected:
+            await waiting.wait()
+        return scheduler, rejected.value
+
+    scheduler, rejected = run(scenario())
+    assert rejected.status_code == 503
+    assert scheduler.queued == 0
+    assert "b" not in scheduler.summary()["users"]
+
+
+def test_disconnected_client_leaves_the_queue():
+    async def scenario():
+        scheduler = admission.AdmissionScheduler(capacity=1)
+        running = scheduler.enqueue("a")
+        waiting = scheduler.enqueue("b")
+
+        async def disconnected():
+            return True
+
+        with pytest.raises(admission.ClientDisconnected):
+            await waiting.wait(disconnected)
+        waiting.release()
+        running.release()
+        return scheduler
+
+    scheduler = run(scenario())
+    assert scheduler.queued == 0
+    assert scheduler.running == 0
+    assert scheduler.summary()["users"] == {}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    import main
+    import models
+    from auth import get_current_user
+
+    main.app.dependency_overrides[get_current_user] = lambda: models.User(id=7, username="gate-north")
+    yield main
+    main.app.dependency_overrides.clear()
+
+
+def _uploads(app) -> set:
+    return set(app.UPLOAD_DIR.iterdir())
+
+
+def _post_image(client):
+    return client.post("/api/detect", files={"file": ("shift.jpg", io.BytesIO(b"jpeg"), "image/jpeg")})
+
+
+def test_timed_out_request_writes_no_upload(app, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    # No free slot, so the request waits until it is shed
+    monkeypatch.setattr(app.admission_scheduler, "capacity", 0)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_WAIT_SECONDS", 0.1)
+    before = _uploads(app)
+
+    response = _post_image(TestClient(app.app))
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert _uploads(app) == before
+
+
+def test_disconnected_request_writes_no_upload(app, monkeypatch):
+    from fastapi.testclient import TestClient
+    from starlette.requests import Request
+
+    async def disconnected(self):
+        return True
+
+    monkeypatch.setattr(Request, "is_disconnected", disconnected)
+    monkeypatch.setattr(app.admission_scheduler, "capacity", 0)
+    before = _uploads(app)
+
+    response = _post_image(TestClient(app.app))
+
+    assert response.status_code == 499
+    assert _uploads(app) == before
+
+
+def test_shed_request_leaves_the_admitted_ones_upload_alone(app, monkeypatch):
+    import httpx
+
+    # One slot: the first request holds it past the second one's maximum wait
+    monkeypatch.setattr(app.admission_scheduler, "capacity", 1)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_WAIT_SECONDS", 0.2)
+    run_detection = app._run_detection
+
+    def slow_detection(file_type, file_path):
+        time.sleep(0.6)
+        return run_detection(file_type, file_path)
+
+    monkeypatch.setattr(app, "_run_detection", slow_detection)
+    image = cv2.imencode(".jpg", np.zeros((240, 320, 3), dtype=np.uint8))[1].tobytes()
+    before = _uploads(app)
+
+    async def post_twice():
+        transport = httpx.ASGITransport(app=app.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await asyncio.gather(*(
+                    client.post("/api/detect", files={"file": ("shift.jpg", image, "image/jpeg")})
+                    for _ in range(2)
+                ))
+        finally:
+            # aiosqlite connections belong to this event loop
+            await app.dispose_async_engines()
+
+    responses = run(post_twice())
+
+    assert sorted(response.status_code for response in responses) == [200, 503]
+    admitted = next(response for response in responses if response.status_code == 200)
+    assert _uploads(app) - before == {app.UPLOAD_DIR / os.path.basename(admitted.json()["file_path"])}
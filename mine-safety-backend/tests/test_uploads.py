@@ -0,0 +1,78 @@
+import asyncio
+import json
+import threading
+
+import cv2
+import httpx
+import numpy as np
+import pytest
+
+from config import settings
+
+
+def _image(seed: int) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", pixels)[1].tobytes()
+
+
+def _verdict(result: dict) -> tuple:
+    return result["is_safe"], sorted(json.loads(result["detected_items"])), sorted(json.loads(result["missing_items"]))
+
+
+@pytest.fixture
+def app(monkeypatch):
+    import main
+    import models
+    from auth import get_current_user
+
+    # Two slots for the one user, so both requests are saved and run side by side
+    monkeypatch.setattr(main.admission_scheduler, "capacity", 2)
+    monkeypatch.setattr(settings, "ADMISSION_USER_CONCURRENCY", 2)
+    monkeypatch.setattr(main.inference_limiter, "total_tokens", 2)
+    main.app.dependency_overrides[get_current_user] = lambda: models.User(id=7, username="gate-north")
+    yield main
+    main.app.dependency_overrides.clear()
+
+
+def test_concurrent_uploads_with_the_same_name_keep_their_own_image(app, monkeypatch, tmp_path):
+    # Two images the stub model gives different verdicts
+    images, expected = [], []
+    for seed in range(50):
+        path = tmp_path / f"{seed}.jpg"
+        path.write_bytes(_image(seed))
+        verdict = _verdict(app.detection_service.detect_image(str(path)))
+        if verdict not in expected:
+            images.append(path.read_bytes())
+            expected.append(verdict)
+        if len(images) == 2:
+            break
+
+    # Both uploads are on disk before either is detected
+    both_saved = threading.Barrier(2, timeout=10)
+    save_upload = app._save_upload
+
+    def save_then_wait(source, file_path):
+        save_upload(source, file_path)
+        both_saved.wait()
+
+    monkeypatch.setattr(app, "_save_upload", save_then_wait)
+
+    async def post_both():
+        transport = httpx.ASGITransport(app=app.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await asyncio.gather(*(
+                    client.post("/api/detect", files={"file": ("frame.jpg", image, "image/jpeg")})
+                    for image in images
+                ))
+        finally:
+            # aiosqlite connections belong to this event loop
+            await app.dispose_async_engines()
+
+    responses = asyncio.run(post_both())
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert [_verdict(response.json()) for response in responses] == expected
+    paths = [response.json()["file_path"] for response in responses]
+    assert paths[0] != paths[1]
+    assert [response.json()["file_name"] for response in responses] == ["frame.jpg", "frame.jpg"]
@@ -0,0 +1,157 @@
+"""One CPU thread budget for every library that runs its own thread pool.
+
+torch, ONNX Runtime, OpenCV and the BLAS behind NumPy each size their pools
+from the machine's core count. Several workers, each running several
+inferences at once, then put dozens of busy threads on every core. Here all of
+them derive from INFERENCE_THREADS, the cores one inference may use:
+
+    OpenCV, BLAS/OpenMP, torch intra-op   INFERENCE_THREADS, by default all of
+                                          the process's cores
+    torch inter-op                        INFERENCE_INTEROP_THREADS
+    inferences running at once            INFERENCE_CONCURRENCY, by default 1
+
+A loaded ultralytics model is not thread-safe (each call's imgsz and conf are
+kept on its shared predictor), so predictions on one model are serialised
+anyway; more than one inference at a time only overlaps decoding, the person
+gate and matching. The cores are better spent inside the one inference.
+
+CPU_AFFINITY optionally pins the process: "auto" gives every gunicorn worker
+its own slice of the CPUs, a list such as "0-3,6" pins a single process.
+
+BLAS and OpenMP read their thread counts when they are first loaded, so this
+module sets the environment variables on import and must be imported before
+NumPy. threadpoolctl, if installed, adjusts them at runtime as well.
+ultralytics creates its ONNX Runtime session without session options, so that
+session is only contained by CPU_AFFINITY. Sessions created here take
+`onnx_session_options()`.
+"""
+import os
+import sys
+from typing import List, Optional, Tuple
+
+from config import settings
+
+_BLAS_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+             "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+
+# What the last apply() set, for the inference limiter and /metrics
+current = {"threads": 1, "interop_threads": 1, "concurrency": 1, "cpus": None}
+
+
+def available_cpus() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def cpu_count() -> int:
+    """CPUs this process may use, honouring affinity and a cgroup v2 CPU quota"""
+    cpus = len(available_cpus())
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as handle:
+            quota, period = handle.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def worker_budget(cpus: int) -> Tuple[int, int]:
+    """(workers, inference threads per worker) with workers x threads ~= cpus"""
+    workers, threads = settings.WEB_CONCURRENCY, settings.INFERENCE_THREADS
+    if workers <= 0 and threads <= 0:
+        threads = 2 if cpus >= 4 else 1
+    if workers <= 0:
+        workers = max(1, cpus // threads)
+    if threads <= 0:
+        threads = max(1, cpus // workers)
+    return workers, threads
+
+
+def parse_cpu_list(value: str) -> List[int]:
+    """'0-3,6' -> [0, 1, 2, 3, 6]"""
+    cpus = []
+    for part in value.split(","):
+        start, _, end = part.strip().partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def worker_cpus(index: int, workers: int) -> Optional[List[int]]:
+    """The CPUs a process should be pinned to under CPU_AFFINITY (None: don't pin)"""
+    if not settings.CPU_AFFINITY:
+        return None
+    if settings.CPU_AFFINITY != "auto":
+        return parse_cpu_list(settings.CPU_AFFINITY)
+    cpus = available_cpus()
+    size = max(1, len(cpus) // workers)
+    start = (index % max(1, len(cpus) // size)) * size
+    return cpus[start:start + size]
+
+
+def _set_env(threads: int):
+    for name in _BLAS_ENV:
+        os.environ[name] = str(threads)
+
+
+def apply(threads: int, interop_threads: int = 1, cpus: Optional[List[int]] = None,
+          processes: int = 1) -> dict:
+    """Set every library's pool to the budget; call again after fork to re-split it.
+
+    Unpinned, the CPUs are shared with `processes` sibling workers. Unless
+    INFERENCE_THREADS is set, a single inference at a time gets all of them.
+    """
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            print(f"❌ Could not pin to CPUs {cpus}: {e}")
+            cpus = None
+    available = len(cpus) if cpus else max(1, cpu_count() // processes)
+    concurrency = settings.INFERENCE_CONCURRENCY or 1
+    if not settings.INFERENCE_THREADS:
+        threads = max(threads, available // concurrency)
+    _set_env(threads)
+
+    import cv2
+    cv2.setNumThreads(threads)
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+    except ImportError:
+        pass
+
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Only settable before torch's first parallel work
+            pass
+
+    current.update(threads=threads, interop_threads=interop_threads, concurrency=concurrency, cpus=cpus)
+    return current
+
+
+def onnx_session_options():
+    """ONNX Runtime session options sized to the budget"""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = current["threads"]
+    options.inter_op_num_threads = current["interop_threads"]
+    return options
+
+
+def default_threads() -> int:
+    """Inference threads for a single process; gunicorn re-splits them per worker"""
+    return settings.INFERENCE_THREADS or worker_budget(cpu_count())[1]
+
+
+# Before NumPy/OpenCV load their thread pools (explicit environment settings win)
+for _name in _BLAS_ENV:
+    os.environ.setdefault(_name, str(default_threads()))
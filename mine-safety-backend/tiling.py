@@ -0,0 +1,164 @@
+"""Tiled (sliced) inference for high-resolution overview images.
+
+Squeezed into the model's 640 px input, the workers in a wide-angle yard
+photo are a handful of pixels tall. With TILED_INFERENCE set, an image is
+cut into TILE_SIZE squares overlapping by TILE_OVERLAP. Each tile goes
+through the model at TILE_SIZE, so it isn't scaled down, and the tiles run
+in batches of TILE_BATCH (1 for ONNX files exported with a fixed batch
+size). The whole frame runs as one more input, because
+people close to the camera are larger than a tile. Boxes are mapped back to
+frame coordinates and merged per class with NMS. A box is also dropped when
+it lies mostly inside a more confident box of its class, which removes the
+partial boxes that tiles cut at their edges. The merged boxes then go through
+the usual person/gear logic.
+
+    auto     only images whose long side is at least TILE_MIN_IMAGE_PX
+    always   every image (and video frame)
+
+For predictable throughput, tiles that are nearly flat (greyscale standard
+deviation under TILE_EMPTY_STD, e.g. sky or bare ground) are skipped. When
+the grid would need more than TILE_MAX_TILES tiles, the tiles are enlarged
+until it doesn't. tile_inference counts tiles run and skipped in /metrics,
+and the time spent cutting and merging is the tiling stage.
+"""
+import time
+from typing import List
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import metrics
+import profiling
+from config import settings
+from person_gate import as_bgr
+
+# A box with this share of its area inside a more confident box of the same class is a duplicate
+CONTAINED_FRACTION = 0.8
+
+
+class TiledBox:
+    """One merged box, shaped like an ultralytics box (cls/conf/xyxy rows)"""
+
+    def __init__(self, class_id: int, confidence: float, xyxy):
+        self.cls = np.array([class_id], dtype=np.float32)
+        self.conf = np.array([confidence], dtype=np.float32)
+        self.xyxy = np.array([xyxy], dtype=np.float32)
+
+
+class TiledResult:
+    def __init__(self, boxes: List[TiledBox], speed: dict):
+        self.boxes = boxes
+        self.speed = speed
+
+
+def tile_starts(length: int, tile: int, overlap: float) -> List[int]:
+    """Tile offsets covering `length`, the last one flush with the edge"""
+    if length <= tile:
+        return [0]
+    step = max(1, int(tile * (1 - overlap)))
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def _overlaps(a: np.ndarray, b: np.ndarray, iou: float) -> bool:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    if inter == 0:
+        return False
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return (inter / (area_a + area_b - inter) >= iou
+            or inter / max(min(area_a, area_b), 1e-9) >= CONTAINED_FRACTION)
+
+
+def merge_boxes(boxes: List[tuple], iou: float) -> List[TiledBox]:
+    """Per-class greedy NMS over (class_id, confidence, xyxy) from every tile"""
+    merged = []
+    for class_id in {box[0] for box in boxes}:
+        candidates = sorted((box for box in boxes if box[0] == class_id), key=lambda box: -box[1])
+        while candidates:
+            best = candidates.pop(0)
+            merged.append(TiledBox(*best))
+            candidates = [box for box in candidates if not _overlaps(best[2], box[2], iou)]
+    return merged
+
+
+class Tiler:
+    def __init__(self):
+        self.mode = settings.TILED_INFERENCE
+
+    def applies(self, image) -> bool:
+        if self.mode == "off":
+            return False
+        if self.mode == "always":
+            return True
+        if isinstance(image, Image.Image):
+            width, height = image.size
+        else:
+            height, width = image.shape[:2]
+        return max(height, width) >= settings.TILE_MIN_IMAGE_PX
+
+    def _grid(self, height: int, width: int):
+        tile = settings.TILE_SIZE
+        while True:
+            xs = tile_starts(width, tile, settings.TILE_OVERLAP)
+            ys = tile_starts(height, tile, settings.TILE_OVERLAP)
+            if len(xs) * len(ys) <= max(1, settings.TILE_MAX_TILES):
+                return tile, xs, ys
+            tile = int(tile * 1.25)
+
+    def _is_empty(self, tile: np.ndarray) -> bool:
+        if settings.TILE_EMPTY_STD <= 0:
+            return False
+        small = cv2.resize(tile, (64, 64), interpolation=cv2.INTER_AREA)
+        gray = small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return float(gray.std()) < settings.TILE_EMPTY_STD
+
+    def predict(self, model, image, conf: float) -> List[TiledResult]:
+        """Run the model over the tiles (and the whole frame) and merge the boxes"""
+        start = time.perf_counter()
+        image = as_bgr(image)
+        height, width = image.shape[:2]
+        tile, xs, ys = self._grid(height, width)
+
+        inputs, offsets = [], []
+        if settings.TILE_FULL_FRAME:
+            inputs.append(image)
+            offsets.append((0, 0))
+        skipped = 0
+        for y in ys:
+            for x in xs:
+                crop = image[y:y + tile, x:x + tile]
+                if self._is_empty(crop):
+                    skipped += 1
+                    continue
+                inputs.append(crop)
+                offsets.append((x, y))
+        if not profiling.is_muted():
+            metrics.TILE_INFERENCE.labels("run").inc(len(inputs) - int(settings.TILE_FULL_FRAME))
+            metrics.TILE_INFERENCE.labels("skipped_empty").inc(skipped)
+        prepared = time.perf_counter() - start
+
+        boxes, speed = [], {}
+        batch = max(1, settings.TILE_BATCH)
+        for index in range(0, len(inputs), batch):
+            results = model.predict(source=inputs[index:index + batch], imgsz=settings.TILE_SIZE,
+                                    conf=conf, verbose=False)
+            for r, (x, y) in zip(results, offsets[index:index + batch]):
+                for stage, ms in (getattr(r, "speed", None) or {}).items():
+                    if ms is not None:
+                        speed[stage] = speed.get(stage, 0.0) + ms
+                if r.boxes is None:
+                    continue
+                for box in r.boxes:
+                    x1, y1, x2, y2 = box.xyxy[0].tolist()
+                    boxes.append((int(box.cls[0]), float(box.conf[0]),
+                                  np.array([x1 + x, y1 + y, x2 + x, y2 + y], dtype=np.float32)))
+
+        merge_start = time.perf_counter()
+        merged = merge_boxes(boxes, settings.TILE_NMS_IOU)
+        profiling.record_stage("tiling", prepared + time.perf_counter() - merge_start)
+        return [TiledResult(merged, speed)]
@@ -0,0 +1,190 @@
+"""Write-behind batching of Detection inserts.
+
+With DETECTION_WRITE_MODE set to "flush" or "enqueue", /api/detect hands its
+Detection to a background writer instead of committing it itself. The writer
+collects records until it has DETECTION_WRITE_BATCH_SIZE of them or
+DETECTION_WRITE_FLUSH_MS has passed, then inserts the whole batch (plus the
+derived counters, rollups and items) in one transaction.
+
+- "flush": the request waits until its batch is committed (durable, id known)
+- "enqueue": the request returns as soon as the record is queued; records still
+  queued when the process dies are lost
+
+A batch that fails to commit (e.g. "database is locked") is retried
+DETECTION_WRITE_RETRIES times with exponential backoff from
+DETECTION_WRITE_RETRY_MS. If it still fails, its rows are inserted one per
+transaction, so a single bad row can't sink the rest. Rows that fail on their
+own too are counted in detection_write_failed_rows and appended as JSON lines
+to DETECTION_WRITE_DEAD_LETTER_FILE, from which they can be inspected and
+replayed; in "flush" mode their requests get the error.
+"""
+import asyncio
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import make_transient
+
+import crud
+import http_cache
+import metrics
+import models
+from config import settings
+from database import AsyncWriteSessionLocal
+
+
+class DetectionWriter:
+    def __init__(self, session_factory=AsyncWriteSessionLocal, batch_size: int = 50,
+                 flush_interval_ms: int = 50, max_queue: int = 1000):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max_queue
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, detection: models.Detection, wait: bool = True) -> models.Detection:
+        """Queue a detection for insertion, optionally waiting until its batch is committed"""
+        self.start()
+        future = asyncio.get_running_loop().create_future() if wait else None
+        # A full queue applies backpressure to the request instead of growing without bound
+        await self._queue.put((detection, future))
+        if wait:
+            await future
+        return detection
+
+    async def close(self):
+        """Flush everything still queued and stop the writer"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+        # Drain anything queued behind the stop marker
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def _commit(self, detections: List[models.Detection]):
+        columns = [column.name for column in models.Detection.__table__.columns if column.name != "id"]
+        values = [{name: getattr(detection, name) for name in columns} for detection in detections]
+        try:
+            async with self.session_factory() as db:
+                await db.run_sync(crud.add_detections, detections)
+                await db.commit()
+        except Exception:
+            # The rollback expires the rows; put their values back for the retry,
+            # without the ids from the failed flush
+            for detection, row in zip(detections, values):
+                make_transient(detection)
+                detection.id = None
+                for name, value in row.items():
+                    setattr(detection, name, value)
+            raise
+
+    async def _flush(self, batch: List[Tuple[models.Detection, asyncio.Future]]):
+        detections = [detection for detection, _ in batch]
+        delay = settings.DETECTION_WRITE_RETRY_MS / 1000
+        for attempt in range(settings.DETECTION_WRITE_RETRIES + 1):
+            try:
+                await self._commit(detections)
+                break
+            except Exception as e:
+                error = e
+            if attempt < settings.DETECTION_WRITE_RETRIES:
+                metrics.DETECTION_WRITE_RETRIES.inc()
+                await asyncio.sleep(delay)
+                delay *= 2
+        else:
+            print(f"❌ Failed to write a batch of {len(batch)} detections, writing them one by one: {error}")
+            await self._flush_rows(batch)
+            return
+
+        self.flushed_batches += 1
+        self.flushed_rows += len(batch)
+        for user_id in {detection.user_id for detection in detections}:
+            http_cache.invalidate_user(user_id)
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def _flush_rows(self, batch: List[Tuple[models.Detection, asyncio.Future]]):
+        """Insert each row in its own transaction; rows that still fail go to the dead-letter file"""
+        for detection, future in batch:
+            try:
+                await self._commit([detection])
+            except Exception as e:
+                self.failed_rows += 1
+                metrics.DETECTION_WRITE_FAILED_ROWS.inc()
+                print(f"❌ Failed to write detection of user {detection.user_id} ({detection.file_path}): {e}")
+                self._dead_letter(detection, e)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+                continue
+            self.flushed_rows += 1
+            http_cache.invalidate_user(detection.user_id)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    def _dead_letter(self, detection: models.Detection, error: Exception):
+        if not settings.DETECTION_WRITE_DEAD_LETTER_FILE:
+            return
+        row = {column.name: getattr(detection, column.name) for column in models.Detection.__table__.columns}
+        row = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+        try:
+            with open(settings.DETECTION_WRITE_DEAD_LETTER_FILE, "a") as handle:
+                handle.write(json.dumps({"error": str(error), "detection": row}) + "\n")
+        except OSError as e:
+            print(f"❌ Could not write to {settings.DETECTION_WRITE_DEAD_LETTER_FILE}: {e}")
+
+
+# Only created when write-behind is enabled; "direct" commits inside the request
+detection_writer = None
+if settings.DETECTION_WRITE_MODE != "direct":
+    detection_writer = DetectionWriter(
+        batch_size=settings.DETECTION_WRITE_BATCH_SIZE,
+        flush_interval_ms=settings.DETECTION_WRITE_FLUSH_MS,
+        max_queue=settings.DETECTION_WRITE_QUEUE_SIZE
+    )
+    metrics.QUEUE_DEPTH.labels("detection_writes").set_function(detection_writer.qsize)
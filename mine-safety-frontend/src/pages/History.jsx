@@ -1,4 +1,4 @@
-import React, { useEffect, useMemo, useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import api from '../api/axios';
 import { CheckCircle2, XCircle, Archive } from 'lucide-react';
 
@@ -15,7 +15,10 @@ const parseItems = (value) => {
 
 const History = () => {
   const [detections, setDetections] = useState([]);
+  const [totals, setTotals] = useState({ total_detections: 0, total_accepted: 0, total_denied: 0 });
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchHistory();
@@ -23,8 +26,14 @@ const History = () => {
 
   const fetchHistory = async () => {
     try {
-      const response = await api.get('/detections');
-      setDetections(response.data);
+      // Totals come from the server-side counters, not from the loaded page
+      const [historyResponse, statsResponse] = await Promise.all([
+        api.get('/detections'),
+        api.get('/dashboard'),
+      ]);
+      setDetections(historyResponse.data.items);
+      setNextCursor(historyResponse.data.next_cursor);
+      setTotals(statsResponse.data);
     } catch (error) {
       console.error('Failed to fetch history:', error);
       setDetections([]);
@@ -33,8 +42,20 @@ const History = () => {
     }
   };
 
-  const acceptedCount = useMemo(() => detections.filter((detection) => detection.is_safe).length, [detections]);
-  const deniedCount = detections.length - acceptedCount;
+  const fetchMore = async () => {
+    if (!nextCursor) return;
+
+    setLoadingMore(true);
+    try {
+      const response = await api.get('/detections', { params: { cursor: nextCursor } });
+      setDetections((current) => [...current, ...response.data.items]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Failed to fetch more history:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   if (loading) {
     return (
@@ -57,15 +78,15 @@ const History = () => {
       <section className="grid grid-cols-1 gap-4 sm:grid-cols-3">
         <article className="soft-card p-5" style={{ borderRadius: '8px' }}>
           <p className="text-sm font-semibold text-slate-500">Total Records</p>
-          <p className="mt-2 text-3xl font-bold text-slate-900">{detections.length}</p>
+          <p className="mt-2 text-3xl font-bold text-slate-900">{totals.total_detections}</p>
         </article>
         <article className="soft-card p-5" style={{ borderRadius: '8px' }}>
           <p className="text-sm font-semibold text-emerald-600">Accepted</p>
-          <p className="mt-2 text-3xl font-bold text-emerald-700">{acceptedCount}</p>
+          <p className="mt-2 text-3xl font-bold text-emerald-700">{totals.total_accepted}</p>
         </article>
         <article className="soft-card p-5" style={{ borderRadius: '8px' }}>
           <p className="text-sm font-semibold text-orange-600">Denied</p>
-          <p className="mt-2 text-3xl font-bold text-orange-700">{deniedCount}</p>
+          <p className="mt-2 text-3xl font-bold text-orange-700">{totals.total_denied}</p>
         </article>
       </section>
 
@@ -161,6 +182,18 @@ const History = () => {
                 })}
               </tbody>
             </table>
+            {nextCursor && (
+              <div className="border-t border-blue-100 px-6 py-4 text-center">
+                <button
+                  type="button"
+                  onClick={fetchMore}
+                  disabled={loadingMore}
+                  className="rounded-full bg-blue-50 px-4 py-2 text-sm font-semibold text-blue-700 hover:bg-blue-100 disabled:opacity-60"
+                >
+                  {loadingMore ? 'Loading...' : 'Load more'}
+                </button>
+              </div>
+            )}
           </div>
         )}
       </section>